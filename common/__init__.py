@@ -0,0 +1,3 @@
+'''
+Code shared by the p1, p2 and p3 programs.
+'''
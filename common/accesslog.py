@@ -0,0 +1,166 @@
+'''
+Asynchronous, batched access log for the servers.
+
+log() only appends a (time, fields) record to a bounded ring buffer, so the
+event loop never waits on stdout. Records are formatted and written in
+batches, with one write per batch, either by a background thread or by the
+owner's event loop (poll()). Timestamps are rendered at most once per second
+from a cached string.
+
+When the buffer is full, the "drop" policy discards the new record (and
+counts it) while "block" applies back-pressure until there is room.
+'''
+
+import json
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+TIME_FORMAT = "%a %b %d %H:%M:%S PDT %Y"
+FORMATS = ("text", "jsonl")
+POLICIES = ("drop", "block")
+FLUSH_MODES = ("thread", "idle")
+
+class AccessLog:
+    '''
+    Buffered access log writer.
+
+    Parameters:
+        template (str): str.format template for text records; "{time}" is the
+            formatted timestamp and every other name is a field passed to log().
+        fmt (str): "text" for the template, "jsonl" for one JSON object per line.
+        capacity (int): Maximum number of buffered records.
+        policy (str): What log() does when the buffer is full, "drop" or "block".
+        interval (float): Seconds between batch flushes.
+        threaded (bool): Flush from a background thread rather than poll().
+        stream (file): Binary stream to write to, defaults to stdout.
+    '''
+
+    def __init__(self, template, fmt="text", capacity=4096, policy="drop", interval=0.1, threaded=True, stream=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown log format {fmt!r}")
+        if policy not in POLICIES:
+            raise ValueError(f"unknown log policy {policy!r}")
+        self._template = template
+        self._jsonl = fmt == "jsonl"
+        self._capacity = capacity
+        self._block = policy == "block"
+        self.interval = interval
+        self._stream = stream if stream is not None else sys.stdout.buffer
+        self._records = deque()
+        self._last_flush = time.monotonic()
+
+        self._second = None
+        self._stamp = ""
+
+        self.written = 0
+        self.dropped = 0
+
+        self._thread = None
+        if threaded:
+            self._wake = threading.Event()
+            self._space = threading.Condition()
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+            self._thread.start()
+
+    def log(self, **fields):
+        '''
+        Buffer one record. Never blocks under the "drop" policy.
+        '''
+        if len(self._records) >= self._capacity:
+            if not self._block:
+                self.dropped += 1
+                return
+            self._wait_for_space()
+        self._records.append((time.time(), fields))
+        if self._thread is not None and len(self._records) >= self._capacity // 2:
+            self._wake.set()
+
+    def timeout(self):
+        '''
+        Return how long an event loop driving poll() may sleep before the
+        buffered records are due, or None if it need not wake up for them.
+        '''
+        if self._thread is not None or not self._records:
+            return None
+        return max(0.0, self._last_flush + self.interval - time.monotonic())
+
+    def poll(self):
+        '''
+        Flush from the owner's event loop once the interval has passed or the
+        buffer is half full. Does nothing in threaded mode.
+        '''
+        if self._thread is None and self._records:
+            if len(self._records) >= self._capacity // 2 or time.monotonic() - self._last_flush >= self.interval:
+                self.flush()
+
+    def flush(self):
+        '''
+        Format and write every buffered record as one batch.
+        '''
+        self._last_flush = time.monotonic()
+        lines = []
+        records = self._records
+        while records:
+            stamp, fields = records.popleft()
+            lines.append(self._format(stamp, fields))
+        if self._thread is not None:
+            with self._space:
+                self._space.notify_all()
+        if lines:
+            self._stream.write("".join(lines).encode())
+            self._stream.flush()
+            self.written += len(lines)
+
+    def close(self):
+        '''
+        Stop the background thread, if any, and write what is left.
+        '''
+        if self._thread is not None:
+            self._closed = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _wait_for_space(self):
+        if self._thread is None:
+            self.flush()
+            return
+        with self._space:
+            while len(self._records) >= self._capacity:
+                self._wake.set()
+                self._space.wait(self.interval)
+
+    def _format(self, stamp, fields):
+        if self._jsonl:
+            return json.dumps({"ts": round(stamp, 6), **fields}, separators=(",", ":")) + "\n"
+        second = int(stamp)
+        if second != self._second:
+            self._second = second
+            self._stamp = datetime.fromtimestamp(second).strftime(TIME_FORMAT)
+        return self._template.format(time=self._stamp, **fields) + "\n"
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+def add_arguments(parser):
+    '''
+    Register the access log options on an argparse parser.
+    '''
+    parser.add_argument("--log-format", choices=FORMATS, default="text", help="access log format (default: %(default)s)")
+    parser.add_argument("--log-buffer", type=int, default=4096, help="maximum buffered log records (default: %(default)s)")
+    parser.add_argument("--log-policy", choices=POLICIES, default="drop", help="when the log buffer is full, drop records or block (default: %(default)s)")
+    parser.add_argument("--log-flush", choices=FLUSH_MODES, default="thread", help="flush from a background thread or from the event loop (default: %(default)s)")
+
+def from_args(template, args):
+    '''
+    Create an AccessLog from options registered with add_arguments.
+    '''
+    return AccessLog(template, args.log_format, args.log_buffer, args.log_policy, threaded=args.log_flush == "thread")
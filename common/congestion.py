@@ -0,0 +1,147 @@
+'''
+Congestion control for the RDP sender.
+
+A controller owns the congestion window (cwnd, in bytes). The sender keeps
+the data in the network below min(cwnd, peer window) and reports events:
+
+    on_ack(acked, now, srtt)   newly acknowledged bytes
+    on_loss(in_flight, now)    a loss detected without a timeout
+    on_timeout(in_flight, now) the retransmission timer expired
+
+Reno follows RFC 5681 (slow start, then one MSS per RTT, halve on loss).
+CUBIC follows RFC 9438: after a loss the window grows along a cubic curve
+anchored at the window where the loss happened, independent of the RTT.
+'''
+
+import abc
+
+class CongestionControl(abc.ABC):
+    '''
+    Base class with slow start and the common loss responses. Subclasses
+    define the growth in congestion avoidance.
+
+    Parameters:
+        mss (int): Largest payload of one segment in bytes.
+        initial_window (int): Starting cwnd, defaults to RFC 5681's IW.
+    '''
+
+    name = None
+
+    def __init__(self, mss, initial_window=None):
+        self.mss = mss
+        if initial_window is None:
+            initial_window = 4 * mss if mss <= 1095 else 3 * mss if mss <= 2190 else 2 * mss
+        self.cwnd = initial_window
+        self.ssthresh = float("inf")
+
+    def on_ack(self, acked, now, srtt):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += min(acked, self.mss)
+        else:
+            self.avoid_congestion(acked, now, srtt)
+
+    @abc.abstractmethod
+    def avoid_congestion(self, acked, now, srtt):
+        '''
+        Grow cwnd for acked bytes once it has reached ssthresh.
+        '''
+
+    def on_loss(self, in_flight, now):
+        self.ssthresh = max(self.decrease(in_flight), 2 * self.mss)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, in_flight, now):
+        self.ssthresh = max(self.decrease(in_flight), 2 * self.mss)
+        self.cwnd = self.mss
+
+    def decrease(self, in_flight):
+        return in_flight / 2
+
+class Reno(CongestionControl):
+    '''
+    Additive increase of about one MSS per round trip, halving on loss.
+    '''
+
+    name = "reno"
+
+    def avoid_congestion(self, acked, now, srtt):
+        self.cwnd += self.mss * acked / self.cwnd
+
+class Cubic(CongestionControl):
+    '''
+    CUBIC window growth with the Reno-friendly region and fast convergence.
+    '''
+
+    name = "cubic"
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, mss, initial_window=None):
+        super().__init__(mss, initial_window)
+        # Window (in segments) before the last reduction, and when growth restarted
+        self._w_max = None
+        self._epoch = None
+        self._k = 0.0
+        self._w_est = 0.0
+
+    def avoid_congestion(self, acked, now, srtt):
+        segments = self.cwnd / self.mss
+        if self._epoch is None:
+            self._epoch = now
+            if self._w_max is None or self._w_max < segments:
+                self._w_max = segments
+                self._k = 0.0
+            else:
+                self._k = ((self._w_max - segments) / self.C) ** (1 / 3)
+            self._w_est = segments
+        t = now - self._epoch + (srtt or 0.0)
+        target = self.C * (t - self._k) ** 3 + self._w_max
+        target = min(max(target, segments), 1.5 * segments)
+
+        # Grow at least as fast as Reno would
+        self._w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * acked / self.cwnd
+        target = max(target, self._w_est)
+        self.cwnd += self.mss * (target - segments) / segments * acked / self.mss
+
+    def decrease(self, in_flight):
+        segments = self.cwnd / self.mss
+        # Fast convergence: release bandwidth to newer flows
+        if self._w_max is not None and segments < self._w_max:
+            self._w_max = segments * (1 + self.BETA) / 2
+        else:
+            self._w_max = segments
+        self._epoch = None
+        return max(in_flight, self.cwnd) * self.BETA
+
+class Unlimited(CongestionControl):
+    '''
+    No congestion control: the peer's window is the only limit.
+    '''
+
+    name = "none"
+
+    def __init__(self, mss, initial_window=None):
+        super().__init__(mss, float("inf"))
+
+    def on_ack(self, acked, now, srtt):
+        pass
+
+    def avoid_congestion(self, acked, now, srtt):
+        pass
+
+    def on_loss(self, in_flight, now):
+        pass
+
+    def on_timeout(self, in_flight, now):
+        pass
+
+CONTROLLERS = {cls.name: cls for cls in (Reno, Cubic, Unlimited)}
+
+def create(name, mss):
+    '''
+    Create the controller registered under name ("reno", "cubic" or "none").
+    '''
+    try:
+        return CONTROLLERS[name](mss)
+    except KeyError:
+        raise ValueError(f"unknown congestion control {name!r}") from None
@@ -0,0 +1,73 @@
+'''
+Network path emulation for the impairment emulator (p2/echo.py) and the
+p3 benchmarks.
+
+A Link is one direction of a path. It only decides what happens to each
+datagram and when it comes out the other end; the caller does the I/O and
+the waiting, with a heap of due times in echo.py and loop.call_at() in the
+asyncio benchmarks. The impairments apply in this order: random loss, a
+bandwidth cap behind a drop-tail queue, a fixed delay with jitter, extra
+delay for a share of the datagrams so later ones overtake them (reordering),
+and duplication.
+'''
+
+class Link:
+    '''
+    One direction of the emulated path.
+
+    Parameters:
+        rng (Random): Source of the loss, jitter, reorder and duplicate draws.
+        loss (float): Probability that a datagram is lost.
+        rate (float): Bytes per second, 0 for no cap.
+        queue (int): Drop-tail queue in front of the cap, in bytes.
+        delay (float): One-way delay in seconds.
+        jitter (float): Uniform variation of the delay, +/- seconds.
+        reorder (float): Probability that a datagram is held back.
+        reorder_delay (float): Extra delay of a held back datagram in seconds.
+        duplicate (float): Probability that a datagram is delivered twice.
+    '''
+
+    def __init__(self, rng, loss=0, rate=0, queue=64 * 1024, delay=0, jitter=0, reorder=0, reorder_delay=0.01, duplicate=0):
+        self._rng = rng
+        self._loss = loss
+        self._rate = rate
+        self._queue = queue
+        self._delay = delay
+        self._jitter = jitter
+        self._reorder = reorder
+        self._reorder_delay = reorder_delay
+        self._duplicate = duplicate
+        # When the link will have transmitted everything queued so far
+        self._free = 0.0
+        self.counters = dict.fromkeys(("received", "lost", "dropped", "reordered", "duplicated", "delivered"), 0)
+
+    def send(self, data, now):
+        '''
+        Returns the times at which data leaves the link, one per copy, or
+        an empty list if it is lost
+        '''
+        counters = self.counters
+        counters["received"] += 1
+        rng = self._rng
+        if self._loss and rng.random() < self._loss:
+            counters["lost"] += 1
+            return []
+        departure = now
+        if self._rate:
+            start = max(now, self._free)
+            if (start - now) * self._rate + len(data) > self._queue:
+                counters["dropped"] += 1
+                return []
+            self._free = departure = start + len(data) / self._rate
+        departure += self._delay
+        if self._jitter:
+            departure += rng.uniform(-self._jitter, self._jitter)
+        if self._reorder and rng.random() < self._reorder:
+            counters["reordered"] += 1
+            departure += self._reorder_delay
+        copies = [max(now, departure)]
+        if self._duplicate and rng.random() < self._duplicate:
+            counters["duplicated"] += 1
+            copies.append(copies[0])
+        counters["delivered"] += len(copies)
+        return copies
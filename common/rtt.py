@@ -0,0 +1,65 @@
+'''
+Round-trip time estimation for the RDP retransmission timers (RFC 6298).
+
+The first measurement R sets SRTT = R and RTTVAR = R / 2. Each later one
+updates
+
+    RTTVAR = (1 - beta) * RTTVAR + beta * |SRTT - R|
+    SRTT = (1 - alpha) * SRTT + alpha * R
+
+and RTO = SRTT + max(G, K * RTTVAR), clamped to [min_rto, max_rto].
+
+Callers follow Karn's algorithm: only segments that were never retransmitted
+are sampled, and a timeout doubles the RTO (backoff()) until the next valid
+sample recomputes it.
+'''
+
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+class RttEstimator:
+    '''
+    Smoothed RTT and retransmission timeout of one connection.
+
+    Parameters:
+        initial_rto (float): RTO in seconds before the first sample.
+        min_rto (float): Lower bound on the RTO. RFC 6298 recommends one
+            second; the default is lower so a loss on a fast link is not
+            paid for with a full second of idle time.
+        max_rto (float): Upper bound on the RTO, also capping the backoff.
+        granularity (float): Clock granularity G in seconds.
+    '''
+
+    def __init__(self, initial_rto=1.0, min_rto=0.2, max_rto=60.0, granularity=0.001):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.granularity = granularity
+        self.samples = 0
+        self.backoffs = 0
+
+    def sample(self, rtt):
+        '''
+        Update the estimate with the RTT of a segment sent exactly once.
+        '''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.samples += 1
+        self.rto = self._clamp(self.srtt + max(self.granularity, K * self.rttvar))
+
+    def backoff(self):
+        '''
+        Double the RTO after a retransmission timeout.
+        '''
+        self.backoffs += 1
+        self.rto = self._clamp(self.rto * 2)
+
+    def _clamp(self, rto):
+        return min(self.max_rto, max(self.min_rto, rto))
@@ -0,0 +1,12 @@
+'''
+Reliable datagram transport shared by the programs.
+
+    rdp.py       the RDP engine, a state machine without I/O
+    backend.py   datagram backends: a UDP socket, or an in-process network,
+                 and a wrapper that traces every packet
+    endpoint.py  socket-like connect()/listen()/accept()/send()/recv()
+'''
+
+from .backend import LoopbackNetwork, TracingBackend, UdpBackend
+from .endpoint import Connection, Endpoint, connect, listen
+from .rdp import CRLF_CODEC, RDP, TEXT_CODEC
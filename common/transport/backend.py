@@ -0,0 +1,199 @@
+'''
+Datagram backends an Endpoint sends and receives through.
+
+A backend has an address, sendto() to queue a datagram, recv_batch() to take
+every datagram that has arrived, flush() to push the queue out and wait()
+to block until there may be something to do.
+
+UdpBackend is a real UDP socket. LoopbackNetwork connects LoopbackBackends
+inside one process: sendto() appends straight to the inbox of the backend
+with the destination address, and waiting on any of them runs every
+endpoint on the network, so one thread can drive both ends of a transfer
+with no system calls and no network.
+'''
+
+import itertools
+import select
+import socket
+import time
+from collections import deque
+
+from ..batchio import BatchedSocket
+
+class UdpBackend:
+    '''
+    A non-blocking UDP socket, read and written in batches.
+
+    Parameters:
+        address (tuple): Local (host, port) to bind, port 0 for any.
+        reuse_port (bool): Set SO_REUSEPORT, so several processes can each
+            bind a socket to the same address.
+    '''
+
+    def __init__(self, address=("0.0.0.0", 0), reuse_port=False):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        self._socket = BatchedSocket(sock)
+        self.address = sock.getsockname()
+        self.endpoint = None
+
+    def sendto(self, data, address):
+        self._socket.send(data, address)
+
+    def recv_batch(self):
+        return self._socket.recv_batch()
+
+    def flush(self):
+        '''
+        Write the queued datagrams. Returns False if the socket filled up;
+        the rest goes out with a later flush().
+        '''
+        return self._socket.flush()
+
+    def pending(self):
+        return self._socket.pending()
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def wait(self, timeout):
+        '''
+        Block until a datagram arrives, queued datagrams can be written or
+        timeout seconds pass (forever if None).
+        '''
+        fd = self._socket.fileno()
+        select.select([fd], [fd] if self._socket.pending() else [], [], timeout)
+
+    def close(self):
+        self._socket.sock.close()
+
+class TracingBackend:
+    '''
+    Wraps another backend and calls trace(packet, sent) for every datagram
+    it sends (sent=True) or receives, e.g. to log each packet.
+    '''
+
+    def __init__(self, backend, trace):
+        self._backend = backend
+        self._trace = trace
+        self.address = backend.address
+
+    @property
+    def endpoint(self):
+        return self._backend.endpoint
+
+    @endpoint.setter
+    def endpoint(self, endpoint):
+        # A LoopbackNetwork drives the endpoint through the wrapped backend
+        self._backend.endpoint = endpoint
+
+    def sendto(self, data, address):
+        self._trace(data, True)
+        self._backend.sendto(data, address)
+
+    def recv_batch(self):
+        batch = self._backend.recv_batch()
+        for data, _ in batch:
+            self._trace(data, False)
+        return batch
+
+    def flush(self):
+        return self._backend.flush()
+
+    def fileno(self):
+        return self._backend.fileno()
+
+    def wait(self, timeout):
+        self._backend.wait(timeout)
+
+    def close(self):
+        self._backend.close()
+
+class LoopbackBackend:
+    '''
+    One address on a LoopbackNetwork. Create it with LoopbackNetwork.backend().
+    '''
+
+    def __init__(self, network, address):
+        self._network = network
+        self.address = address
+        self.endpoint = None
+        self.inbox = deque()
+
+    def sendto(self, data, address):
+        self._network.deliver(bytes(data), self.address, address)
+
+    def recv_batch(self):
+        batch = list(self.inbox)
+        self.inbox.clear()
+        return batch
+
+    def flush(self):
+        pass
+
+    def wait(self, timeout):
+        self._network.run(timeout)
+
+    def close(self):
+        self._network.remove(self)
+
+class LoopbackNetwork:
+    '''
+    An in-process datagram network without loss, delay or reordering.
+
+    Addresses are ("loopback", n) pairs. Datagrams to an address nobody has
+    are dropped, like UDP to a closed port.
+    '''
+
+    def __init__(self):
+        self._backends = {}
+        self._ports = itertools.count(1)
+        self.delivered = 0
+
+    def backend(self, address=None):
+        '''
+        Return a backend with a new address on this network, or with the
+        given one if it is free, like binding a port that was used before.
+        '''
+        if address is None:
+            address = ("loopback", next(self._ports))
+        elif address in self._backends:
+            raise OSError(f"address {address} is in use")
+        backend = LoopbackBackend(self, address)
+        self._backends[backend.address] = backend
+        return backend
+
+    def remove(self, backend):
+        self._backends.pop(backend.address, None)
+
+    def deliver(self, data, source, destination):
+        backend = self._backends.get(destination)
+        if backend is not None:
+            backend.inbox.append((data, source))
+            self.delivered += 1
+
+    def run(self, timeout=None):
+        '''
+        Run every endpoint until no datagram is left in transit. If none was
+        in transit to begin with, first sleep until the earliest
+        retransmission timer on the network or timeout, whichever is sooner.
+        '''
+        endpoints = [backend.endpoint for backend in self._backends.values() if backend.endpoint is not None]
+        if not self._in_transit():
+            delays = [delay for delay in (endpoint.next_timeout() for endpoint in endpoints) if delay is not None]
+            if timeout is not None:
+                delays.append(timeout)
+            if not delays:
+                raise RuntimeError("loopback network is idle: nothing is in transit and no timer is armed")
+            time.sleep(max(0.0, min(delays)))
+        for endpoint in endpoints:
+            endpoint.process()
+        while self._in_transit():
+            for backend in list(self._backends.values()):
+                if backend.inbox and backend.endpoint is not None:
+                    backend.endpoint.process()
+
+    def _in_transit(self):
+        return any(backend.inbox and backend.endpoint is not None for backend in self._backends.values())
@@ -0,0 +1,403 @@
+'''
+Socket-like connections over the RDP engine.
+
+An Endpoint owns one datagram backend and runs one RDP state machine per
+peer address on it. connect() makes an endpoint with a single outgoing
+connection; listen() makes one that accepts a connection from every new
+peer. Calls that wait (accept, recv, wait_closed) drive the endpoint, and on
+a loopback network every other endpoint too, until they can return.
+
+    server = listen(("127.0.0.1", 9000))
+    client = connect(("127.0.0.1", 9000))
+    client.send(b"GET / HTTP/1.0\r\n\r\n")
+    request = server.accept().recv()
+
+An event-driven server (see p3/sor-server.py) instead passes a handler,
+calls process() whenever the backend is readable or next_timeout() runs
+out, and answers from the handler without ever blocking.
+'''
+
+import heapq
+import itertools
+import time
+import traceback
+from collections import deque
+
+from .backend import UdpBackend
+from .rdp import RDP, TEXT_CODEC, decode_packet
+
+# Seconds a closed connection is kept around to answer a retransmitted FIN
+CLOSE_LINGER = 10.0
+
+class Connection:
+    '''
+    One RDP connection to a peer. Create it with connect() or accept it from
+    a listening Endpoint.
+    '''
+
+    def __init__(self, endpoint, address, rdp):
+        self._endpoint = endpoint
+        self.address = address
+        self.rdp = rdp
+        self._received = bytearray()
+        # Deadline of this connection's entry in the endpoint's timer heap
+        self._timer = None
+        # Retransmissions already added to the endpoint's counters
+        self._retransmits = 0
+        # Free for the application, e.g. a server's per-connection state
+        self.context = None
+
+    def send(self, data):
+        '''
+        Queue data after everything sent so far and send what the windows allow.
+        '''
+        self.rdp.add_data(data)
+        self._endpoint.flush(self)
+
+    def sendfile(self, file, offset=0, length=None):
+        '''
+        Queue a region of an open binary file; it is read as it is sent.
+        '''
+        self.rdp.add_file(file, offset, length)
+        self._endpoint.flush(self)
+
+    def recv(self, bufsize=65536, timeout=None):
+        '''
+        Return up to bufsize received bytes, waiting for some if there are
+        none. Returns b"" once the peer has closed and everything it sent
+        was read.
+
+        Raises:
+            TimeoutError: Nothing arrived within timeout seconds.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._received and not self.rdp.is_peer_closed() and not self.rdp.is_closed():
+            self._endpoint.poll(_remaining(deadline))
+        return self.recv_nowait(bufsize)
+
+    def recv_nowait(self, bufsize=65536):
+        '''
+        Return up to bufsize bytes that were already received, b"" if there
+        are none. Does not wait, so it is safe to call from a handler.
+        '''
+        data = bytes(self._received[:bufsize])
+        del self._received[:bufsize]
+        return data
+
+    def close(self):
+        '''
+        Send FIN after the data queued so far. Does not wait; see wait_closed().
+        '''
+        self.rdp.close()
+        self._endpoint.flush(self)
+
+    def wait_closed(self, timeout=None):
+        '''
+        Wait until both sides have closed and their FINs are acknowledged.
+
+        Raises:
+            TimeoutError: The connection is still open after timeout seconds.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.rdp.is_closed():
+            self._endpoint.poll(_remaining(deadline))
+
+    def reset(self):
+        '''
+        Send RST and close at once, dropping whatever was not sent yet.
+        '''
+        self.rdp.reset()
+        self._endpoint.flush(self)
+
+    @property
+    def closed(self):
+        return self.rdp.is_closed()
+
+    @property
+    def peer_closed(self):
+        return self.rdp.is_peer_closed()
+
+    def _receive(self, data):
+        delivered = self.rdp.receive_packet(data)
+        if delivered:
+            self._received += delivered
+
+class Endpoint:
+    '''
+    A datagram backend and the connections multiplexed on it by peer address.
+
+    Parameters:
+        backend: UdpBackend, LoopbackBackend or anything with their methods.
+        listening (bool): Accept connections from new peers.
+        window (int): Receive window of each connection in bytes.
+        payload_length (int): Largest payload of one segment.
+        binary (bool): Offer (and accept) the binary header.
+        congestion_control (str): "reno", "cubic" or "none".
+        sack (bool): Offer (and accept) selective acknowledgements.
+        text_codec: Encoding of text packets, TEXT_CODEC or CRLF_CODEC.
+        handler (callable): Called as handler(connection) during process()
+            for every connection that datagrams arrived for, after they
+            were taken in and before anything is sent, so a server can
+            queue its answer in the same pass. Connections accepted by an
+            endpoint with a handler are not queued for accept(). If the
+            handler raises, the traceback is printed and that connection
+            is reset.
+
+    Retransmission timers live in a heap ordered by deadline, so process()
+    and next_timeout() only look at the connections whose timers are due
+    rather than at every open connection. An entry is only replaced when a
+    connection's deadline moves earlier; one that moved later is found at
+    the top of the heap and pushed again with the new deadline.
+
+    counters adds up the datagrams and bytes of every connection.
+    '''
+
+    def __init__(self, backend, listening=False, window=65536, payload_length=1024, binary=True, congestion_control="reno", sack=True, text_codec=TEXT_CODEC, handler=None):
+        self._backend = backend
+        backend.endpoint = self
+        self._listening = listening
+        self._options = (window, payload_length, binary, congestion_control, sack, text_codec)
+        self._handler = handler
+        # Key is the peer address, value is its Connection. Closed ones stay
+        # for CLOSE_LINGER seconds but leave _open, the ones with timers
+        self._connections = {}
+        self._open = {}
+        # (time closed, Connection) in the order connections closed
+        self._lingering = deque()
+        self._accept_queue = deque()
+        # (deadline, order, Connection), see _next_timer()
+        self._timers = []
+        self._order = itertools.count()
+        # Connections to send for at the end of the process() running now,
+        # or None outside process()
+        self._touched = None
+        self.counters = {
+            "datagrams_received": 0,
+            "datagrams_sent": 0,
+            "bytes_sent": 0,
+            "retransmits": 0,
+            # Datagrams dropped because they did not decode
+            "malformed": 0,
+            # Connections reset because the handler raised
+            "handler_errors": 0,
+        }
+
+    @property
+    def address(self):
+        return self._backend.address
+
+    def open(self, address, data=b""):
+        '''
+        Start a connection to address; the SYN goes out right away, carrying
+        the first segment of data if any is given.
+        '''
+        connection = self._connections[address] = self._open[address] = Connection(self, address, RDP(*self._options))
+        if data:
+            connection.rdp.add_data(data)
+        self.flush(connection)
+        return connection
+
+    def accept(self, timeout=None):
+        '''
+        Return the next connection opened by a peer, waiting for one.
+
+        Raises:
+            TimeoutError: No peer connected within timeout seconds.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._accept_queue:
+            self.poll(_remaining(deadline))
+        return self._accept_queue.popleft()
+
+    def poll(self, timeout=None):
+        '''
+        Wait until a datagram may have arrived, a retransmission timer is due
+        or timeout seconds pass, then process whatever there is.
+        '''
+        delay = self.next_timeout()
+        if timeout is not None:
+            delay = timeout if delay is None else min(delay, timeout)
+        self._backend.wait(delay)
+        self.process()
+
+    def process(self):
+        '''
+        Hand every datagram that arrived to its connection, fire due timers
+        and send what the connections queued, without waiting.
+        '''
+        touched = self._touched = {}
+        batch = self._backend.recv_batch()
+        self.counters["datagrams_received"] += len(batch)
+        for data, address in batch:
+            connection = self._connections.get(address)
+            try:
+                if connection is None or self._reopens(connection, data):
+                    # Only a SYN opens a connection, so stray datagrams
+                    # leave nothing behind
+                    if not self._listening or "SYN" not in decode_packet(data)[0]:
+                        continue
+                    connection = self._connections[address] = self._open[address] = Connection(self, address, RDP(*self._options))
+                    if self._handler is None:
+                        self._accept_queue.append(connection)
+                connection._receive(data)
+            except ValueError:
+                # Not an RDP packet; drop it and carry on with the batch
+                self.counters["malformed"] += 1
+                continue
+            touched[address] = connection
+        if self._handler is not None:
+            for connection in list(touched.values()):
+                try:
+                    self._handler(connection)
+                except Exception:
+                    # Only this connection is lost, not the rest of the batch
+                    traceback.print_exc()
+                    self.counters["handler_errors"] += 1
+                    connection.rdp.reset()
+        now = time.monotonic()
+        deadline = self._next_timer()
+        while deadline is not None and deadline <= now:
+            _, _, connection = heapq.heappop(self._timers)
+            connection._timer = None
+            connection.rdp.timeout()
+            touched[connection.address] = connection
+            deadline = self._next_timer()
+        self._touched = None
+        for connection in touched.values():
+            connection.rdp.send_packet()
+            self._drain(connection)
+            self._arm(connection)
+        self._backend.flush()
+        self._retire(touched)
+
+    def _reopens(self, connection, data):
+        '''
+        Whether data is a SYN starting a new connection from the address of
+        one that closed, e.g. a client whose port was handed out again.
+        '''
+        return self._listening and connection.address not in self._open and "SYN" in decode_packet(data)[0]
+
+    def _retire(self, touched):
+        '''
+        Move connections that just closed out of _open, and forget those
+        closed longer than CLOSE_LINGER.
+        '''
+        now = time.monotonic()
+        for address, connection in touched.items():
+            if connection.rdp.is_closed() and self._open.get(address) is connection:
+                del self._open[address]
+                self._lingering.append((now, connection))
+        lingering = self._lingering
+        while lingering and now - lingering[0][0] > CLOSE_LINGER:
+            _, connection = lingering.popleft()
+            if self._connections.get(connection.address) is connection:
+                del self._connections[connection.address]
+
+    def flush(self, connection):
+        '''
+        Send whatever the connection has room for now. Inside process() it
+        is only noted, and sent with everything else at the end.
+        '''
+        if self._touched is not None:
+            self._touched[connection.address] = connection
+            return
+        connection.rdp.send_packet()
+        self._drain(connection)
+        self._arm(connection)
+        self._backend.flush()
+        self._retire({connection.address: connection})
+
+    def next_timeout(self):
+        '''
+        Return the seconds until the earliest retransmission timer, or None.
+        '''
+        deadline = self._next_timer()
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _arm(self, connection):
+        '''
+        Make sure the timer heap has an entry for the connection no later
+        than its retransmission deadline.
+        '''
+        deadline = connection.rdp.deadline()
+        if deadline is not None and (connection._timer is None or deadline < connection._timer):
+            connection._timer = deadline
+            heapq.heappush(self._timers, (deadline, next(self._order), connection))
+
+    def _next_timer(self):
+        '''
+        Return the earliest retransmission deadline, after dropping the
+        entries at the top of the heap that are out of date: replaced by an
+        earlier entry, of a connection that closed or disarmed its timer,
+        or whose deadline moved later (that one is pushed again).
+        '''
+        timers = self._timers
+        while timers:
+            deadline, _, connection = timers[0]
+            if connection._timer != deadline:
+                heapq.heappop(timers)
+                continue
+            actual = connection.rdp.deadline() if self._open.get(connection.address) is connection else None
+            if actual == deadline:
+                return deadline
+            heapq.heappop(timers)
+            connection._timer = None
+            if actual is not None:
+                self._arm(connection)
+        return None
+
+    def close(self):
+        '''
+        Drop every connection without waiting and release the backend.
+        '''
+        for connection in self._connections.values():
+            connection.rdp.discard()
+        self._connections.clear()
+        self._open.clear()
+        self._lingering.clear()
+        self._timers.clear()
+        self._backend.endpoint = None
+        self._backend.close()
+
+    def _drain(self, connection):
+        rdp = connection.rdp
+        sendto = self._backend.sendto
+        sent = size = 0
+        packet = rdp.pop_queue()
+        while packet is not None:
+            if packet:
+                sendto(packet, connection.address)
+                sent += 1
+                size += len(packet)
+            packet = rdp.pop_queue()
+        counters = self.counters
+        counters["datagrams_sent"] += sent
+        counters["bytes_sent"] += size
+        retransmits = rdp.counters["retransmits"]
+        if retransmits != connection._retransmits:
+            counters["retransmits"] += retransmits - connection._retransmits
+            connection._retransmits = retransmits
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("timed out")
+    return remaining
+
+def listen(address=("0.0.0.0", 0), backend=None, **options):
+    '''
+    Return an Endpoint accepting connections on address, or on backend if
+    one is given (e.g. LoopbackNetwork().backend()).
+    '''
+    return Endpoint(backend if backend is not None else UdpBackend(address), listening=True, **options)
+
+def connect(address, backend=None, **options):
+    '''
+    Open a connection to address from a new endpoint on backend (a UDP
+    socket on any port by default) and return it without waiting for the
+    handshake; data sent meanwhile follows the SYN.
+    '''
+    endpoint = Endpoint(backend if backend is not None else UdpBackend(), **options)
+    return endpoint.open(address)
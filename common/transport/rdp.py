@@ -0,0 +1,916 @@
+'''
+The RDP engine: one end of a connection as a state machine that turns
+datagrams from the peer into delivered bytes and queued datagrams to send.
+It does no I/O itself; see endpoint.py for the socket-like front end.
+'''
+
+import os
+import struct
+import time
+from collections import deque
+from enum import Enum
+
+from .. import congestion
+from ..rtt import RttEstimator
+
+# Command flags of the binary header, in the order they are listed when decoded
+COMMAND_BITS = {"SYN": 1, "DAT": 2, "FIN": 4, "ACK": 8, "RST": 16, "BIN": 32, "SACK": 64}
+# First byte of every binary packet; a text packet starts with a command name
+BINARY_MAGIC = 0xB5
+BINARY_VERSION = 2
+# Binary encoding of -1, the "no acknowledgement yet" value, in the unsigned
+# 64-bit sequence and acknowledgement fields
+NO_NUMBER = 2 ** 64 - 1
+# Most selective acknowledgement blocks carried by one packet
+MAX_SACK_BLOCKS = 4
+# A segment counts as lost once this many duplicate ACKs arrived for it, or
+# this many segments after it were SACKed
+DUP_THRESHOLD = 3
+# Consecutive retransmission timeouts without progress after which the peer
+# is taken to be gone and the connection is reset
+MAX_TIMEOUTS = 6
+# Decoded command lists for every flag combination, indexed by the flag byte
+COMMANDS_BY_BITS = [tuple(name for name, bit in COMMAND_BITS.items() if bits & bit) for bits in range(128)]
+
+class TextCodec:
+    '''
+    The original human readable wire format:
+
+        SYN|DAT|ACK
+        Sequence: #
+        Length: #
+        Acknowledgement: #
+        Window: #
+        Sack: #-# #-#
+
+        PAYLOAD
+
+    The Sack line is only present when there are blocks to report.
+
+    Lines end with newline, "\n" by default or "\r\n" for the p2 programs.
+    Decoding takes either, whichever the packet's first line ends with.
+    '''
+
+    def __init__(self, newline="\n"):
+        self._newline = newline
+
+    def encode(self, commands, seq_num, ack_num, window, payload, sack=()):
+        newline = self._newline
+        header = (
+            "|".join(commands) + newline
+            + "Sequence: " + str(seq_num) + newline
+            + "Length: " + str(len(payload)) + newline
+            + "Acknowledgement: " + str(ack_num) + newline
+            + "Window: " + str(window) + newline
+        )
+        if sack:
+            header += "Sack: " + " ".join(f"{start}-{end}" for start, end in sack) + newline
+        header = header.encode()
+        return header + newline.encode() + payload if payload else header
+
+    def decode(self, packet):
+        packet = bytes(packet)
+        first = packet.find(b"\n")
+        newline = b"\r\n" if first > 0 and packet[first - 1] == 13 else b"\n"
+        lines = packet.split(newline, 5)
+        commands = lines[0].decode().split("|")
+        seq_num = int(lines[1].split(b": ")[1])
+        length = int(lines[2].split(b": ")[1])
+        ack_num = int(lines[3].split(b": ")[1])
+        window = int(lines[4].split(b": ")[1])
+        rest = lines[5] if len(lines) > 5 else b""
+        sack = []
+        if rest.startswith(b"Sack: "):
+            line, _, rest = rest.partition(newline)
+            for block in line[6:].split():
+                start, _, end = block.partition(b"-")
+                sack.append((int(start), int(end)))
+        # Everything after the blank line, byte for byte
+        payload = memoryview(rest)[len(newline):]
+        return commands, seq_num, length, ack_num, window, payload, sack
+
+class BinaryCodec:
+    '''
+    Fixed 28 byte header followed by the raw payload:
+
+        magic (B) version (B) commands (B) sack blocks (B)
+        sequence (Q) length (I) acknowledgement (Q) window (I)
+        [start (Q) end (Q)] * sack blocks
+
+    All fields are in network byte order. Sequence numbers count bytes from
+    zero and are never wrapped, so they are 64 bits wide; a 32-bit field
+    would overflow partway through a 2 GiB body. -1 is sent as NO_NUMBER.
+    Decoding never copies the payload, it is returned as a slice of a
+    memoryview over the datagram.
+    '''
+
+    HEADER = struct.Struct("!BBBBQIQI")
+    SACK_BLOCK = struct.Struct("!QQ")
+
+    def encode(self, commands, seq_num, ack_num, window, payload, sack=()):
+        bits = 0
+        for command in commands:
+            bits |= COMMAND_BITS[command]
+        header = self.HEADER.pack(
+            BINARY_MAGIC, BINARY_VERSION, bits, len(sack),
+            NO_NUMBER if seq_num == -1 else seq_num, len(payload),
+            NO_NUMBER if ack_num == -1 else ack_num, window,
+        )
+        if sack:
+            header += b"".join(self.SACK_BLOCK.pack(start, end) for start, end in sack)
+        return header + payload
+
+    def decode(self, packet):
+        view = memoryview(packet)
+        _, version, bits, blocks, seq_num, length, ack_num, window = self.HEADER.unpack_from(view)
+        if version != BINARY_VERSION:
+            raise ValueError(f"unsupported RDP binary version {version}")
+        if seq_num == NO_NUMBER:
+            seq_num = -1
+        if ack_num == NO_NUMBER:
+            ack_num = -1
+        commands = COMMANDS_BY_BITS[bits & 127]
+        offset = self.HEADER.size
+        sack = []
+        for _ in range(blocks):
+            sack.append(self.SACK_BLOCK.unpack_from(view, offset))
+            offset += self.SACK_BLOCK.size
+        payload = view[offset:offset + length]
+        return commands, seq_num, length, ack_num, window, payload, sack
+
+TEXT_CODEC = TextCodec()
+CRLF_CODEC = TextCodec("\r\n")
+BINARY_CODEC = BinaryCodec()
+
+def decode_packet(packet):
+    '''
+    Decode a datagram in either wire format, recognised by its first byte.
+
+    Raises:
+        ValueError: The datagram is not an RDP packet.
+    '''
+    codec = BINARY_CODEC if packet[:1] == bytes([BINARY_MAGIC]) else TEXT_CODEC
+    try:
+        return codec.decode(packet)
+    except (IndexError, struct.error) as exc:
+        raise ValueError(f"malformed RDP packet: {exc}") from None
+
+class State(Enum):
+    CLOSED = 0
+    SYN_SENT = 1
+    SYN_RCVD = 2
+    CONNECTED = 3
+    FIN_SENT = 4
+    FIN_RCVD = 5
+    CON_FIN_RCVD = 6
+
+class BytesSource:
+    '''
+    Data already in memory, handed out from an offset without re-slicing.
+    '''
+
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._offset = 0
+
+    def remaining(self):
+        return len(self._data) - self._offset
+
+    def read(self, size):
+        chunk = bytes(self._data[self._offset:self._offset + size])
+        self._offset += len(chunk)
+        return chunk
+
+    def close(self):
+        self._offset = len(self._data)
+
+class FileSource:
+    '''
+    A region of an open binary file, read with os.pread() one segment at a
+    time as the window opens. The file is closed once it has been read.
+
+    Parameters:
+        file (file): File object opened for reading in binary mode.
+        offset (int): Where the region starts.
+        length (int): Bytes in the region, defaults to the rest of the file.
+    '''
+
+    def __init__(self, file, offset=0, length=None):
+        self._file = file
+        self._fd = file.fileno()
+        self._offset = offset
+        self._end = os.fstat(self._fd).st_size if length is None else offset + length
+
+    def remaining(self):
+        return self._end - self._offset
+
+    def read(self, size):
+        size = min(size, self.remaining())
+        chunk = os.pread(self._fd, size, self._offset)
+        self._offset += len(chunk)
+        if len(chunk) < size:
+            # The file shrank underneath us; end the region where it ends now
+            self._end = self._offset
+        if not self.remaining():
+            self.close()
+        return chunk
+
+    def close(self):
+        self._end = self._offset
+        self._file.close()
+
+class SendBuffer:
+    '''
+    Application data not sent yet, as a queue of sources read in order.
+
+    Only what a segment needs is ever read, so memory per connection is bounded
+    by the window (the payloads of the segments in flight) rather than by the
+    size of what is being sent.
+    '''
+
+    def __init__(self):
+        self._sources = deque()
+
+    def __len__(self):
+        return sum(source.remaining() for source in self._sources)
+
+    def append(self, source):
+        if source.remaining():
+            self._sources.append(source)
+        else:
+            source.close()
+
+    def read(self, size):
+        '''
+        Return up to size bytes from the front of the buffer.
+        '''
+        chunks = []
+        sources = self._sources
+        while size and sources:
+            chunk = sources[0].read(size)
+            chunks.append(chunk)
+            size -= len(chunk)
+            if not sources[0].remaining():
+                sources.popleft().close()
+        return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+    def close(self):
+        while self._sources:
+            self._sources.popleft().close()
+
+class ReceiveBuffer:
+    '''
+    Reassembly buffer for segments that arrive ahead of a gap.
+
+    Payloads are copied into a preallocated ring the size of the receive
+    window, at the position of their sequence number, and the received ranges
+    are kept as a short sorted list. Once the gap before them fills, pop()
+    hands out the contiguous run in one piece.
+    '''
+
+    def __init__(self, size):
+        self._ring = bytearray(size)
+        self._size = size
+        # Sorted, disjoint [start, end) sequence ranges held in the ring
+        self._ranges = []
+
+    def __len__(self):
+        return sum(end - start for start, end in self._ranges)
+
+    def ranges(self):
+        return list(self._ranges)
+
+    def add(self, start, data, next_seq):
+        '''
+        Store data that begins at sequence number start, beyond next_seq. Data
+        past the window is dropped.
+        '''
+        end = min(start + len(data), next_seq + self._size)
+        if end <= start:
+            return
+        data = data[:end - start]
+        offset = start % self._size
+        first = min(len(data), self._size - offset)
+        self._ring[offset:offset + first] = data[:first]
+        self._ring[:len(data) - first] = data[first:]
+
+        ranges = self._ranges
+        index = 0
+        while index < len(ranges) and ranges[index][1] < start:
+            index += 1
+        while index < len(ranges) and ranges[index][0] <= end:
+            start = min(start, ranges[index][0])
+            end = max(end, ranges[index][1])
+            del ranges[index]
+        ranges.insert(index, (start, end))
+
+    def pop(self, next_seq):
+        '''
+        Remove and return the stored data that continues from next_seq, or
+        b"" if the gap there is still open.
+        '''
+        ranges = self._ranges
+        while ranges and ranges[0][1] <= next_seq:
+            del ranges[0]
+        if not ranges or ranges[0][0] > next_seq:
+            return b""
+        end = ranges.pop(0)[1]
+        offset = next_seq % self._size
+        length = end - next_seq
+        if offset + length <= self._size:
+            return bytes(self._ring[offset:offset + length])
+        return bytes(self._ring[offset:]) + bytes(self._ring[:offset + length - self._size])
+
+class Segment:
+    '''
+    A sent segment waiting to be acknowledged.
+    '''
+
+    def __init__(self, seq, end, commands, payload):
+        self.seq = seq
+        # Sequence number just past this segment, i.e. the ACK that frees it
+        self.end = end
+        self.commands = commands
+        self.payload = payload
+        # The payload's sequence range, which is what SACK blocks describe
+        self.data_start = seq + ("SYN" in commands)
+        self.data_end = self.data_start + len(payload)
+        # Time of the first transmission, for RTT samples
+        self.sent = None
+        self.retransmitted = False
+        self.sacked = False
+        self.lost = False
+
+class RDP:
+    '''
+    One end of a reliable data protocol connection
+
+    Sequence numbers count payload bytes, and SYN and FIN take up one number
+    each. Every segment carries ACK with the next sequence number expected
+    from the peer (-1 until the peer's SYN has arrived).
+
+    Segments that arrive ahead of a gap are kept in a ReceiveBuffer and handed
+    to the application together with the segment that fills the gap.
+
+    The sender keeps its unacknowledged segments in a deque ordered by
+    sequence number and keeps sending new ones while the bytes in flight fit
+    both the window advertised by the peer and the congestion window (see
+    common/congestion.py). A cumulative ACK frees segments from the front of
+    the deque in O(acked). When the retransmission timer of the oldest
+    segment expires, everything in flight is sent again (Go-Back-N), paced by
+    the congestion window that the timeout shrank. There is one timer per
+    connection, not one per segment (RFC 6298, section 5): it is restarted
+    by every ACK that frees a segment, so it always belongs to the oldest
+    segment, whose timer would have been the first to expire anyway. The timeout adapts to the
+    measured round-trip time (see common/rtt.py). After MAX_TIMEOUTS timeouts
+    in a row without an ACK that moves the window, the peer is given up on:
+    the connection sends RST and closes.
+
+    Losses are normally repaired without waiting for the timer. The third
+    duplicate ACK resends the oldest segment (fast retransmit) and starts
+    fast recovery: cwnd is reduced once, inflated by one segment for each
+    further duplicate, and every partial ACK resends the next hole until
+    everything sent before the loss is acknowledged (NewReno).
+
+    If both SYNs carry the SACK flag, every ACK also reports the ranges held
+    in the peer's ReceiveBuffer. The sender marks those segments, leaves them
+    out when going back after a timeout, and resends a segment as soon as
+    DUP_THRESHOLD segments after it were SACKed. The SACKed bytes leave the
+    pipe estimate, which replaces the window inflation.
+
+    counters records per connection how much was sent and how losses were
+    repaired.
+
+    receive_packet() only updates state; call send_packet() afterwards to send
+    new data and any acknowledgement that is owed, then drain pop_queue().
+
+    With binary=True the connection offers (or accepts) the binary header:
+    the SYN carries a BIN flag, and once both SYNs have carried it every
+    later packet uses BinaryCodec. SYNs themselves are always text so a peer
+    without binary support still understands them. Text packets, SYNs
+    included, are encoded with text_codec, TEXT_CODEC or CRLF_CODEC.
+    '''
+
+    def __init__(self, window, payload_length, binary=False, congestion_control="reno", sack=True, text_codec=TEXT_CODEC):
+        self._state = State.CLOSED
+        # Our receive buffer, advertised to the peer
+        self._window = window
+        self._payload_length = payload_length
+        # The window the peer advertised
+        self._receiver_window = window
+
+        # Sending side
+        self._send_buffer = SendBuffer()
+        self._seq = 0
+        self._una = 0
+        self._in_flight = deque()
+        self._deadline = None
+        self._rtt = RttEstimator()
+        self._cc = congestion.create(congestion_control, payload_length)
+        # After a timeout, the start of the segments that still have to be
+        # sent again; None when not recovering
+        self._rewind = None
+        # Payload bytes in flight that the peer reported in SACK blocks
+        self._sacked = 0
+        # The sequence number that ends loss recovery once acknowledged
+        self._recover = None
+        self._dup_acks = 0
+        # Extra cwnd during fast recovery without SACK, one segment per
+        # duplicate ACK (each means a segment has left the network)
+        self._inflation = 0
+        self.counters = {
+            "segments": 0,
+            "retransmits": 0,
+            "timeouts": 0,
+            "duplicate_acks": 0,
+            "fast_retransmits": 0,
+            "sack_retransmits": 0,
+            "recoveries": 0,
+            "aborts": 0,
+        }
+        # Timeouts since the last ACK that moved the window
+        self._timeouts = 0
+        self._closing = False
+        self._syn_sent = False
+        self._syn_acked = False
+        self._fin_sent = False
+        self._fin_acked = False
+
+        # Receiving side
+        self._ack = -1
+        self._reassembly = ReceiveBuffer(window)
+        # Sequence number of the peer's FIN once seen, even out of order
+        self._fin_seq = None
+        self._syn_rcvd = False
+        self._fin_rcvd = False
+        self._ack_pending = False
+        self._reset = False
+
+        self._queue = deque()
+        self._content_length = 0
+
+        self._binary = binary
+        self._peer_binary = False
+        self._text_codec = text_codec
+        self._codec = text_codec
+
+        self._sack = sack
+        self._sack_ok = False
+
+    def set_content_length(self, length):
+        self._content_length = length
+
+    def pop_queue(self):
+        return self._queue.popleft() if self._queue else None
+
+    def add_data(self, data):
+        self._send_buffer.append(BytesSource(data.encode() if isinstance(data, str) else data))
+
+    def add_file(self, file, offset=0, length=None):
+        '''
+        Send a region of an open binary file after the data added so far. The
+        file is read lazily and closed once sent.
+        '''
+        self._send_buffer.append(FileSource(file, offset, length))
+
+    def discard(self):
+        '''
+        Drop the data not sent yet and close any file it comes from.
+        '''
+        self._send_buffer.close()
+
+    def close(self):
+        '''
+        Send FIN once all the data added so far has been sent.
+        '''
+        self._closing = True
+
+    def is_closed(self):
+        return self._state == State.CLOSED
+
+    def is_peer_closed(self):
+        return self._fin_rcvd
+
+    def is_binary(self):
+        return self._codec is BINARY_CODEC
+
+    def is_sack(self):
+        return self._sack_ok
+
+    def in_flight(self):
+        '''
+        Return the number of sequence numbers sent but not yet acknowledged.
+        '''
+        return self._seq - self._una
+
+    def cwnd(self):
+        '''
+        Return the congestion window in bytes, including any inflation
+        during fast recovery.
+        '''
+        return self._cc.cwnd + self._inflation
+
+    def _pipe(self):
+        # Sequence numbers actually in the network; segments waiting to be
+        # sent again after a timeout and SACKed segments are not
+        if self._rewind is not None:
+            return self._rewind - self._una
+        return self.in_flight() - self._sacked
+
+    def srtt(self):
+        '''
+        Return the smoothed round-trip time in seconds, or None before the
+        first sample.
+        '''
+        return self._rtt.srtt
+
+    def rto(self):
+        '''
+        Return the current retransmission timeout in seconds.
+        '''
+        return self._rtt.rto
+
+    def timeout(self):
+        '''
+        Send everything in flight again if the retransmission timer expired,
+        and back off the timer. Reset the connection instead once the timer
+        has expired MAX_TIMEOUTS times in a row.
+        '''
+        now = time.monotonic()
+        if self._deadline is None or now < self._deadline:
+            return
+        self.counters["timeouts"] += 1
+        self._timeouts += 1
+        if self._timeouts > MAX_TIMEOUTS:
+            self._abort()
+            return
+        self._rtt.backoff()
+        self._cc.on_timeout(self.in_flight(), now)
+        self._recover = None
+        self._dup_acks = 0
+        self._inflation = 0
+        self._rewind = self._una
+        self._deadline = now + self._rtt.rto
+        self._resend()
+
+    def _abort(self):
+        '''
+        Give up on an unresponsive peer: queue RST and close.
+        '''
+        self.counters["aborts"] += 1
+        self.reset()
+
+    def reset(self):
+        '''
+        Queue RST, drop everything still to be sent and close.
+        '''
+        self._queue.append(self.create_packet(["RST"], seq_num=self._seq, ack_num=-1, window=self._window))
+        self._reset = True
+        self._send_buffer.close()
+        self._in_flight.clear()
+        self._deadline = None
+        self._update_state()
+
+    def _resend(self):
+        '''
+        Send segments from the rewind point again while the congestion window
+        has room, always at least one.
+        '''
+        limit = min(self._cc.cwnd, self._receiver_window)
+        for segment in self._in_flight:
+            if segment.end <= self._rewind or segment.sacked:
+                continue
+            if self._pipe() > 0 and self._pipe() + segment.end - segment.seq > limit:
+                return
+            self._retransmit(segment)
+            self._rewind = segment.end
+        self._rewind = None
+
+    def deadline(self):
+        '''
+        Return the time.monotonic() at which timeout() has work to do, or
+        None when no timer is armed.
+        '''
+        return self._deadline
+
+    def next_timeout(self):
+        '''
+        Return the seconds until timeout() has work to do, or None when no
+        timer is armed.
+        '''
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def create_packet(self, commands, seq_num=-1, ack_num=-1, window=-1, payload="", sack=()):
+        '''
+        Create a packet from the given components in the negotiated format.
+        '''
+        payload = payload.encode() if isinstance(payload, str) else (payload or b"")
+        if "SYN" in commands:
+            # Offer options as the initiator, or echo the peer's offers
+            if self._binary and (self._peer_binary or not self._syn_rcvd):
+                commands = commands + ["BIN"]
+            if self._sack and (self._sack_ok or not self._syn_rcvd):
+                commands = commands + ["SACK"]
+            return self._text_codec.encode(commands, seq_num, ack_num, window, payload, sack)
+        return self._codec.encode(commands, seq_num, ack_num, window, payload, sack)
+
+    def parse_packet(self, packet):
+        '''
+        Parse a packet in either format into its components.
+        '''
+        commands, seq_num, length, ack_num, window, payload, _ = decode_packet(packet)
+        return commands, seq_num, length, ack_num, window, bytes(payload).decode()
+
+    def send_packet(self):
+        '''
+        Queue as many new segments as the peer's window allows, then a bare
+        ACK if a received segment still has to be acknowledged.
+        '''
+        if self._reset:
+            return
+        if self._rewind is not None:
+            self._resend()
+        now = time.monotonic()
+        segment = self._next_segment()
+        while segment is not None:
+            segment.sent = now
+            self._in_flight.append(segment)
+            self._transmit(segment)
+            self.counters["segments"] += 1
+            if self._deadline is None:
+                self._deadline = now + self._rtt.rto
+            segment = self._next_segment()
+        if self._ack_pending:
+            self._queue.append(self.create_packet(["ACK"], seq_num=self._seq, ack_num=self._ack, window=self._window, sack=self._sack_blocks()))
+            self._ack_pending = False
+        self._update_state()
+
+    def receive_packet(self, data):
+        '''
+        Process one packet from the peer.
+
+        Returns:
+            payload (bytes): Newly received in-order data, or None.
+        '''
+        commands, seq_num, length, ack_num, window, payload, sack = decode_packet(data)
+
+        if "RST" in commands:
+            self._reset = True
+            self._queue.clear()
+            self._send_buffer.close()
+            self._update_state()
+            return None
+
+        if length > self._window:
+            # The peer ignores our window; give up on it rather than answer
+            # every retransmission of the segment
+            self.reset()
+            return None
+
+        if "SYN" in commands and not self._syn_rcvd:
+            self._syn_rcvd = True
+            self._ack = seq_num
+            self._peer_binary = "BIN" in commands
+            if self._binary and self._peer_binary:
+                self._codec = BINARY_CODEC
+            self._sack_ok = self._sack and "SACK" in commands
+
+        if ack_num == -1 and window != -1:
+            # A SYN without ACK still advertises the peer's window
+            self._receiver_window = window
+        elif ack_num != -1:
+            bare = not payload and "SYN" not in commands and "FIN" not in commands
+            self._process_ack(ack_num, window, sack, bare)
+
+        delivered = self._accept(commands, seq_num, payload)
+        self._update_state()
+        return delivered or None
+
+    def _next_segment(self):
+        '''
+        Cut the next segment from the pending data, or return None if nothing
+        may be sent right now.
+        '''
+        if self._fin_sent or self._rewind is not None:
+            return None
+        syn = not self._syn_sent
+        if syn and not self._syn_rcvd:
+            # Nothing is known about the peer's window yet; send one segment
+            budget = self._payload_length
+        elif syn:
+            # The SYN|ACK answering the peer's SYN, which carried its window
+            budget = self._receiver_window
+        elif not self._syn_rcvd:
+            return None
+        else:
+            budget = min(self._receiver_window - self.in_flight(), self.cwnd() - self._pipe())
+        take = int(max(0, min(self._payload_length, budget)))
+        if take < self._payload_length and take < len(self._send_buffer) and self.in_flight():
+            # Wait for room for a full segment rather than send a sliver
+            take = 0
+        payload = self._send_buffer.read(take) if take else b""
+        fin = self._closing and not len(self._send_buffer)
+        if not (syn or payload or fin):
+            return None
+
+        commands = []
+        if syn:
+            commands.append("SYN")
+            self._syn_sent = True
+        if payload:
+            commands.append("DAT")
+        if fin:
+            commands.append("FIN")
+            self._fin_sent = True
+        segment = Segment(self._seq, self._seq + len(payload) + syn + fin, commands, payload)
+        self._seq = segment.end
+        return segment
+
+    def _transmit(self, segment):
+        packet = self.create_packet(segment.commands + ["ACK"], seq_num=segment.seq, ack_num=self._ack, window=self._window, payload=segment.payload, sack=self._sack_blocks())
+        self._queue.append(packet)
+        self._ack_pending = False
+
+    def _retransmit(self, segment):
+        segment.retransmitted = True
+        self._transmit(segment)
+        self.counters["retransmits"] += 1
+
+    def _enter_recovery(self):
+        '''
+        Reduce cwnd once for a window of data in which something was lost.
+        '''
+        if self._recover is None:
+            self._cc.on_loss(self.in_flight(), time.monotonic())
+            self._recover = self._seq
+            self.counters["recoveries"] += 1
+
+    def _sack_blocks(self):
+        if not self._sack_ok:
+            return ()
+        return self._reassembly.ranges()[:MAX_SACK_BLOCKS]
+
+    def _process_ack(self, ack_num, window, sack=(), bare=False):
+        '''
+        Apply a cumulative acknowledgement, SACK blocks and the peer's
+        advertised window. bare is True for a packet that carries nothing
+        but the acknowledgement, the only kind that counts as a duplicate.
+        '''
+        window_update = window != self._receiver_window
+        self._receiver_window = window
+        if sack and self._sack_ok:
+            self._mark_sacked(sack)
+        if self._una < ack_num <= self._seq:
+            self._advance(ack_num)
+        elif ack_num == self._una and bare and self._in_flight and not window_update:
+            self._duplicate_ack()
+        if self._sacked:
+            self._retransmit_lost()
+
+    def _duplicate_ack(self):
+        self._dup_acks += 1
+        self.counters["duplicate_acks"] += 1
+        if self._recover is None:
+            if self._dup_acks == DUP_THRESHOLD:
+                self._enter_recovery()
+                segment = self._in_flight[0]
+                if not (segment.sacked or segment.lost):
+                    segment.lost = True
+                    self._retransmit(segment)
+                    self.counters["fast_retransmits"] += 1
+                if not self._sack_ok:
+                    self._inflation = DUP_THRESHOLD * self._payload_length
+        elif self._dup_acks > DUP_THRESHOLD and not self._sack_ok:
+            self._inflation += self._payload_length
+
+    def _mark_sacked(self, sack):
+        for segment in self._in_flight:
+            if segment.sacked or segment.data_start == segment.data_end:
+                continue
+            for start, end in sack:
+                if start <= segment.data_start and segment.data_end <= end:
+                    segment.sacked = True
+                    self._sacked += len(segment.payload)
+                    break
+
+    def _retransmit_lost(self):
+        '''
+        Resend, once, every segment with DUP_THRESHOLD SACKed segments after it.
+        '''
+        lost = []
+        above = 0
+        for segment in reversed(self._in_flight):
+            if segment.sacked:
+                above += 1
+            elif above >= DUP_THRESHOLD and not segment.lost:
+                lost.append(segment)
+        if not lost:
+            return
+        self._enter_recovery()
+        for segment in reversed(lost):
+            segment.lost = True
+            self._retransmit(segment)
+            self.counters["sack_retransmits"] += 1
+
+    def _advance(self, ack_num):
+        self._dup_acks = 0
+        self._timeouts = 0
+        acked = ack_num - self._una
+        self._una = ack_num
+        if self._rewind is not None and self._rewind < ack_num:
+            self._rewind = ack_num if ack_num < self._seq else None
+        in_flight = self._in_flight
+        segment = None
+        while in_flight and in_flight[0].end <= ack_num:
+            segment = in_flight.popleft()
+            if segment.sacked:
+                self._sacked -= len(segment.payload)
+            if "SYN" in segment.commands:
+                self._syn_acked = True
+            if "FIN" in segment.commands:
+                self._fin_acked = True
+        now = time.monotonic()
+        # Karn's algorithm: the ACK of a retransmitted segment is ambiguous
+        if segment is not None and not segment.retransmitted:
+            self._rtt.sample(now - segment.sent)
+        self._deadline = now + self._rtt.rto if in_flight else None
+        if self._recover is None or self._sack_ok:
+            # Without SACK, the inflation alone grows the window in recovery
+            self._cc.on_ack(acked, now, self._rtt.srtt)
+        if self._recover is not None and ack_num >= self._recover:
+            # Full acknowledgement: recovery is over, deflate the window
+            self._recover = None
+            self._inflation = 0
+        elif self._recover is not None and not self._sack_ok:
+            # Partial acknowledgement: the next hole was lost too
+            self._inflation = max(0, self._inflation - acked + self._payload_length)
+            if not in_flight[0].lost:
+                in_flight[0].lost = True
+                self._retransmit(in_flight[0])
+                self.counters["fast_retransmits"] += 1
+
+    def _accept(self, commands, seq_num, payload):
+        '''
+        Take in the data of a segment, acknowledge it and return whatever
+        became contiguous. ACKs of in-order segments wait for send_packet(),
+        so a batch of them is answered once; any other segment gets its own
+        ACK at once.
+        '''
+        if not self._syn_rcvd:
+            return None
+        syn = "SYN" in commands
+        if not (payload or syn or "FIN" in commands):
+            return None
+        ack = self._ack
+        if syn and seq_num == self._ack:
+            self._ack += 1
+        # The payload follows the SYN and comes before the FIN
+        start = seq_num + syn
+        end = start + len(payload)
+        if "FIN" in commands:
+            self._fin_seq = end
+
+        delivered = None
+        if start <= self._ack < end:
+            delivered = bytes(payload[self._ack - start:])
+            self._ack = end
+            rest = self._reassembly.pop(end)
+            if rest:
+                delivered += rest
+                self._ack += len(rest)
+        elif self._ack < start:
+            self._reassembly.add(start, payload, self._ack)
+
+        if self._ack == self._fin_seq:
+            self._ack += 1
+            self._fin_rcvd = True
+
+        if self._ack == ack:
+            # Out of order or a duplicate: acknowledge it right away, as the
+            # duplicate ACKs are what drive the peer's fast retransmit
+            self._queue.append(self.create_packet(["ACK"], seq_num=self._seq, ack_num=self._ack, window=self._window, sack=self._sack_blocks()))
+            self._ack_pending = False
+        else:
+            # In order: one ACK for all of them is sent by send_packet()
+            self._ack_pending = True
+        return delivered
+
+    def _update_state(self):
+        if self._reset:
+            self._state = State.CLOSED
+        elif self._fin_sent and self._fin_acked and self._fin_rcvd:
+            self._state = State.CLOSED
+        elif self._fin_sent:
+            self._state = State.FIN_SENT
+        elif self._fin_rcvd:
+            self._state = State.CON_FIN_RCVD if self._syn_acked else State.FIN_RCVD
+        elif self._syn_sent and self._syn_rcvd and self._syn_acked:
+            self._state = State.CONNECTED
+        elif self._syn_sent:
+            self._state = State.SYN_SENT
+        elif self._syn_rcvd:
+            self._state = State.SYN_RCVD
+        else:
+            self._state = State.CLOSED
@@ -0,0 +1,108 @@
+'''
+Load benchmark for the sws.py event loop.
+
+Starts sws.py, parks a growing number of idle keep-alive connections on it and
+measures the latency of fresh GET requests while they sit there. With an O(1)
+event loop the per-request latency should stay flat as the idle count grows.
+
+usage: python3 bench_connections.py [--backend NAME] [--requests N] [idle_count ...]
+'''
+
+import argparse
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REQUEST = b"GET /small.html HTTP/1.0\r\n\r\n"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_server(port, deadline=5.0):
+    end = time.monotonic() + deadline
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("sws.py did not start")
+
+def open_idle(port, count):
+    '''
+    Open count connections that stay open without sending a request.
+    '''
+    conns = []
+    for _ in range(count):
+        conns.append(socket.create_connection(("127.0.0.1", port)))
+    return conns
+
+def measure(port, requests):
+    '''
+    Return the per-request latencies in microseconds for sequential GETs.
+    '''
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            s.sendall(REQUEST)
+            while s.recv(4096):
+                pass
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+def run(backend, idle_count, requests):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "sws.py", "127.0.0.1", str(port), "--backend", backend], cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    conns = []
+    try:
+        wait_for_server(port)
+        conns = open_idle(port, idle_count)
+        measure(port, 10)
+        if server.poll() is not None:
+            return None
+        samples = measure(port, requests)
+    except OSError:
+        return None
+    finally:
+        for c in conns:
+            c.close()
+        server.kill()
+        server.wait()
+    samples.sort()
+    return {
+        "median": statistics.median(samples),
+        "p99": samples[int(len(samples) * 0.99) - 1],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="default")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("idle", nargs="*", type=int, default=[100, 1000, 5000, 10000])
+    args = parser.parse_args()
+
+    # Every idle connection costs a descriptor on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, 2 * max(args.idle) + 256)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+    print(f"backend: {args.backend}, {args.requests} requests per run")
+    print(f"{'idle':>8} {'median us':>12} {'p99 us':>12}")
+    for idle in args.idle:
+        result = run(args.backend, idle, args.requests)
+        if result is None:
+            print(f"{idle:>8} {'failed':>12}")
+        else:
+            print(f"{idle:>8} {result['median']:>12.1f} {result['p99']:>12.1f}")
+
+if __name__ == "__main__":
+    main()
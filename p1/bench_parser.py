@@ -0,0 +1,90 @@
+'''
+Microbenchmark for the sws.py request parser.
+
+Compares the old regex-per-line pipeline against the incremental
+RequestParser on the pipelined input in multiple_requests.txt, delivered in
+one chunk and as one chunk per request.
+
+usage: python3 bench_parser.py [seconds_per_case]
+'''
+
+import os
+import re
+import sys
+import time
+
+from httpparser import RequestParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+EOL_PATTERN = r'^(\r\n|\n)[2]$'
+EOR_PATTERN = r'.*(\r\n\r\n|\n\n)$'
+REQ_PATTERN = r'^GET\s\/(.*)\sHTTP\/1.0(\r\n|\n)?'
+CONNECTION_PATTERN = r'Connection:\s?(.*)\s*(\r\n|\n)?'
+
+def legacy_parse(chunks):
+    '''
+    The request handling of the previous sws.py with file access and
+    response building removed: string accumulation, a full re.split of the
+    buffer on every chunk and several regexes per line.
+    '''
+    buffer = ""
+    parsed = 0
+    for chunk in chunks:
+        message = chunk.decode()
+        buffer += message
+        if not re.search(EOR_PATTERN, message):
+            continue
+        requests = list(filter((lambda x: x != "\r\n\r\n" and x != "\n\n" and x != ""), re.split(r'(\r\n\r\n|\n\n)', buffer)))
+        for request in requests:
+            for line in request.splitlines():
+                if not (re.match(REQ_PATTERN, line) or re.match(CONNECTION_PATTERN, line) or re.match(EOL_PATTERN, line)):
+                    continue
+                if re.match(REQ_PATTERN, line):
+                    re.match(REQ_PATTERN, line).group(1) if re.match(REQ_PATTERN, line).group(1) != "" else "index.html"
+                elif re.match(CONNECTION_PATTERN, line):
+                    re.search(CONNECTION_PATTERN, line).group(1).lower()
+            parsed += 1
+        buffer = ""
+    return parsed
+
+def incremental_parse(chunks):
+    parser = RequestParser()
+    parsed = 0
+    for chunk in chunks:
+        parsed += len(parser.feed(chunk))
+    return parsed
+
+def bench(parse, chunks, seconds):
+    '''
+    Return requests parsed per second.
+    '''
+    requests = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for _ in range(100):
+            requests += parse(chunks)
+    return requests / (time.perf_counter() - start)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    with open(os.path.join(HERE, "multiple_requests.txt"), "rb") as f:
+        data = f.read()
+    # The fixture uses bare LF line endings; also measure the CRLF form
+    inputs = {
+        "LF": data,
+        "CRLF": data.replace(b"\n", b"\r\n"),
+    }
+
+    print(f"{'input':<8} {'chunking':<10} {'legacy req/s':>14} {'parser req/s':>14} {'speedup':>8}")
+    for name, payload in inputs.items():
+        sep = b"\r\n\r\n" if name == "CRLF" else b"\n\n"
+        per_request = [block + sep for block in payload.split(sep) if block]
+        for label, chunks in (("whole", [payload]), ("request", per_request)):
+            old = bench(legacy_parse, chunks, seconds)
+            new = bench(incremental_parse, chunks, seconds)
+            print(f"{name:<8} {label:<10} {old:>14,.0f} {new:>14,.0f} {new / old:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+'''
+In-memory cache of static file responses for sws.py.
+
+Entries hold the file body as pre-encoded bytes together with pre-rendered
+"200 OK" headers, so a cache hit can be handed straight to the socket. The
+cache is bounded by a byte budget and evicts the least recently used entries
+first.
+'''
+
+import os
+import stat
+import time
+from collections import OrderedDict
+
+# How often (seconds) a cached entry is checked against the file on disk.
+# Between checks a hit costs no filesystem syscalls at all.
+REVALIDATE_INTERVAL = 1.0
+
+CONNECTION_VALUES = ("close", "keep-alive")
+
+class CacheEntry:
+    '''
+    A cached response body plus the data needed to validate it.
+
+    body is None for files too large to cache; those are streamed from disk.
+    '''
+
+    def __init__(self, body, mtime, size):
+        self.body = body
+        self.mtime = mtime
+        self.size = size
+        self.checked = time.monotonic()
+        self.headers = {c: f"HTTP/1.0 200 OK\r\nConnection: {c}\r\n\r\n".encode() for c in CONNECTION_VALUES}
+
+    def cost(self):
+        return len(self.body) if self.body is not None else 0
+
+class FileCache:
+    '''
+    LRU cache of file responses keyed by path and bounded by max_bytes.
+
+    Parameters:
+        max_bytes (int): Total body bytes the cache may hold. 0 disables caching.
+        max_entry_bytes (int): Largest single file that will be cached.
+    '''
+
+    def __init__(self, max_bytes, max_entry_bytes=None):
+        self._entries = OrderedDict()
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_bytes if max_entry_bytes is None else min(max_entry_bytes, max_bytes)
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path):
+        '''
+        Return the CacheEntry for path, loading it from disk on a miss.
+        Files larger than max_entry_bytes are not read; their entry has no body.
+
+        Returns:
+            entry (CacheEntry): The entry, or None if path is not a regular file.
+        '''
+        entry = self._entries.get(path)
+        if entry is not None:
+            if time.monotonic() - entry.checked < REVALIDATE_INTERVAL or self._still_valid(path, entry):
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            self._remove(path)
+
+        self.misses += 1
+        try:
+            st = os.stat(path)
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            if st.st_size > self._max_entry_bytes:
+                return CacheEntry(None, st.st_mtime_ns, st.st_size)
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        entry = CacheEntry(body, st.st_mtime_ns, st.st_size)
+        self._insert(path, entry)
+        return entry
+
+    def stats(self):
+        '''
+        Return the cache counters as a dictionary.
+        '''
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def _still_valid(self, path, entry):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        entry.checked = time.monotonic()
+        return st.st_mtime_ns == entry.mtime and st.st_size == entry.size
+
+    def _insert(self, path, entry):
+        self._entries[path] = entry
+        self._bytes += entry.cost()
+        while self._bytes > self._max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.cost()
+            self.evictions += 1
+
+    def _remove(self, path):
+        entry = self._entries.pop(path)
+        self._bytes -= entry.cost()
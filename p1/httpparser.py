@@ -0,0 +1,121 @@
+'''
+Incremental HTTP/1.0 request parser for sws.py.
+
+Each connection owns one RequestParser. Received bytes are appended to a
+bytearray and only the newly arrived bytes are scanned for the blank line
+that ends a header block, so a request split over many recv calls (or many
+requests pipelined into one) costs time proportional to its size. Complete
+header blocks are turned into Request objects right away.
+'''
+
+# Header blocks larger than this are rejected instead of buffered forever
+MAX_HEADER_BYTES = 8192
+
+LF = 0x0A
+CR = 0x0D
+
+class Request:
+    '''
+    One parsed request.
+
+    Attributes:
+        line (str): The request line (or the offending line of a bad request), for logging.
+        path (str): Requested file, "index.html" for "/".
+        connection (str): Lower-cased Connection header value, or None if absent.
+        bad (bool): Whether the block was malformed.
+    '''
+
+    def __init__(self, line, path=None, connection=None, bad=False):
+        self.line = line
+        self.path = path
+        self.connection = connection
+        self.bad = bad
+
+    def keep_alive(self):
+        return self.connection == "keep-alive"
+
+class RequestParser:
+    '''
+    Splits a byte stream into header blocks and parses each one.
+    '''
+
+    def __init__(self):
+        self._buf = bytearray()
+        # Offset from which to resume looking for the end of the header block
+        self._scan = 0
+
+    def feed(self, data):
+        '''
+        Add received bytes and return every request they complete.
+
+        Parameters:
+            data (bytes): Bytes just read from the connection.
+
+        Returns:
+            requests (list): Request objects in arrival order.
+        '''
+        buf = self._buf
+        buf += data
+        requests = []
+        while True:
+            end = self._find_block_end()
+            if end < 0:
+                break
+            block = bytes(buf[:end])
+            del buf[:end]
+            self._scan = 0
+            if block.strip():
+                requests.append(parse_block(block))
+        if len(buf) > MAX_HEADER_BYTES:
+            del buf[:]
+            self._scan = 0
+            requests.append(Request("", bad=True))
+        return requests
+
+    def _find_block_end(self):
+        '''
+        Return the offset just past the blank line ending the first header
+        block, or -1 if the block is not complete yet.
+        '''
+        buf = self._buf
+        i = buf.find(b"\n", self._scan)
+        while i >= 0:
+            if i + 1 < len(buf) and buf[i + 1] == LF:
+                return i + 2
+            if i + 2 < len(buf) and buf[i + 1] == CR and buf[i + 2] == LF:
+                return i + 3
+            if i + 2 >= len(buf):
+                # Not enough bytes to decide yet; resume from this newline
+                self._scan = i
+                return -1
+            i = buf.find(b"\n", i + 1)
+        self._scan = len(buf)
+        return -1
+
+def parse_block(block):
+    '''
+    Parse a complete header block (request line plus headers).
+
+    Parameters:
+        block (bytes): The block, including its terminating blank line.
+
+    Returns:
+        request (Request): The parsed request.
+    '''
+    request_line = None
+    path = None
+    connection = None
+    bad = False
+    for raw in block.split(b"\n"):
+        line = raw.rstrip(b"\r")
+        if not line:
+            continue
+        if path is None and line.startswith(b"GET /") and line.endswith(b" HTTP/1.0"):
+            path = line[5:-9].decode("latin-1") or "index.html"
+            request_line = request_line or line.decode("latin-1")
+        elif line.startswith(b"Connection:"):
+            connection = line[11:].strip().decode("latin-1").lower()
+        else:
+            bad = True
+            request_line = request_line or line.decode("latin-1").strip()
+    return Request(request_line or "", path, connection, bad or path is None)
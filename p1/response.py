@@ -0,0 +1,104 @@
+'''
+Non-blocking response writer for sws.py.
+
+A Response is a sequence of in-memory buffers and at most one file region.
+Buffers go out with a single sendmsg (no joining into one big string) and
+file regions are streamed with os.sendfile straight from the descriptor, so
+the body is never copied through Python. Partial writes are remembered, and
+the next writable event resumes exactly where the kernel stopped accepting.
+'''
+
+import os
+from collections import deque
+
+# Upper bound on the number of buffers handed to one sendmsg call
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+# Chunk size used when the platform has no sendfile
+FALLBACK_CHUNK = 64 * 1024
+
+class FileRegion:
+    '''
+    A byte range of an open file that still has to be sent.
+    '''
+
+    def __init__(self, file, offset, count):
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+class Response:
+    '''
+    An outgoing response that may take several writable events to send.
+
+    Parameters:
+        buffers (list): Bytes-like header and body chunks sent before the file.
+        file (file): Open binary file whose contents follow the buffers, or None.
+        size (int): Number of bytes of file to send.
+        trailer (bytes): Bytes sent after the file body.
+    '''
+
+    def __init__(self, buffers, file=None, size=0, trailer=b""):
+        self._parts = deque(memoryview(b) for b in buffers if b)
+        self._file = file
+        if file is not None:
+            self._parts.append(FileRegion(file, 0, size))
+        if trailer:
+            self._parts.append(memoryview(trailer))
+
+    def write(self, sock):
+        '''
+        Send as much of the response as the socket accepts without blocking.
+
+        Returns:
+            done (bool): True once every byte has been sent.
+        '''
+        try:
+            while self._parts:
+                if isinstance(self._parts[0], FileRegion):
+                    self._send_file(sock, self._parts[0])
+                else:
+                    self._send_buffers(sock)
+        except BlockingIOError:
+            return False
+        self.close()
+        return True
+
+    def close(self):
+        '''
+        Release the file descriptor held by the response, if any.
+        '''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _send_buffers(self, sock):
+        buffers = []
+        for part in self._parts:
+            if isinstance(part, FileRegion) or len(buffers) == IOV_MAX:
+                break
+            buffers.append(part)
+        sent = sock.sendmsg(buffers)
+        while sent:
+            head = self._parts[0]
+            if sent < len(head):
+                self._parts[0] = head[sent:]
+                break
+            sent -= len(head)
+            self._parts.popleft()
+
+    def _send_file(self, sock, region):
+        if region.count:
+            if hasattr(os, "sendfile"):
+                sent = os.sendfile(sock.fileno(), region.file.fileno(), region.offset, region.count)
+            else:
+                region.file.seek(region.offset)
+                sent = sock.send(region.file.read(min(region.count, FALLBACK_CHUNK)))
+            if sent == 0:
+                raise OSError("file shrank while it was being sent")
+            region.offset += sent
+            region.count -= sent
+        if not region.count:
+            self._parts.popleft()
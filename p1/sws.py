@@ -1,168 +1,286 @@
+import os
 import socket
-import select
+import selectors
+import argparse
 import sys
-import queue
-import re
-from datetime import datetime, timedelta
-from os.path import exists
-
-EOL_PATTERN = r'^(\r\n|\n)[2]$'
-TERMINAL_EOR_PATTERN = r'^(\r\n|\n)?$'
-EOR_PATTERN = r'.*(\r\n\r\n|\n\n)$'
-REQ_PATTERN = r'^GET\s\/(.*)\sHTTP\/1.0(\r\n|\n)?'
-CONNECTION_PATTERN = r'Connection:\s?(.*)\s*(\r\n|\n)?'
+import time
+import workers
+from collections import deque
+from filecache import FileCache
+from httpparser import RequestParser
+from response import Response
+from timerwheel import TimerWheel
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import accesslog
+
+# Seconds a connection may sit without any read or write before it is closed
 TIMEOUT = 60.0
+# Finest resolution of the idle timer wheel, in seconds
+MIN_TICK = 0.01
+RECV_SIZE = 1024
+CACHE_SIZE = 16 * 1024 * 1024
+# Files above this size skip the cache and are streamed with sendfile
+SENDFILE_THRESHOLD = 64 * 1024
+TRAILER = b"\r\n\r\n"
+BAD_REQUEST = b"HTTP/1.0 400 Bad Request\r\n\r\n"
+LOG_TEMPLATE = "{time}: {client}:{port} {request}; {response}"
+
+# Event loop backends, best first. "default" lets the selectors module pick
+# (epoll on Linux, kqueue on BSD/macOS) and falls back to select elsewhere.
+BACKENDS = {
+    "default": "DefaultSelector",
+    "epoll": "EpollSelector",
+    "kqueue": "KqueueSelector",
+    "poll": "PollSelector",
+    "select": "SelectSelector",
+}
+
+parser = argparse.ArgumentParser(description="Simple web server")
+parser.add_argument("ip_address")
+parser.add_argument("port_number", type=int)
+parser.add_argument("--backend", choices=BACKENDS, default="default", help="event loop backend (default: best available)")
+parser.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="file cache budget in bytes, 0 to disable (default: %(default)s)")
+parser.add_argument("--sendfile-threshold", type=int, default=SENDFILE_THRESHOLD, help="stream files larger than this many bytes with sendfile (default: %(default)s)")
+parser.add_argument("--idle-timeout", type=float, default=TIMEOUT, help="close connections idle for this many seconds (default: %(default)s)")
+accesslog.add_arguments(parser)
+parser.add_argument("--workers", type=int, default=0, help="fork this many event loop processes sharing the port with SO_REUSEPORT (default: single process)")
+args = parser.parse_args()
+if args.idle_timeout <= 0:
+    parser.error("--idle-timeout must be greater than 0")
+if args.workers > 0 and not hasattr(socket, "SO_REUSEPORT"):
+    parser.error("--workers needs SO_REUSEPORT, which this platform does not provide")
+
+ip_address = args.ip_address
+port_number = args.port_number
 
-ip_address = sys.argv[1]
-port_number = int(sys.argv[2])
+def make_selector(backend):
+    '''
+    Create the event loop selector for the given backend name, falling back
+    to select() when the platform does not provide it.
+    '''
+    return getattr(selectors, BACKENDS[backend], selectors.SelectSelector)()
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setblocking(0)
-server.bind((ip_address, port_number))
-server.listen(5)
+def make_server(reuse_port=False):
+    '''
+    Create the non-blocking listening socket. With reuse_port, several
+    processes can each bind their own socket to the same address.
+    '''
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.setblocking(0)
+    server.bind((ip_address, port_number))
+    server.listen(socket.SOMAXCONN)
+    return server
 
-inputs = [server]
-outputs = []
+def start(reuse_port=False):
+    '''
+    Set up the listening socket, event loop and file cache of this process.
+    '''
+    global server, sel, file_cache, idle_timers, access_log
+    server = make_server(reuse_port)
+    # Registered sockets are keyed by file descriptor inside the selector, so
+    # adding, switching and dropping interest in a socket are all O(1).
+    sel = make_selector(args.backend)
+    file_cache = FileCache(args.cache_size, args.sendfile_threshold)
+    # Idle deadlines are checked every loop iteration at tick resolution
+    idle_timers = TimerWheel(tick=max(MIN_TICK, min(1.0, args.idle_timeout / 8)))
+    # Created per process: a forked worker must start its own flush thread
+    access_log = accesslog.from_args(LOG_TEMPLATE, args)
+
+def stats():
+    '''
+    Return this process's request and cache counters.
+    '''
+    return {
+        **counters,
+        **{f"cache_{k}": v for k, v in file_cache.stats().items()},
+        "log_dropped": access_log.dropped,
+    }
+
+server = None
+sel = None
+file_cache = None
+idle_timers = None
+access_log = None
+counters = {"connections": 0, "requests": 0, "200": 0, "400": 0, "404": 0}
 response_messages = {}
-request_message = {}
+request_parsers = {}
+client_address = {}
 close_connection = {}
-last_event = {}
+# Connections whose peer has shut down its sending side
+read_closed = set()
 
-def main():
+def main(report=None):
+    '''
+    Run the event loop. report, if given, is called after every iteration
+    so a worker can pass its counters to the supervisor.
+    '''
+    sel.register(server, selectors.EVENT_READ)
     while True:
-        readable, writable, exceptional = select.select(inputs, outputs, inputs, TIMEOUT)
+        timeouts = [t for t in (idle_timers.next_timeout(time.monotonic()), access_log.timeout()) if t is not None]
+        if report is not None:
+            timeouts.append(workers.REPORT_INTERVAL)
+        events = sel.select(min(timeouts, default=None))
+        if report is not None:
+            report()
 
-        if not (readable or writable or exceptional):
-            for socket in inputs:
-                if socket != server:
-                    if check_timeout(socket):
-                        handle_connection_error(socket)
-            continue
+        for s in idle_timers.expire(time.monotonic()):
+            handle_connection_error(s)
 
-        for s in readable:
+        for key, mask in events:
+            s = key.fileobj
             if s is server:
                 handle_new_connection(s)
-            else:
-                handle_existing_connection(s)
+                continue
+            try:
+                if mask & selectors.EVENT_READ:
+                    handle_existing_connection(s)
+                if mask & selectors.EVENT_WRITE and is_registered(s):
+                    write_back_response(s)
+            except OSError:
+                handle_connection_error(s)
 
-        for s in writable:
-            write_back_response(s)
-
-        for s in exceptional:
-            handle_connection_error(s)
+        access_log.poll()
 
 # --------------- Helper methods ----------------
 
-def check_timeout(socket):
-    if last_event[socket] + timedelta(seconds=TIMEOUT) < datetime.now():
-        return True
+def touch(socket):
+    '''
+    Push the idle deadline of a connection forward after activity.
+    '''
+    idle_timers.schedule(socket, time.monotonic() + args.idle_timeout)
 
-def check_format(message):
-    if re.match(REQ_PATTERN, message) or re.match(CONNECTION_PATTERN, message) or re.match(EOL_PATTERN, message):
-        return True
-    return False
+def is_registered(socket):
+    return socket.fileno() != -1 and socket in close_connection
+
+def want_write(socket, enabled):
+    '''
+    Add or drop write interest for a connection that is already registered.
+    '''
+    events = 0 if socket in read_closed else selectors.EVENT_READ
+    if enabled:
+        events |= selectors.EVENT_WRITE
+    if sel.get_key(socket).events != events:
+        sel.modify(socket, events)
 
 def handle_new_connection(socket):
-    connection, _ = socket.accept()
+    try:
+        connection, address = socket.accept()
+    except BlockingIOError:
+        return
     connection.setblocking(0)
-    inputs.append(connection)
-    response_messages[connection] = queue.Queue()
+    sel.register(connection, selectors.EVENT_READ)
+    response_messages[connection] = deque()
+    request_parsers[connection] = RequestParser()
+    client_address[connection] = address
     close_connection[connection] = True
-    last_event[connection] = datetime.now()
+    touch(connection)
+    counters["connections"] += 1
 
 def handle_existing_connection(socket):
-    message = socket.recv(1024).decode()
-    last_event[socket] = datetime.now()
-    if message:
-        if request_message.get(socket) is None:
-            request_message[socket] = message
+    data = socket.recv(RECV_SIZE)
+    touch(socket)
+    if not data:
+        # Peer shut down its sending side. Stop reading, since with
+        # level-triggered epoll the socket would otherwise stay readable
+        # forever, but still deliver responses already queued for it.
+        request_parsers.pop(socket, None)
+        close_connection[socket] = True
+        if not response_messages[socket]:
+            handle_connection_error(socket)
+            return
+        read_closed.add(socket)
+        want_write(socket, True)
+        return
+    parser = request_parsers.get(socket)
+    if parser is None:
+        # A closing response is already queued; ignore anything after it
+        return
+    for request in parser.feed(data):
+        respond(socket, request)
+        if close_connection[socket]:
+            request_parsers.pop(socket)
+            break
+
+def respond(socket, request):
+    '''
+    Queue the response to one request and log it.
+    '''
+    close_connection[socket] = not request.keep_alive()
+    c = "close" if close_connection[socket] else "keep-alive"
+    if request.bad:
+        status = "HTTP/1.0 400 Bad Request"
+        response = Response([BAD_REQUEST])
+    else:
+        entry = file_cache.get(request.path)
+        if entry is not None:
+            status = "HTTP/1.0 200 OK"
+            response = file_response(request.path, entry, c)
         else:
-            request_message[socket] += message
-        if re.search(EOR_PATTERN, message) or re.match(TERMINAL_EOR_PATTERN, message):
-            whole_message = request_message[socket]
-            outputs.append(socket)
-
-            req_file = ""
-            file_found = False
-            bad_request = False
-            connection_header = False
-            i = 0
-
-            requests = list(filter((lambda x: x != "\r\n\r\n" and x != "\n\n" and x != ""), re.split(r'(\r\n\r\n|\n\n)', whole_message)))
-            responses = []
-
-            for request in requests:
-                log = {"response": "", "request": "", "time": datetime.now().strftime("%a %b %d %H:%M:%S PDT %Y")}
-                for line in request.splitlines():
-                    if not check_format(line):
-                        if i < len(responses) - 1:
-                            responses[i] = "HTTP/1.0 400 Bad Request\r\n\r\n"
-                        else:
-                            responses.append("HTTP/1.0 400 Bad Request\r\n\r\n")
-                        log["response"] = "HTTP/1.0 400 Bad Request"
-                        if not log["request"]:
-                            log["request"] = line.strip()
-                        bad_request = True
-                    else:
-                        if re.match(REQ_PATTERN, line):
-                            log["request"] = line.strip()
-                            req_file = re.match(REQ_PATTERN, line).group(1) if re.match(REQ_PATTERN, line).group(1) != "" else "index.html"
-                            if exists(req_file):
-                                responses.append("HTTP/1.0 200 OK\r\n")
-                                log["response"] = "HTTP/1.0 200 OK"
-                                file_found = True
-                            else:
-                                responses.append("HTTP/1.0 404 Not Found\r\n")
-                                log["response"] = "HTTP/1.0 404 Not Found"
-                        elif re.match(CONNECTION_PATTERN, line):
-                            connection_header = True
-                            connection = re.search(CONNECTION_PATTERN, line).group(1)
-                            if connection.lower() == "keep-alive":
-                                close_connection[socket] = False
-                            elif connection.lower() == "close":
-                                close_connection[socket] = True
-                print(f"{log['time']}: {socket.getpeername()[0]}:{port_number} {log['request']}; {log['response']}")
-                c = "close" if close_connection[socket] or not connection_header else "keep-alive"
-                responses[i] += f"Connection: {c}\r\n\r\n" if not bad_request else ""
-                if file_found:
-                    with open(req_file, 'r') as f:
-                        responses[i] += f.read()
-                    responses[i] += "\r\n\r\n"
-                if close_connection[socket] or not connection_header:
-                    close_connection[socket] = True
-                    break
-                file_found = False
-                bad_request = False
-                req_file = ""
-                i += 1
-                connection_header = False
-                request_message[socket] = ""
-            for response in responses:
-                response_messages[socket].put(response)
+            status = "HTTP/1.0 404 Not Found"
+            response = Response([f"{status}\r\nConnection: {c}\r\n\r\n".encode()])
+    counters["requests"] += 1
+    counters[status.split()[1]] += 1
+    access_log.log(client=client_address[socket][0], port=port_number, request=request.line, response=status)
+    response_messages[socket].append(response)
+    want_write(socket, True)
 
-def write_back_response(socket):
+def file_response(req_file, entry, connection):
+    '''
+    Build the 200 response for a file, from memory when it is cached and
+    streamed from disk with sendfile otherwise.
+    '''
+    if entry.body is not None:
+        return Response([entry.headers[connection], entry.body], trailer=TRAILER)
     try:
-        next_msg = response_messages[socket].get_nowait()
+        f = open(req_file, "rb")
+    except OSError:
+        return Response([f"HTTP/1.0 404 Not Found\r\nConnection: {connection}\r\n\r\n".encode()])
+    return Response([entry.headers[connection]], file=f, size=entry.size, trailer=TRAILER)
 
-    except queue.Empty:
-        outputs.remove(socket)
+def write_back_response(socket):
+    touch(socket)
+    pending = response_messages[socket]
+    while pending:
+        if not pending[0].write(socket):
+            # Kernel buffer is full, carry on from here on the next writable event
+            return
+        pending.popleft()
+    if close_connection[socket]:
+        handle_connection_error(socket)
     else:
-        msg = next_msg.encode()
-        socket.send(msg)
-        last_event[socket] = datetime.now()
-        if(close_connection[socket] and response_messages[socket].empty()):
-            outputs.remove(socket)
-            inputs.remove(socket)
-            last_event.pop(socket)
-            socket.close()
+        want_write(socket, False)
 
 def handle_connection_error(socket):
-    if socket in outputs:
-        outputs.remove(socket)
-    inputs.remove(socket)
+    if socket.fileno() != -1:
+        sel.unregister(socket)
+    for response in response_messages.pop(socket, ()):
+        response.close()
+    for state in (request_parsers, client_address, close_connection):
+        state.pop(socket, None)
+    read_closed.discard(socket)
+    idle_timers.cancel(socket)
     socket.close()
 
 # --------------- End of helper methods ----------------
 
+def run_worker(report):
+    start(reuse_port=True)
+    try:
+        main(report)
+    finally:
+        access_log.close()
+
 if __name__ == "__main__":
-    main()
+    if args.workers > 0:
+        workers.supervise(args.workers, run_worker, stats)
+    else:
+        start()
+        try:
+            main()
+        except KeyboardInterrupt:
+            access_log.close()
+            print(f"stats: {stats()}")
@@ -0,0 +1,99 @@
+'''
+Hashed timing wheel used by sws.py to expire idle connections.
+
+Deadlines are monotonic times. Each key lives in the slot of the tick its
+deadline falls in. Pushing a deadline later (the common case: a connection
+saw activity) only updates a dictionary; the key is moved lazily when its
+old slot comes around. Expiring therefore costs O(expired + moved) per tick
+instead of a scan over every connection.
+'''
+
+import math
+import time
+
+class TimerWheel:
+    '''
+    One-shot timers keyed by any hashable object, such as a socket.
+
+    Parameters:
+        tick (float): Slot width in seconds; deadlines fire up to one tick late.
+        slots (int): Number of slots. Deadlines further away than
+            tick * slots wrap around and are re-slotted when visited.
+        now (float): Start time, defaults to time.monotonic().
+    '''
+
+    def __init__(self, tick=1.0, slots=64, now=None):
+        self._tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._deadlines = {}
+        self._slot_of = {}
+        # Next tick number that has not been processed yet
+        self._current = math.floor((time.monotonic() if now is None else now) / tick)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, deadline):
+        '''
+        Arm or re-arm the timer of key to fire at deadline.
+        '''
+        old = self._deadlines.get(key)
+        self._deadlines[key] = deadline
+        if old is not None:
+            if deadline >= old:
+                return
+            self._slots[self._slot_of[key]].discard(key)
+        self._place(key, deadline)
+
+    def cancel(self, key):
+        '''
+        Disarm the timer of key if it has one.
+        '''
+        if self._deadlines.pop(key, None) is not None:
+            self._slots[self._slot_of.pop(key)].discard(key)
+
+    def expire(self, now):
+        '''
+        Remove and return every key whose deadline is at or before now.
+        '''
+        last = math.floor(now / self._tick)
+        expired = []
+        # Visiting each slot once is enough, however long the loop slept
+        first = max(self._current, last - len(self._slots) + 1)
+        for tick in range(first, last + 1):
+            index = tick % len(self._slots)
+            slot = self._slots[index]
+            if not slot:
+                continue
+            self._slots[index] = set()
+            for key in slot:
+                deadline = self._deadlines[key]
+                if deadline <= now:
+                    del self._deadlines[key]
+                    del self._slot_of[key]
+                    expired.append(key)
+                else:
+                    self._place(key, deadline)
+        self._current = max(self._current, last + 1)
+        return expired
+
+    def next_timeout(self, now):
+        '''
+        Return how long the event loop may sleep before calling expire
+        again, or None if no timer is armed.
+        '''
+        if not self._deadlines:
+            return None
+        return max(0.0, (math.floor(now / self._tick) + 1) * self._tick - now)
+
+    def _tick_of(self, deadline):
+        return math.ceil(deadline / self._tick)
+
+    def _place(self, key, deadline):
+        tick = max(self._tick_of(deadline), self._current)
+        index = tick % len(self._slots)
+        self._slots[index].add(key)
+        self._slot_of[key] = index
@@ -0,0 +1,217 @@
+'''
+Multi-process mode for sws.py.
+
+The supervisor forks N worker processes. Each worker binds its own listening
+socket to the same address with SO_REUSEPORT, so the kernel spreads new
+connections across them, and runs an independent event loop. A worker's
+stdout (its access log) goes to a pipe, and a second pipe carries periodic
+JSON snapshots of its counters. The supervisor forwards the log line by
+line, adds up the counters and restarts any worker that dies.
+'''
+
+import json
+import os
+import selectors
+import signal
+import sys
+import time
+import traceback
+from collections import Counter
+
+# Seconds between counter snapshots sent by a worker
+REPORT_INTERVAL = 1.0
+# Minimum seconds between two starts of the same worker slot
+RESTART_DELAY = 1.0
+# Seconds to wait for workers to exit before killing them
+SHUTDOWN_GRACE = 5.0
+
+# Counters that describe current state rather than totals; they are not
+# carried over from workers that have exited
+GAUGES = {"cache_entries", "cache_bytes"}
+
+class StatsReporter:
+    '''
+    Called by a worker's event loop; writes a counter snapshot to the
+    supervisor at most once every REPORT_INTERVAL seconds.
+    '''
+
+    def __init__(self, fd, index, stats):
+        self._fd = fd
+        self._index = index
+        self._stats = stats
+        self._last = 0.0
+        os.set_blocking(fd, False)
+
+    def __call__(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last < REPORT_INTERVAL:
+            return
+        self._last = now
+        sys.stdout.flush()
+        record = json.dumps({"worker": self._index, **self._stats()}) + "\n"
+        try:
+            os.write(self._fd, record.encode())
+        except BlockingIOError:
+            # Supervisor is behind; the next snapshot supersedes this one
+            pass
+
+class Process:
+    '''
+    One forked worker and the supervisor's ends of its pipes.
+    '''
+
+    def __init__(self, index, pid, log_fd, stats_fd):
+        self.index = index
+        self.pid = pid
+        self.log_fd = log_fd
+        self.stats_fd = stats_fd
+        self.partial = {log_fd: b"", stats_fd: b""}
+        self.stats = {}
+        self.started = time.monotonic()
+
+def run_worker(index, target, stats, stats_fd, inherited):
+    '''
+    Body of a forked worker. Never returns.
+    '''
+    status = 1
+    reporter = None
+    try:
+        for fd in inherited:
+            os.close(fd)
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        reporter = StatsReporter(stats_fd, index, stats)
+        target(reporter)
+        status = 0
+    except KeyboardInterrupt:
+        status = 0
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            if reporter is not None:
+                reporter(force=True)
+            sys.stdout.flush()
+        finally:
+            os._exit(status)
+
+def spawn(index, target, stats, inherited):
+    '''
+    Fork a worker for slot index with its stdout redirected into a log pipe.
+    '''
+    log_r, log_w = os.pipe()
+    stats_r, stats_w = os.pipe()
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.dup2(log_w, 1)
+        run_worker(index, target, stats, stats_w, inherited + [log_r, log_w, stats_r])
+    os.close(log_w)
+    os.close(stats_w)
+    return Process(index, pid, log_r, stats_r)
+
+def supervise(count, target, stats):
+    '''
+    Run count workers until interrupted, restarting any that exit.
+
+    Parameters:
+        count (int): Number of worker processes.
+        target (callable): Worker body, called with a StatsReporter.
+        stats (callable): Returns the calling worker's counters as a dictionary.
+    '''
+    sel = selectors.DefaultSelector()
+    slots = [None] * count
+    retired = Counter()
+    restart_at = [0.0] * count
+    stopping = False
+
+    def inherited():
+        return [key.fd for key in sel.get_map().values()] + [sel.fileno()]
+
+    def totals():
+        total = Counter(retired)
+        for key in sel.get_map().values():
+            if key.fd == key.data.stats_fd:
+                total.update(key.data.stats)
+        return dict(total)
+
+    def start(index):
+        proc = spawn(index, target, stats, inherited())
+        sel.register(proc.log_fd, selectors.EVENT_READ, proc)
+        sel.register(proc.stats_fd, selectors.EVENT_READ, proc)
+        slots[index] = proc
+        restart_at[index] = proc.started + RESTART_DELAY
+
+    def drain(proc, fd):
+        data = os.read(fd, 65536)
+        lines = (proc.partial[fd] + data).split(b"\n")
+        if data:
+            proc.partial[fd] = lines.pop()
+        else:
+            sel.unregister(fd)
+            os.close(fd)
+        if fd == proc.log_fd:
+            out = b"".join(line + b"\n" for line in lines if line)
+            sys.stdout.buffer.write(out)
+            sys.stdout.flush()
+            return
+        for line in lines:
+            try:
+                proc.stats = json.loads(line)
+            except ValueError:
+                # Empty or cut short by a crashing worker
+                continue
+            proc.stats.pop("worker", None)
+        if not data:
+            retired.update({k: v for k, v in proc.stats.items() if k not in GAUGES})
+
+    def reap():
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for index, proc in enumerate(slots):
+                if proc is not None and proc.pid == pid:
+                    slots[index] = None
+                    if not stopping:
+                        print(f"worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting", file=sys.stderr)
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: print(f"stats: {totals()}", file=sys.stderr))
+
+    try:
+        for index in range(count):
+            start(index)
+        while True:
+            for key, _ in sel.select(REPORT_INTERVAL / 2):
+                drain(key.data, key.fd)
+            reap()
+            now = time.monotonic()
+            for index in range(count):
+                if slots[index] is None and now >= restart_at[index]:
+                    start(index)
+    except KeyboardInterrupt:
+        pass
+
+    stopping = True
+    for proc in slots:
+        if proc is not None:
+            try:
+                os.kill(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    deadline = time.monotonic() + SHUTDOWN_GRACE
+    while sel.get_map() and time.monotonic() < deadline:
+        for key, _ in sel.select(deadline - time.monotonic()):
+            drain(key.data, key.fd)
+    for proc in slots:
+        if proc is None:
+            continue
+        if sel.get_map():
+            # Still holding pipes open after the grace period
+            os.kill(proc.pid, signal.SIGKILL)
+        os.waitpid(proc.pid, 0)
+    print(f"stats: {totals()}")
@@ -0,0 +1,83 @@
+'''
+Receive-side CPU time per MB of rdp.py's receiver.
+
+An Endpoint set up like rdp.py's (CRLF text header, its log and its
+ReceiveSink) is fed the SYN, DAT and FIN packets of a whole file in order
+over the loopback network, and the process CPU time of taking them in is
+measured. The ACKs go to a backend nobody reads and the log goes to
+/dev/null. With --no-log the packets are not logged, to show the cost of the
+receive path alone.
+
+usage: python3 bench_receiver.py [--runs N] [--no-log] [--mss N] [--window N] [--flush-threshold N] [file]
+'''
+
+import argparse
+import contextlib
+import filecmp
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, ".."))
+from common.transport import CRLF_CODEC, Endpoint, LoopbackNetwork, TracingBackend
+import rdp
+
+def make_packets(data, mss):
+    packets = [CRLF_CODEC.encode(["SYN"], 0, -1, -1, b"")]
+    for seq in range(1, len(data) + 1, mss):
+        packets.append(CRLF_CODEC.encode(["DAT"], seq, -1, -1, data[seq - 1:seq - 1 + mss]))
+    packets.append(CRLF_CODEC.encode(["FIN"], len(data) + 1, -1, -1, b""))
+    return packets
+
+def run(args, packets, out):
+    network = LoopbackNetwork()
+    backend = network.backend()
+    if not args.no_log:
+        backend = TracingBackend(backend, rdp.log_packet)
+    sink = rdp.ReceiveSink(out, args.window, args.flush_threshold or args.window)
+
+    def handle(connection):
+        data = connection.recv_nowait()
+        if data:
+            sink.write(data)
+
+    receiver = Endpoint(backend, listening=True, window=args.window, payload_length=args.mss, binary=False, text_codec=CRLF_CODEC, handler=handle)
+    sender = network.backend()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.process_time()
+        for packet in packets:
+            sender.sendto(packet, receiver.address)
+            receiver.process()
+            # Let the ACKs not pile up at the sender
+            sender.inbox.clear()
+        sink.close()
+        elapsed = time.process_time() - start
+    receiver.close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", nargs="?", default=os.path.join(HERE, "inputs", "1mb.txt"))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-log", action="store_true", help="leave out the per-packet log")
+    parser.add_argument("--mss", type=int, default=1024, help="payload of one DAT packet (default: %(default)s)")
+    parser.add_argument("--window", type=int, default=2048, help="receive buffer of the receiver (default: %(default)s)")
+    parser.add_argument("--flush-threshold", type=int, help="buffered bytes that trigger a write to the output file (default: the window)")
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as f:
+        data = f.read()
+    packets = make_packets(data, args.mss)
+    with tempfile.TemporaryDirectory() as out_dir:
+        out = os.path.join(out_dir, "out")
+        times = [run(args, packets, out) for _ in range(args.runs)]
+        intact = filecmp.cmp(args.file, out, shallow=False)
+    cpu = statistics.median(times) / (len(data) / 1e6)
+    print(f"rdp.py --mss {args.mss} --window {args.window}: {cpu * 1000:.1f} ms CPU per MB"
+          f"{' without log' if args.no_log else ''}, median of {args.runs}, output {'intact' if intact else 'CORRUPT'}")
+
+if __name__ == "__main__":
+    main()
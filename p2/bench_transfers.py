@@ -0,0 +1,177 @@
+'''
+Transfers of the fixture files through the impairment emulator (echo.py),
+reported as JSON.
+
+Two stacks are measured:
+
+    p2    rdp.py sending to itself through echo.py in echo mode
+    sor   p3's sor-client.py fetching from sor-server.py through echo.py
+          in relay mode (--forward)
+
+For every stack, impairment profile and file the report has the completion
+time (null if the transfer did not finish before the timeout), the goodput,
+the retransmissions of the sender, whether the output matches the input,
+and the emulator's counters.
+
+usage: python3 bench_transfers.py [--stack p2|sor ...] [--profile NAME ...] [--file NAME ...] [--output FILE]
+'''
+
+import argparse
+import filecmp
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+P3 = os.path.join(HERE, "..", "p3")
+# Fixtures of each stack
+FIXTURES = {"p2": os.path.join(HERE, "inputs"), "sor": P3}
+BUFFER_SIZE = 65536
+PAYLOAD_LENGTH = 1024
+
+# echo.py options of each impairment profile
+PROFILES = {
+    "clean": [],
+    "delay": ["--delay", "20", "--jitter", "2"],
+    "loss": ["--delay", "5", "--loss", "2"],
+    "reorder": ["--delay", "5", "--reorder", "5"],
+    "duplicate": ["--delay", "5", "--duplicate", "5"],
+    "capped": ["--delay", "10", "--rate", "8000", "--queue", "65536"],
+}
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def stop(process):
+    '''
+    Terminate a background process and return what it wrote to stderr
+    '''
+    process.terminate()
+    _, err = process.communicate()
+    return err.decode()
+
+def start_emulator(port, profile, seed, forward=None):
+    options = PROFILES[profile] + ["--seed", str(seed)]
+    if forward is not None:
+        options += ["--forward", f"127.0.0.1:{forward}"]
+    process = subprocess.Popen(
+        [sys.executable, "echo.py", "127.0.0.1", str(port), *options],
+        cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    time.sleep(0.3)
+    return process
+
+def run_client(command, cwd, timeout):
+    '''
+    Run a transfer and return its elapsed seconds (None on timeout), exit
+    code and output
+    '''
+    start = time.monotonic()
+    try:
+        result = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        return None, None, e.stdout or b""
+    return time.monotonic() - start, result.returncode, result.stdout
+
+def count_retransmissions(log):
+    '''
+    Count the SYN, DAT and FIN packets of a p2 log sent with a sequence
+    number that was sent before; one packet may carry several, e.g. DAT|FIN
+    '''
+    seen = set()
+    retransmissions = 0
+    for match in re.finditer(r"Send; ((?:SYN|DAT|FIN)(?:\|(?:SYN|DAT|FIN))*); Sequence: (\d+)", log):
+        if match.groups() in seen:
+            retransmissions += 1
+        seen.add(match.groups())
+    return retransmissions
+
+def transfer_p2(profile, path, out, args):
+    echo_port = free_port()
+    emulator = start_emulator(echo_port, profile, args.seed)
+    try:
+        elapsed, code, log = run_client(
+            [sys.executable, "rdp.py", "127.0.0.1", str(free_port()), path, out, "127.0.0.1", str(echo_port), *args.p2_option],
+            HERE, args.timeout)
+    finally:
+        link = stop(emulator)
+    return elapsed, code, count_retransmissions(log.decode(errors="replace")), link
+
+def transfer_sor(profile, path, out, args):
+    server_port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "sor-server.py", "127.0.0.1", str(server_port), str(BUFFER_SIZE), str(PAYLOAD_LENGTH), "--stats", "3600"],
+        cwd=P3, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    proxy_port = free_port()
+    emulator = start_emulator(proxy_port, profile, args.seed, forward=server_port)
+    try:
+        elapsed, code, _ = run_client(
+            [sys.executable, "sor-client.py", "127.0.0.1", str(proxy_port), str(BUFFER_SIZE), str(PAYLOAD_LENGTH),
+             os.path.basename(path), out, "--binary"],
+            P3, args.timeout)
+    finally:
+        link = stop(emulator)
+        totals = dict(re.findall(r"(\w+)=(\d+)", stop(server).splitlines()[-1]))
+    return elapsed, code, int(totals["retransmits"]), link
+
+TRANSFERS = {"p2": transfer_p2, "sor": transfer_sor}
+
+def measure(stack, profile, file_name, args):
+    path = os.path.join(FIXTURES[stack], file_name)
+    size = os.path.getsize(path)
+    with tempfile.TemporaryDirectory() as out_dir:
+        out = os.path.join(out_dir, "out")
+        elapsed, code, retransmissions, link = TRANSFERS[stack](profile, path, out, args)
+        intact = os.path.exists(out) and filecmp.cmp(path, out, shallow=False)
+    return {
+        "stack": stack,
+        "profile": profile,
+        "file": file_name,
+        "bytes": size,
+        "seconds": round(elapsed, 3) if elapsed is not None else None,
+        "goodput_kBps": round(size / elapsed / 1000, 1) if elapsed and intact else None,
+        "retransmissions": retransmissions,
+        "exit_code": code,
+        "intact": intact,
+        "link": json.loads(link.strip().splitlines()[-1]) if link.strip() else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--stack", nargs="+", choices=sorted(TRANSFERS), default=sorted(TRANSFERS))
+    parser.add_argument("--profile", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--file", nargs="+", default=["small.html", "1mb.txt"], help="fixture files (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds before a transfer counts as unfinished (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--p2-option", action="append", default=[], metavar="OPTION", help="pass an option to rdp.py, e.g. --p2-option=--window=65536 (repeatable)")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    for stack in args.stack:
+        for profile in args.profile:
+            for file_name in args.file:
+                results.append(measure(stack, profile, file_name, args))
+                print(f"{stack} {profile} {file_name}: {results[-1]['seconds']} s", file=sys.stderr, flush=True)
+
+    report = {
+        "profiles": {name: PROFILES[name] for name in args.profile},
+        "seed": args.seed,
+        "p2_options": args.p2_option,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
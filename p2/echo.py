@@ -1,24 +1,146 @@
+'''
+UDP echo server that can impair the traffic it passes on.
+
+Without options every datagram goes straight back to its sender, as before.
+The options emulate a bad path on one machine with common/netem.py: random
+loss, a bandwidth cap behind a drop-tail queue, a fixed delay with jitter,
+extra delay for a share of the datagrams so later ones overtake them
+(reordering), and duplication.
+
+With --forward HOST:PORT the server relays instead of echoing: each client
+gets its own socket towards HOST:PORT, and replies arriving there go back to
+that client through the same impairments (each direction has its own queue).
+
+Counters go to stderr as one JSON object on exit (SIGINT or SIGTERM).
+'''
+
+import argparse
+import heapq
+import json
+import os
+import random
+import select
+import signal
 import socket
 import sys
+import time
 
-def show_usage():
-    print("Usage: ./echo.py <host> <port>", file=sys.stderr)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.netem import Link
 
-def main():
-    if len(sys.argv) != 3 or not sys.argv[2].isascii() or not sys.argv[2].isdigit():
-        show_usage()
-        raise SystemExit(1)
+def make_link(args, rng):
+    '''
+    Build one direction of the path from the command line options.
+    '''
+    return Link(
+        rng,
+        loss=args.loss / 100,
+        rate=args.rate * 1000 / 8,
+        queue=args.queue,
+        delay=args.delay / 1000,
+        jitter=args.jitter / 1000,
+        reorder=args.reorder / 100,
+        reorder_delay=args.reorder_delay / 1000,
+        duplicate=args.duplicate / 100,
+    )
+
+class Emulator:
+    '''
+    Echoes or relays datagrams through a Link per direction, holding each one
+    in a heap until it is due.
+    '''
+
+    def __init__(self, sock, args):
+        self._sock = sock
+        self._forward = args.forward
+        rng = random.Random(args.seed)
+        self.uplink = make_link(args, rng)
+        self.downlink = make_link(args, rng)
+        # (due, order, socket, data, address)
+        self._pending = []
+        self._order = 0
+        # Relay mode: client address -> upstream socket, and back
+        self._upstreams = {}
+        self._clients = {}
 
-    host = sys.argv[1]
-    port = int(sys.argv[2])
+    def run(self):
+        while True:
+            now = time.monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                _, _, sock, data, address = heapq.heappop(self._pending)
+                try:
+                    sock.sendto(data, address)
+                except OSError:
+                    # The receiver went away
+                    pass
+            timeout = max(0.0, self._pending[0][0] - now) if self._pending else None
+            readable, _, _ = select.select([self._sock, *self._clients], [], [], timeout)
+            now = time.monotonic()
+            for sock in readable:
+                try:
+                    data, address = sock.recvfrom(65536)
+                except OSError:
+                    continue
+                if sock is self._sock:
+                    self._from_client(data, address, now)
+                else:
+                    self._schedule(self.downlink, data, self._sock, self._clients[sock], now)
+
+    def _from_client(self, data, address, now):
+        if self._forward is None:
+            self._schedule(self.uplink, data, self._sock, address, now)
+            return
+        upstream = self._upstreams.get(address)
+        if upstream is None:
+            upstream = self._upstreams[address] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._clients[upstream] = address
+        self._schedule(self.uplink, data, upstream, self._forward, now)
+
+    def _schedule(self, link, data, sock, address, now):
+        for due in link.send(data, now):
+            self._order += 1
+            heapq.heappush(self._pending, (due, self._order, sock, data, address))
+
+def parse_address(value):
+    host, _, port = value.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"expected HOST:PORT, got {value!r}")
+    return host, int(port)
+
+def stop(signum, frame):
+    sys.exit(0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--loss", type=float, default=0, metavar="PERCENT", help="random loss (default: %(default)s)")
+    parser.add_argument("--delay", type=float, default=0, metavar="MS", help="one-way delay (default: %(default)s)")
+    parser.add_argument("--jitter", type=float, default=0, metavar="MS", help="uniform variation of the delay, +/- (default: %(default)s)")
+    parser.add_argument("--reorder", type=float, default=0, metavar="PERCENT", help="share of datagrams held back by --reorder-delay (default: %(default)s)")
+    parser.add_argument("--reorder-delay", type=float, default=10, metavar="MS", help="extra delay of a reordered datagram (default: %(default)s)")
+    parser.add_argument("--duplicate", type=float, default=0, metavar="PERCENT", help="datagrams delivered twice (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=0, metavar="KBPS", help="bandwidth cap in kbit/s, 0 for none (default: %(default)s)")
+    parser.add_argument("--queue", type=int, default=64 * 1024, metavar="BYTES", help="drop-tail queue in front of the cap (default: %(default)s)")
+    parser.add_argument("--forward", type=parse_address, metavar="HOST:PORT", help="relay to this address instead of echoing")
+    parser.add_argument("--seed", type=int, help="seed of the random draws")
+    args = parser.parse_args()
 
     sock = socket.socket(type=socket.SOCK_DGRAM)
-    sock.bind((host, port))
+    sock.bind((args.host, args.port))
 
-    while True:
-        msg, address = sock.recvfrom(8192)
-        sock.sendto(msg, address)
+    emulator = Emulator(sock, args)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        emulator.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        counters = {"uplink": emulator.uplink.counters}
+        if args.forward is not None:
+            counters["downlink"] = emulator.downlink.counters
+        print(json.dumps(counters), file=sys.stderr, flush=True)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
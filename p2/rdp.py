@@ -3,88 +3,28 @@ Reliable Datagram Protocol (RDP)
 
 A reliable layer on top of UDP. It provides the data transfer between two hosts, the sender and the receiver.
 Given an input file, the sender will read the file and send it to the receiver. The receiver will write the data to an output file.
+
+Both ends run in this one program on one UDP socket: every packet goes to the
+echo server and comes back, so the connection is opened to the echo server's
+address and its own SYN, DAT and FIN packets arrive as the peer's. The
+protocol is the shared RDP engine (common/transport) with the "\r\n" text
+header; this file only adds the per-packet log and the output file. The
+engine keeps the window full of segments of --mss bytes and retransmits
+from one timer for the oldest unacknowledged segment (see RDP in
+common/transport/rdp.py).
 '''
 
 from datetime import datetime
-import socket
-import select
+import argparse
+import os
 import sys
-from enum import Enum
-
-if len(sys.argv) != 5:
-    print("Usage: python3 rdp.py <ip_address> <local_port> <read_file_name> <write_file_name>")
-    sys.exit(1)
-
-ip_address = sys.argv[1]
-port_number = int(sys.argv[2])
-read_file_name = sys.argv[3]
-write_file_name = sys.argv[4]
-
-# Read file into string
-FILE_DATA = ""
-with open(read_file_name, "r") as f:
-    FILE_DATA += f.read()
-
-# Initialize a UDP socket
-udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-udp_sock.bind((ip_address, port_number))
-udp_sock.connect(("h2", 8888))
-
-# Initialize a queue for the sending buffer
-snd_buff = bytearray(2048)
-
-def create_packet(command, seq_num=-1, ack_num=-1, payload=None, window=-1):
-    '''
-    Create a packet with the given information.
-
-    Parameters:
-        command (str): The command of the packet.
-        seq_num (int): The sequence number of the packet.
-        ack_num (int): The acknowledgement number of the packet.
-        payload (str): The payload of the packet.
-        window (int): The window size of the packet.
-
-    Returns:
-        packet (string): The packet in string format:
 
-        CMD
-        Header: value
-        Header: value
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import CRLF_CODEC, Endpoint, TracingBackend, UdpBackend
+from common.transport.rdp import decode_packet
 
-        PAYLOAD
-    '''
-
-    packet = f"{command}\r\n"
-    if seq_num != -1:
-        packet += f"Sequence: {seq_num}\r\n"
-    if ack_num != -1:
-        packet += f"Acknowledgment: {ack_num}\r\n"
-    if window != -1:
-        packet += f"Window: {window}\r\n\r\n"
-    if payload is not None:
-        packet += f"Length: {len(payload)}\r\n\r\n"
-        packet += f"{payload}\r\n"
-    elif window == -1:
-        packet += "Length: 0\r\n\r\n"
-
-    return packet
-
-def send_packet(packet, sender=True):
-    '''
-    Send a packet to the echo server. Additionally logs the information of the packet.
-
-    Parameters:
-        packet (string): The packet to send.
-        sender (bool): Whether the packet is sent by the sender or receiver.
-
-    Returns:
-        bytes_sent (int): The number of bytes sent.
-    '''
-
-    command, seq_num, ack_num, window, payload = parse_packet(packet)
-    send_log(command, sender, seq_num, len(payload if payload else ""), ack_num, window)
-    bytes_sent = udp_sock.send(packet)
-    return bytes_sent
+# Commands of the sending role; the ACK belongs to the receiving role
+DATA_COMMANDS = ("SYN", "DAT", "FIN")
 
 def receive_log(command, sender=True, seq_num=-1, length=-1, ack_num=-1, window=-1):
     '''
@@ -126,196 +66,144 @@ def send_log(command, sender=True, seq_num=-1, length=-1, ack_num=-1, window=-1)
     else:
         print(f"{time}: Send; {command}; Acknowledgement: {ack_num}; Window: {window}")
 
-def write_to_byte_array(byte_array, data, offset=0):
+def log_packet(packet, sent):
     '''
-    Write the data to the byte array at the given offset.
-
-    Parameters:
-        byte_array (bytearray): The byte array to write to.
-        data (str): The data to write.
-        offset (int): The offset to write to.
-    '''
-
-    for i in range(len(data)):
-        curr = data[i] if type(data[i]) is int else ord(data[i])
-        byte_array[offset + i] = curr
+    Log a packet as the sender and receiver roles see it.
 
-def parse_packet(packet):
-    '''
-    Parse the packet and return the information of the packet.
+    A packet may carry data (SYN, DAT, FIN) and an acknowledgement at once.
+    The data is logged as the sender's packet, the ACK as the receiver's.
 
     Parameters:
-        packet (string): The packet to parse.
-
-    Returns:
-        command (str): The command of the packet.
-        seq_num (int): The sequence number of the packet.
-        ack_num (int): The acknowledgement number of the packet.
-        window (int): The window size of the packet.
-        payload (str): The payload of the packet.
+        packet (bytes): The packet.
+        sent (bool): Whether the packet is being sent or was received.
     '''
 
-    lines = packet.decode("utf-8").split("\r\n")
-    command = lines[0]
-    seq_num = -1
-    ack_num = -1
-    window = -1
-    payload = None
-    for line in lines:
-        if line.startswith("Sequence"):
-            seq_num = int(line.split(": ")[1])
-        elif line.startswith("Acknowledgment"):
-            ack_num = int(line.split(": ")[1])
-        elif line.startswith("Window"):
-            window = int(line.split(": ")[1])
-        elif line.startswith("Length"):
-            payload = lines[-2]
-
-    return command, seq_num, ack_num, window, payload
+    try:
+        commands, seq_num, length, ack_num, window, _, _ = decode_packet(packet)
+    except ValueError:
+        return
+    log = send_log if sent else receive_log
+    data = "|".join(command for command in commands if command in DATA_COMMANDS)
+    if data:
+        # Sent data is the sender's, received data is for the receiver
+        log(data, sent, seq_num=seq_num, length=length)
+    if "ACK" in commands and ack_num != -1 and not (data and length):
+        log("ACK", not sent, ack_num=ack_num, window=window)
 
-class State(Enum):
+class ReceiveSink:
     '''
-    The state of the sender.
-    '''
-    CLOSED = 0
-    SYN_SENT = 1
-    OPEN = 2
-    FIN_SENT = 3
-
-class rdp_sender:
-    '''
-    The sender of the reliable data transfer protocol.
-    '''
-
-    def __init__(self):
-        self._state = State.CLOSED
-        self._ack = 0
-        self._window = 0
-
-    def _send(self):
-        if self._state == State.SYN_SENT:
-            packet = create_packet("SYN", 0)
-            write_to_byte_array(snd_buff, packet)
-        if self._state == State.OPEN:
-            # If all the data has been sent, close
-            if self._ack >= len(FILE_DATA):
-                self.close()
-
-            max_send = min(self._window, 1024)
-            # Get the next max_send bytes of data
-            payload = FILE_DATA[(self._ack - 1):self._ack + max_send - 1]
-            packet = create_packet("DAT", self._ack, payload=payload)
-            write_to_byte_array(snd_buff, packet)
-        if self._state == State.FIN_SENT:
-            packet = create_packet("FIN", self._ack)
-            write_to_byte_array(snd_buff, packet)
-
-    def open(self):
-        '''
-        Open the connection.
-        '''
+    The receiver's output file, written in batches from a fixed buffer.
 
-        self._state = State.SYN_SENT
-        self._send()
+    The file stays open for the whole transfer. Delivered bytes are copied
+    into a preallocated bytearray, which is written out once it holds the
+    flush threshold. Data that does not fit in the buffer is written together
+    with what is buffered in one os.writev call, without copying it first.
 
-    def receive_ack(self, ack):
-        '''
-        Receive an acknowledgement.
-        '''
-
-        # Parse ack
-        command, _, ack_num, window, __ = parse_packet(ack)
-        receive_log(command, True, ack_num=ack_num, window=window)
-        self._ack = ack_num
-        self._window = window
-        if self._state == State.SYN_SENT:
-            self._state = State.OPEN
-            self._send()
-        if self._state == State.FIN_SENT:
-            self._state = State.CLOSED
-            exit(0)
-        if self._state == State.OPEN:
-            self._send()
-
-    def timeout(self):
-        pass
+    Parameters:
+        file_name (str): The file to create.
+        capacity (int): The size of the buffer.
+        flush_threshold (int): Buffered bytes that trigger a write.
+    '''
+
+    def __init__(self, file_name, capacity, flush_threshold):
+        self._fd = os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._length = 0
+        self._flush_threshold = min(flush_threshold, capacity)
+        self.writes = 0
+
+    def write(self, data):
+        end = self._length + len(data)
+        if end > len(self._buffer):
+            self._writev([self._view[:self._length], data])
+            self._length = 0
+            return
+        self._buffer[self._length:end] = data
+        self._length = end
+        if end >= self._flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if self._length:
+            self._writev([self._view[:self._length]])
+            self._length = 0
 
     def close(self):
-        '''
-        Close the connection.
-        '''
-
-        self._state = State.FIN_SENT
-        self._send()
-
-    def get_state(self):
-        '''
-        Get the state of the sender.
-        '''
-
-        return self._state
-
-class rdp_receiver:
-    '''
-    The receiver of the reliable data transfer protocol.
-    '''
-
-    def __init__(self):
-        self._window = 2048
-        self._rcv_buff = ""
+        self.flush()
+        os.close(self._fd)
+
+    def _writev(self, buffers):
+        written = os.writev(self._fd, buffers)
+        self.writes += 1
+        # Finish a short write one buffer at a time
+        for buffer in buffers:
+            if written >= len(buffer):
+                written -= len(buffer)
+                continue
+            rest = memoryview(buffer)[written:]
+            while rest:
+                rest = rest[os.write(self._fd, rest):]
+                self.writes += 1
+            written = 0
+
+def transfer(backend, echo_address, read_file_name, write_file_name, mss=1024, window=2048, flush_threshold=None):
+    '''
+    Send read_file_name through the echo server and write what comes back
+    to write_file_name.
 
-    def receive_data(self, data):
-        '''
-        Receive data from the sender.
-        '''
+    Parameters:
+        backend: The datagram backend to send from, e.g. a UdpBackend.
+        echo_address (tuple): The echo server reflecting every packet.
+        read_file_name (str): The file to send.
+        write_file_name (str): The file to create with the received data.
+        mss (int): Largest payload of one DAT packet.
+        window (int): Receive window advertised to the peer, which stays
+            the same for the whole transfer, and the size of the output
+            buffer.
+        flush_threshold (int): Buffered bytes that trigger a write to the
+            output file, defaults to the window.
 
-        command, seq_num, ack_num, window, payload = parse_packet(data)
-        receive_log(command, False, seq_num=seq_num, length=len(payload))
-        # Decrease the window
-        self._window -= len(payload)
-        # If the window is 0, empty the buffer to file
-        if self._window == 0 and len(payload) > 0 or command == "FIN":
-            # Write to file
-            with open(write_file_name, "a") as f:
-                f.write(self._rcv_buff)
-            # Reset the buffer and window
-            self._rcv_buff = ""
-            self._window = 2048
-        if len(payload) > 0:
-            # Add to buffer
-            self._rcv_buff += payload
-        padding = len(payload) - 1 if len(payload) > 0 else 0
-        packet = create_packet("ACK", ack_num=seq_num + padding + 1, window=self._window)
-        send_packet(packet.encode(), False)
+    Returns:
+        connection (Connection): The closed connection, for its counters.
+    '''
+
+    endpoint = Endpoint(TracingBackend(backend, log_packet), window=window, payload_length=mss, binary=False, text_codec=CRLF_CODEC)
+    sink = ReceiveSink(write_file_name, window, flush_threshold or window)
+    try:
+        connection = endpoint.open(echo_address)
+        # The file is read a segment at a time as the window opens
+        connection.sendfile(open(read_file_name, "rb"))
+        connection.close()
+        data = connection.recv()
+        while data:
+            sink.write(data)
+            data = connection.recv()
+        connection.wait_closed()
+    finally:
+        sink.close()
+        endpoint.close()
+    return connection
 
 def main():
     '''
     The main function.
     '''
 
-    sender = rdp_sender()
-    receiver = rdp_receiver()
-    sender.open()
-
-    while True:
-        readable, writable, exceptional = select.select([udp_sock], [udp_sock], [udp_sock], 0.1)
-
-        if udp_sock in readable:
-            message, _ = udp_sock.recv(8192)
-            command, _, __, ___, ____ = parse_packet(message)
-            if command == "ACK":
-                sender.receive_ack(message)
-            else:
-                receiver.receive_data(message)
-
-        if udp_sock in writable:
-            # If snd_buff is not all 0s, send it then empty it
-            if any(snd_buff):
-                send_packet(snd_buff)
-                snd_buff[:] = [0] * len(snd_buff)
-
-        if udp_sock in exceptional:
-            print("exceptional")
+    parser = argparse.ArgumentParser(description="Send read_file_name to write_file_name over RDP through an echo server")
+    parser.add_argument("ip_address")
+    parser.add_argument("local_port", type=int)
+    parser.add_argument("read_file_name")
+    parser.add_argument("write_file_name")
+    parser.add_argument("echo_ip_address", nargs="?", default="h2")
+    parser.add_argument("echo_port", nargs="?", type=int, default=8888)
+    parser.add_argument("--mss", type=int, default=1024, help="largest payload of one DAT packet (default: %(default)s)")
+    parser.add_argument("--window", type=int, default=2048, help="receive window advertised to the sender and size of the output buffer (default: %(default)s)")
+    parser.add_argument("--flush-threshold", type=int, help="buffered bytes that trigger a write to the output file (default: the window)")
+    args = parser.parse_args()
+
+    transfer(UdpBackend((args.ip_address, args.local_port)), (args.echo_ip_address, args.echo_port),
+             args.read_file_name, args.write_file_name, args.mss, args.window, args.flush_threshold)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,39 @@
+'''
+Packets per second for encoding and decoding RDP headers in the text and
+binary wire formats.
+
+usage: python3 bench_codec.py [seconds_per_case] [payload_length]
+'''
+
+import sys
+import time
+
+from rdp import TEXT_CODEC, BINARY_CODEC, decode_packet
+
+def rate(fn, seconds):
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for _ in range(1000):
+            fn()
+        count += 1000
+    return count / (time.perf_counter() - start)
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    payload_length = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    payload = (b"0123456789abcdef\r\n" * (payload_length // 18 + 1))[:payload_length]
+    commands = ["DAT", "ACK"]
+
+    print(f"payload: {payload_length} bytes")
+    print(f"{'format':<8} {'encode pkt/s':>14} {'decode pkt/s':>14} {'header bytes':>13}")
+    for name, codec in (("text", TEXT_CODEC), ("binary", BINARY_CODEC)):
+        packet = codec.encode(commands, 123456, 654321, 5120, payload)
+        assert bytes(decode_packet(packet)[5]) == payload
+        encode = rate(lambda: codec.encode(commands, 123456, 654321, 5120, payload), seconds)
+        decode = rate(lambda: decode_packet(packet), seconds)
+        print(f"{name:<8} {encode:>14,.0f} {decode:>14,.0f} {len(packet) - payload_length:>13}")
+
+if __name__ == "__main__":
+    main()
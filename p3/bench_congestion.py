@@ -0,0 +1,198 @@
+'''
+Goodput and fairness of concurrent SoR transfers through one lossy path.
+
+A UDP proxy between the clients and sor-server.py emulates the bottleneck:
+each direction is a common/netem.py link drained at a fixed rate behind a
+drop-tail queue, followed by a one-way delay, with random loss on top. All clients download
+the same file at once. For every congestion control the script reports the
+aggregate goodput and Jain's fairness index over the per-client goodput
+(1.0 means every transfer got the same share).
+
+server(), bottleneck() and client() are shared with the other p3
+benchmarks.
+
+usage: python3 bench_congestion.py [--clients N] [--rate KBPS] [--delay MS] [--loss PERCENT] [file]
+'''
+
+import argparse
+import asyncio
+import contextlib
+import filecmp
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.netem import Link
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUFFER_SIZE = 65536
+PAYLOAD_LENGTH = 1024
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Upstream(asyncio.DatagramProtocol):
+    def __init__(self, proxy, client_address):
+        self._proxy = proxy
+        self._client_address = client_address
+
+    def datagram_received(self, data, address):
+        self._proxy.forward(self._proxy.downlink, data, lambda data: self._proxy.transport.sendto(data, self._client_address))
+
+class Proxy(asyncio.DatagramProtocol):
+    '''
+    Forwards each client through its own upstream socket to the server.
+    '''
+
+    def __init__(self, server_address, uplink, downlink):
+        self._server_address = server_address
+        self.uplink = uplink
+        self.downlink = downlink
+        self.transport = None
+        # Key is the client address, value is its upstream transport (or a
+        # list of datagrams waiting for it to open)
+        self._upstreams = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, client_address):
+        upstream = self._upstreams.get(client_address)
+        if upstream is None:
+            self._upstreams[client_address] = [data]
+            asyncio.ensure_future(self._open(client_address))
+        elif isinstance(upstream, list):
+            upstream.append(data)
+        else:
+            self.forward(self.uplink, data, upstream.sendto)
+
+    async def _open(self, client_address):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: Upstream(self, client_address), remote_addr=self._server_address)
+        pending = self._upstreams[client_address]
+        self._upstreams[client_address] = transport
+        for data in pending:
+            self.forward(self.uplink, data, transport.sendto)
+
+    def forward(self, link, data, deliver):
+        '''
+        Pass data through link and call deliver with it when it comes out.
+        '''
+        loop = asyncio.get_running_loop()
+        for due in link.send(data, loop.time()):
+            loop.call_at(due, deliver, data)
+
+    def close(self):
+        for upstream in self._upstreams.values():
+            if not isinstance(upstream, list):
+                upstream.close()
+
+@contextlib.asynccontextmanager
+async def server(*options, stderr=None, startup=0.5):
+    '''
+    Run sor-server.py with options on a free port and yield the port and
+    the process. The server is terminated on the way out unless it already
+    exited.
+    '''
+    port = free_port()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "sor-server.py", "127.0.0.1", str(port), str(BUFFER_SIZE), str(PAYLOAD_LENGTH), *options,
+        cwd=HERE, stdout=asyncio.subprocess.DEVNULL, stderr=stderr)
+    await asyncio.sleep(startup)
+    try:
+        yield port, process
+    finally:
+        if process.returncode is None:
+            process.terminate()
+        await process.wait()
+
+@contextlib.asynccontextmanager
+async def bottleneck(server_port, rng, rate, delay, queue, loss):
+    '''
+    Run the proxy emulating the path to the server and yield its port and
+    the downlink, for its counters.
+
+    Parameters:
+        rate (float): Bottleneck rate in kbit/s.
+        delay (float): One-way delay in ms.
+        queue (int): Bottleneck queue in bytes.
+        loss (float): Random loss in percent.
+    '''
+    rate = rate * 1000 / 8
+    uplink = Link(rng, loss=loss / 100, rate=rate, queue=queue, delay=delay / 1000)
+    downlink = Link(rng, loss=loss / 100, rate=rate, queue=queue, delay=delay / 1000)
+    loop = asyncio.get_running_loop()
+    transport, proxy = await loop.create_datagram_endpoint(
+        lambda: Proxy(("127.0.0.1", server_port), uplink, downlink), local_addr=("127.0.0.1", 0))
+    try:
+        yield transport.get_extra_info("sockname")[1], downlink
+    finally:
+        proxy.close()
+        transport.close()
+
+async def client(index, proxy_port, file_name, out_dir, timeout, *options):
+    '''
+    Download file_name with sor-client.py and return the seconds it took,
+    or None if it failed, timed out or the copy differs.
+    '''
+    out = os.path.join(out_dir, f"{index}.out")
+    start = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "sor-client.py", "127.0.0.1", str(proxy_port), str(BUFFER_SIZE), str(PAYLOAD_LENGTH), file_name, out, *options,
+        cwd=HERE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return None
+    elapsed = time.monotonic() - start
+    if process.returncode != 0 or not filecmp.cmp(os.path.join(HERE, file_name), out, shallow=False):
+        return None
+    return elapsed
+
+async def run(controller, args):
+    rng = random.Random(args.seed)
+    async with server("--congestion", controller) as (server_port, _), \
+            bottleneck(server_port, rng, args.rate, args.delay, args.queue, args.loss) as (proxy_port, downlink):
+        with tempfile.TemporaryDirectory() as out_dir:
+            results = await asyncio.gather(*(
+                client(i, proxy_port, args.file, out_dir, args.timeout) for i in range(args.clients)))
+    return results, downlink
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", nargs="?", default="1mb.txt", help="file every client downloads (default: %(default)s)")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=8000, help="bottleneck rate in kbit/s (default: %(default)s)")
+    parser.add_argument("--delay", type=float, default=10, help="one-way delay in ms (default: %(default)s)")
+    parser.add_argument("--loss", type=float, default=1, help="random loss in percent (default: %(default)s)")
+    parser.add_argument("--queue", type=int, default=64 * 1024, help="bottleneck queue in bytes (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds before a transfer counts as failed (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--congestion", nargs="+", default=["none", "reno", "cubic"])
+    args = parser.parse_args()
+
+    size = os.path.getsize(os.path.join(HERE, args.file))
+    print(f"{args.clients} x {args.file} ({size} bytes), {args.rate:g} kbit/s, {args.delay:g} ms, {args.loss:g}% loss, {args.queue} byte queue")
+    print(f"{'control':<8} {'done':>5} {'goodput KB/s':>13} {'min KB/s':>9} {'max KB/s':>9} {'fairness':>9} {'lost':>6} {'dropped':>8}")
+    for controller in args.congestion:
+        results, downlink = asyncio.run(run(controller, args))
+        rates = [size / elapsed / 1000 for elapsed in results if elapsed is not None]
+        done = f"{len(rates)}/{args.clients}"
+        if not rates:
+            print(f"{controller:<8} {done:>5}")
+            continue
+        total = len(rates) * size / max(elapsed for elapsed in results if elapsed is not None) / 1000
+        fairness = sum(rates) ** 2 / (len(rates) * sum(r * r for r in rates))
+        print(f"{controller:<8} {done:>5} {total:>13,.1f} {min(rates):>9,.1f} {max(rates):>9,.1f} {fairness:>9.3f} {downlink.counters['lost']:>6} {downlink.counters['dropped']:>8}")
+
+if __name__ == "__main__":
+    main()
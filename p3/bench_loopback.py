@@ -0,0 +1,105 @@
+'''
+Transfers per second through common/transport, over the in-process loopback
+network and over real UDP sockets.
+
+Every transfer is a full connection: the client connects and sends a short
+request, the server accepts it, reads it, sends the file back and closes,
+and the client reads to the end and waits for the close handshake. On the
+loopback network both ends run in this thread; over UDP the server runs in
+a second thread.
+
+usage: python3 bench_loopback.py [--seconds S] [file ...]
+'''
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import LoopbackNetwork, UdpBackend, connect, listen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REQUEST = b"GET / HTTP/1.0\r\n\r\n"
+
+def serve(server, body, timeout=None):
+    connection = server.accept(timeout)
+    connection.recv()
+    connection.send(body)
+    connection.close()
+    return connection
+
+def read_all(client):
+    '''
+    Read until the server closes, close in turn and return the byte count
+    '''
+    received = 0
+    chunk = client.recv()
+    while chunk:
+        received += len(chunk)
+        chunk = client.recv()
+    client.close()
+    client.wait_closed(timeout=5)
+    return received
+
+def loopback(body, seconds):
+    network = LoopbackNetwork()
+    server = listen(backend=network.backend())
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        backend = network.backend()
+        client = connect(server.address, backend=backend)
+        client.send(REQUEST)
+        serve(server, body)
+        assert read_all(client) == len(body)
+        backend.endpoint.close()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def udp(body, seconds):
+    server = listen(("127.0.0.1", 0))
+    stop = threading.Event()
+
+    def run():
+        while not stop.is_set():
+            try:
+                serve(server, body, timeout=0.2).wait_closed(timeout=5)
+            except TimeoutError:
+                continue
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    count = 0
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < seconds:
+            backend = UdpBackend(("127.0.0.1", 0))
+            client = connect(server.address, backend=backend)
+            client.send(REQUEST)
+            assert read_all(client) == len(body)
+            backend.endpoint.close()
+            count += 1
+    finally:
+        stop.set()
+        thread.join()
+        server.close()
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="*", default=["small.html", "1mb.txt"])
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    print(f"{'file':<12} {'bytes':>9} {'loopback/s':>11} {'udp/s':>8} {'loopback MB/s':>14} {'udp MB/s':>9}")
+    for file_name in args.files:
+        with open(os.path.join(HERE, file_name), "rb") as f:
+            body = f.read()
+        rates = [loopback(body, args.seconds), udp(body, args.seconds)]
+        mbps = [rate * len(body) / 1e6 for rate in rates]
+        print(f"{file_name:<12} {len(body):>9} {rates[0]:>11,.1f} {rates[1]:>8,.1f} {mbps[0]:>14,.1f} {mbps[1]:>9,.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+'''
+Transfer time of one SoR download split into K byte ranges over K parallel
+RDP connections, behind a long-delay path.
+
+Uses the bottleneck proxy of bench_congestion.py. One connection moves
+at most one receive buffer per round trip, so on a path whose
+bandwidth-delay product exceeds the buffer, K connections can carry up to K
+times as much. Each case is repeated and the median time is reported.
+
+usage: python3 bench_parallel.py [--runs N] [--rate KBPS] [--delay MS] [--loss PERCENT] [file] [K ...]
+'''
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+
+from bench_congestion import HERE, bottleneck, client, server
+
+async def run(parallel, seed, args):
+    rng = random.Random(seed)
+    async with server() as (server_port, _), \
+            bottleneck(server_port, rng, args.rate, args.delay, args.queue, args.loss) as (proxy_port, _):
+        with tempfile.TemporaryDirectory() as out_dir:
+            return await client(0, proxy_port, args.file, out_dir, args.timeout, "--binary", "--parallel", str(parallel))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", nargs="?", default="1mb.txt", help="file to download (default: %(default)s)")
+    parser.add_argument("parallel", nargs="*", type=int, default=[1, 2, 4, 8], help="connection counts (default: 1 2 4 8)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=100000, help="bottleneck rate in kbit/s (default: %(default)s)")
+    parser.add_argument("--delay", type=float, default=50, help="one-way delay in ms (default: %(default)s)")
+    parser.add_argument("--loss", type=float, default=0, help="random loss in percent (default: %(default)s)")
+    parser.add_argument("--queue", type=int, default=1024 * 1024, help="bottleneck queue in bytes (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds before a transfer counts as failed (default: %(default)s)")
+    args = parser.parse_args()
+
+    size = os.path.getsize(os.path.join(HERE, args.file))
+    print(f"{args.file} ({size} bytes), {args.rate:g} kbit/s, {args.delay:g} ms, {args.loss:g}% loss, median of {args.runs}")
+    print(f"{'K':>3} {'seconds':>8} {'KB/s':>8} {'speedup':>8}")
+    base = None
+    for parallel in args.parallel:
+        times = [asyncio.run(run(parallel, seed, args)) for seed in range(args.runs)]
+        finished = [t for t in times if t is not None]
+        if len(finished) * 2 <= len(times):
+            print(f"{parallel:>3} {'failed':>8}")
+            continue
+        median = statistics.median(finished)
+        base = base or median
+        print(f"{parallel:>3} {median:>8.2f} {size / median / 1000:>8,.1f} {base / median:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
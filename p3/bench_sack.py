@@ -0,0 +1,54 @@
+'''
+Transfer time of one SoR download at several random loss rates, with and
+without selective acknowledgements.
+
+Uses the bottleneck proxy of bench_congestion.py. Each case is repeated
+with different loss patterns and the median time is reported; transfers that
+do not finish within the timeout are counted as failed.
+
+usage: python3 bench_sack.py [--runs N] [--rate KBPS] [--delay MS] [file] [loss_percent ...]
+'''
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+
+from bench_congestion import HERE, bottleneck, client, server
+
+async def run(sack, loss, seed, args):
+    options = [] if sack else ["--no-sack"]
+    rng = random.Random(seed)
+    async with server(*options) as (server_port, _), \
+            bottleneck(server_port, rng, args.rate, args.delay, args.queue, loss) as (proxy_port, _):
+        with tempfile.TemporaryDirectory() as out_dir:
+            return await client(0, proxy_port, args.file, out_dir, args.timeout)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", nargs="?", default="1mb.txt", help="file to download (default: %(default)s)")
+    parser.add_argument("loss", nargs="*", type=float, default=[1, 5, 10], help="loss rates in percent (default: 1 5 10)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=8000, help="bottleneck rate in kbit/s (default: %(default)s)")
+    parser.add_argument("--delay", type=float, default=10, help="one-way delay in ms (default: %(default)s)")
+    parser.add_argument("--queue", type=int, default=64 * 1024, help="bottleneck queue in bytes (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before a transfer counts as failed (default: %(default)s)")
+    args = parser.parse_args()
+
+    size = os.path.getsize(os.path.join(HERE, args.file))
+    print(f"{args.file} ({size} bytes), {args.rate:g} kbit/s, {args.delay:g} ms, median of {args.runs}")
+    print(f"{'loss':>5} {'no sack s':>10} {'sack s':>8} {'speedup':>8}")
+    for loss in args.loss:
+        medians = []
+        for sack in (False, True):
+            times = [asyncio.run(run(sack, loss, seed, args)) for seed in range(args.runs)]
+            finished = [t for t in times if t is not None]
+            medians.append(statistics.median(finished) if len(finished) * 2 > len(times) else None)
+        cells = [f"{m:.2f}" if m is not None else "failed" for m in medians]
+        speedup = f"{medians[0] / medians[1]:.1f}x" if None not in medians else ""
+        print(f"{loss:>4g}% {cells[0]:>10} {cells[1]:>8} {speedup:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+'''
+Datagrams per second of the SoR server with one or more worker processes.
+
+Many clients download the same file at once straight over loopback, with
+no emulated bottleneck, so the server's CPU is the limit. The server is run
+with --stats and its totals, summed over all workers, give the datagrams it
+received and sent during the run.
+
+Clients run on the same machine and compete with the workers for the CPU, so
+scaling shows only on a box with more cores than workers.
+
+usage: python3 bench_workers.py [--clients N] [--runs N] [file] [workers ...]
+'''
+
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+from bench_congestion import BUFFER_SIZE, HERE, PAYLOAD_LENGTH, server
+
+async def run(workers, args):
+    async with server("--workers", str(workers), "--stats", "3600", stderr=asyncio.subprocess.PIPE, startup=0.5 + 0.1 * workers) as (server_port, process):
+        with tempfile.TemporaryDirectory() as out_dir:
+            start = time.monotonic()
+            clients = [await asyncio.create_subprocess_exec(
+                sys.executable, "sor-client.py", "127.0.0.1", str(server_port), str(BUFFER_SIZE), str(PAYLOAD_LENGTH),
+                args.file, os.path.join(out_dir, f"{i}.out"), "--binary",
+                cwd=HERE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL) for i in range(args.clients)]
+            codes = await asyncio.gather(*(client.wait() for client in clients))
+            elapsed = time.monotonic() - start
+        # The totals are printed on exit
+        process.terminate()
+        _, err = await process.communicate()
+    totals = dict(re.findall(r"(\w+)=(\d+)", err.decode().splitlines()[-1]))
+    datagrams = int(totals["datagrams_received"]) + int(totals["datagrams_sent"])
+    return datagrams / elapsed, codes.count(0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("file", nargs="?", default="1mb.txt", help="file every client downloads (default: %(default)s)")
+    parser.add_argument("workers", nargs="*", type=int, default=[1, 2, 4], help="worker counts (default: 1 2 4)")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.clients} x {args.file}, {os.cpu_count()} CPUs, median of {args.runs}")
+    print(f"{'workers':>7} {'datagrams/s':>12} {'scaling':>8} {'done':>6}")
+    base = None
+    for workers in args.workers:
+        results = [asyncio.run(run(workers, args)) for _ in range(args.runs)]
+        rate = statistics.median(rate for rate, _ in results)
+        base = base or rate
+        done = f"{min(done for _, done in results)}/{args.clients}"
+        print(f"{workers:>7} {rate:>12,.0f} {rate / base:>7.2f}x {done:>6}")
+
+if __name__ == "__main__":
+    main()
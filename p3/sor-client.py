@@ -1,37 +1,100 @@
 """
 python3 sor-client.py server_ip_address server_udp_port_number client_buffer_size client_payload_length read_file_name write_file_name [read_file_name write_file_name]*
 If there are multiple pairs of read_file_name and write_file_name in the command line, it indicates that the SoR client shall request these files from the SoR server in a persistent HTTP session over an RDP connection
+With --parallel K a single file is downloaded as K byte ranges over K RDP connections, each from its own UDP port
 """
 
+import os
 import sys
-import socket
 import select
-from rdp import RDP, State
+import argparse
+from collections import deque
 from datetime import datetime
 import re
 
-buff = []
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import Endpoint, TracingBackend, UdpBackend
+from common.transport.rdp import decode_packet
 
-response_pattern = r"HTTP\/1.0(.*)(\r\n|\n)Connection:(.*)(\r\n|\n)Content-Length:\s(\d+)(\r\n|\n)(\r\n|\n)(.*)"
+buff = []
 
-def process_response(response):
+class ResponseWriter:
     '''
-    Processes a HTTP response and returns the payload
+    Writes the body of one HTTP response to a file as it arrives.
+
+    The header is collected up to the blank line that ends it. Then the output
+    file is created at its Content-Length and every chunk after that goes
+    straight to the file, instead of being held until the connection closes.
+    Content-Length also marks where the next pipelined response begins.
+
+    A 206 response is one byte range of the file and is written at the offset
+    its Content-Range gives. With create=False the file was already created
+    at its full size by the writer of another range and is only opened.
+
+    Any other status (400, 404, 416) writes no file and sets failed; the
+    header still ends at its blank line, so the next response is read as usual.
     '''
-    # Get rid of empty line at start of response if it is there
-    response = response[2:] if response[:2] == "\r\n" else response
-    response = response[1:] if response[0] == "\n" else response
-    # print("=========================================")
-    # print(response)
-    # print("=========================================")
-    if re.match(response_pattern, response, re.S):
-        match = re.match(response_pattern, response, re.S)
-        length = int(match.group(5))
-        payload = match.group(8)
-        return payload, length
-    else:
-        # print("Not matched")
-        return response, 0
+
+    def __init__(self, file_name, create=True):
+        self._file_name = file_name
+        self._create = create
+        self._header = b""
+        self._header_done = False
+        self._file = None
+        self.length = 0
+        self.written = 0
+        # Size of the whole file, known once the header has arrived
+        self.total = None
+        self.done = False
+        self.failed = False
+
+    def status(self):
+        '''
+        Returns the status code of the response, or None if it has not arrived yet
+        '''
+        match = re.match(rb"HTTP/1.0 (\d{3})", self._header)
+        return match.group(1).decode() if match else None
+
+    def feed(self, data):
+        '''
+        Takes the next bytes of the response stream and returns whatever lies
+        beyond the end of this response
+        '''
+        if not self._header_done:
+            self._header += data
+            end = self._header.find(b"\r\n\r\n")
+            if end == -1:
+                return b""
+            self._header_done = True
+            data = self._header[end + 4:]
+            self._header = self._header[:end + 2]
+            match = re.search(rb"Content-Length:\s(\d+)\r\n", self._header)
+            self.length = int(match.group(1)) if match else 0
+            if self.status() == "200":
+                self.total = self.length
+                self._file = open(self._file_name, "wb")
+                self._file.truncate(self.length)
+            elif self.status() == "206":
+                match = re.search(rb"Content-Range:\sbytes\s(\d+)-\d+/(\d+)\r\n", self._header)
+                self.total = int(match.group(2))
+                self._file = open(self._file_name, "wb" if self._create else "r+b")
+                if self._create:
+                    self._file.truncate(self.total)
+                self._file.seek(int(match.group(1)))
+            else:
+                self.failed = True
+        body = data[:self.length - self.written]
+        if self._file is not None:
+            self._file.write(body)
+        self.written += len(body)
+        if self.written == self.length:
+            self.close()
+        return data[len(body):]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self.done = self._header_done and self.written == self.length
 
 def log(commands, send=True, seq_num=-1, length=-1, ack_num=-1, window=-1):
     '''
@@ -52,72 +115,158 @@ def log(commands, send=True, seq_num=-1, length=-1, ack_num=-1, window=-1):
     joined_commands = "|".join(commands)
     print(f"{time}: {send_receive}; {joined_commands}; Sequence: {seq_num}; Length: {length}; Acknowledgement: {ack_num}; Window: {window}")
 
-def main():
-    # Check for correct number of arguments
-    if len(sys.argv) < 7 or len(sys.argv) % 2 != 1:
-        print("Usage: python3 sor-client.py server_ip_address server_udp_port_number client_buffer_size client_payload_length read_file_name write_file_name [read_file_name write_file_name]*")
-        print("* If there are multiple pairs of read_file_name and write_file_name in the command line, it indicates that the SoR client shall request these files from the SoR server in a persistent HTTP session over an RDP connection")
-        sys.exit(1)
+def log_packet(packet, send):
+    '''
+    Log a packet sent to or received from the server, skipping datagrams
+    that are not RDP packets
+    '''
+    try:
+        commands, seq_num, length, ack_num, window, _, _ = decode_packet(packet)
+    except ValueError:
+        return
+    log(commands, send, seq_num, length, ack_num, window)
+
+class Connection:
+    '''
+    One RDP connection to the server and the responses still expected on it.
+
+    Every connection has its own Endpoint on its own UDP socket, so the
+    server sees a separate source port and keeps a separate session for each.
+    '''
+
+    def __init__(self, server_address, buffer_size, payload_length, binary):
+        self.backend = TracingBackend(UdpBackend(), log_packet)
+        self.endpoint = Endpoint(self.backend, window=buffer_size, payload_length=payload_length, binary=binary)
+        # Opened with the first request, which rides on the SYN
+        self.connection = None
+        self.writers = deque()
+        self._server_address = server_address
+
+    def request(self, read_file_name, writer, connection="close", byte_range=None):
+        '''
+        Queues a GET whose response goes to writer; byte_range is an
+        inclusive (first, last) pair
+        '''
+        request = "GET /" + read_file_name + " HTTP/1.0\r\n"
+        request += f"Connection: {connection}\r\n"
+        if byte_range is not None:
+            request += f"Range: bytes={byte_range[0]}-{byte_range[1]}\r\n"
+        request += "\r\n"
+        self.writers.append(writer)
+        if self.connection is None:
+            self.connection = self.endpoint.open(self._server_address, request.encode())
+        else:
+            self.connection.send(request.encode())
+
+    def close(self):
+        self.connection.close()
+
+    def finished(self):
+        return self.connection.closed
 
-    server_ip_address = sys.argv[1]
-    server_udp_port_number = int(sys.argv[2])
-    client_buffer_size = int(sys.argv[3])
-    client_payload_length = int(sys.argv[4])
-    read_file_name = sys.argv[5]
-    write_file_name = sys.argv[6]
+    def receive(self):
+        '''
+        Process what arrived and what timed out, and feed the response
+        bytes to the writers
+        '''
+        self.endpoint.process()
+        response = self.connection.recv_nowait()
+        while response:
+            while response and self.writers:
+                response = self.writers[0].feed(response)
+                if self.writers[0].done:
+                    self.writers.popleft()
+            response = self.connection.recv_nowait()
+        if self.connection.peer_closed:
+            self.connection.close()
 
-    # Initialize UDP socket and bind to server IP address and port number
-    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+def split_ranges(first, total, parts):
+    '''
+    Splits the bytes from first to the end of the file into at most parts
+    inclusive (first, last) ranges of about the same size
+    '''
+    if first >= total:
+        return []
+    size = -(-(total - first) // parts)
+    return [(start, min(start + size, total) - 1) for start in range(first, total, size)]
 
-    rdp = RDP(client_buffer_size, client_payload_length, test=True)
+def main():
+    parser = argparse.ArgumentParser(description="SoR client: HTTP/1.0 over RDP", epilog="If there are multiple pairs of read_file_name and write_file_name in the command line, it indicates that the SoR client shall request these files from the SoR server in a persistent HTTP session over an RDP connection")
+    parser.add_argument("server_ip_address")
+    parser.add_argument("server_udp_port_number", type=int)
+    parser.add_argument("client_buffer_size", type=int)
+    parser.add_argument("client_payload_length", type=int)
+    parser.add_argument("files", nargs="+", metavar="read_file_name write_file_name")
+    parser.add_argument("--binary", action="store_true", help="offer the binary RDP header to the server")
+    parser.add_argument("--parallel", type=int, default=1, metavar="K", help="download one file as K byte ranges over K connections")
+    args = parser.parse_args()
+    if len(args.files) % 2:
+        parser.error("read_file_name and write_file_name must come in pairs")
+    if args.parallel < 1:
+        parser.error("--parallel must be at least 1")
+    if args.parallel > 1 and len(args.files) != 2:
+        parser.error("--parallel downloads exactly one file")
 
-    request = "GET /" + read_file_name + " HTTP/1.0\r\n"
-    request += "Connection: keep-alive\r\n"
+    server_address = (args.server_ip_address, args.server_udp_port_number)
+    client_buffer_size = args.client_buffer_size
+    client_payload_length = args.client_payload_length
+    file_names = list(zip(args.files[0::2], args.files[1::2]))
 
-    rdp.add_data(request)
-    rdp.send_packet()
+    def connect():
+        return Connection(server_address, client_buffer_size, client_payload_length, args.binary)
 
-    wrote = False
-    data = ""
-    p_length = 0
+    connections = [connect()]
+    # Every response expected, as (read_file_name, ResponseWriter)
+    writers = []
+    # Writer whose header tells the file size to split, in parallel mode
+    probe = None
+    if args.parallel == 1:
+        # Pipeline every request at once; the last one lets the server close
+        for i, (read_file_name, write_file_name) in enumerate(file_names):
+            connection = "keep-alive" if i < len(file_names) - 1 else "close"
+            writers.append((read_file_name, ResponseWriter(write_file_name)))
+            connections[0].request(read_file_name, writers[-1][1], connection)
+    else:
+        # The size is unknown until the first response, so the first
+        # connection starts with one buffer's worth and the rest of the file
+        # is split over all K connections once its header arrives
+        read_file_name, write_file_name = file_names[0]
+        probe = ResponseWriter(write_file_name)
+        writers.append((read_file_name, probe))
+        connections[0].request(read_file_name, probe, "keep-alive", (0, client_buffer_size - 1))
 
     while True:
-        readable, writable, exceptional = select.select([udp_sock], [udp_sock], [udp_sock], 0.1)
-
-        if rdp._state == State.CLOSED and rdp._fin_sent:
-            with open(write_file_name, "w") as f:
-                f.write(data)
-            sys.exit(0)
-
-        if udp_sock in readable:
-            message, client_address = udp_sock.recvfrom(client_buffer_size)
-            commands, seq_num, length, ack_num, window, payload = rdp.parse_packet(message)
-            log(commands, False, seq_num, length, ack_num, window)
-            # Close the connection if 400 or 404
-            if "400" in payload or "404" in payload:
-                sys.exit(1)
-            if("RST" in commands):
-                sys.exit(1)
-            response = rdp.receive_packet(message)
-            if response:
-                payload, length = process_response(payload)
-                # rdp.set_content_length(length)
-                # Set p_length to max of p_length and length
-                p_length = max(p_length, length)
-                # p_length = length
-                data += payload
-
-        if udp_sock in writable:
-            # Check for any timeouts
-            rdp.timeout()
-            packet = rdp.pop_queue()
-            if packet:
-                commands, seq_num, length, ack_num, window, payload = rdp.parse_packet(packet)
-                log(commands, True, seq_num, length, ack_num, window)
-                udp_sock.sendto(packet, (server_ip_address, server_udp_port_number))
-
-        if udp_sock in exceptional:
-            print("exceptional")
+        if probe is not None and (probe.total is not None or probe.failed):
+            ranges = split_ranges(client_buffer_size, probe.total, args.parallel) if probe.status() == "206" else []
+            if ranges:
+                writers.append((read_file_name, ResponseWriter(write_file_name, create=False)))
+                connections[0].request(read_file_name, writers[-1][1], "close", ranges[0])
+            else:
+                connections[0].close()
+            for byte_range in ranges[1:]:
+                connections.append(connect())
+                writers.append((read_file_name, ResponseWriter(write_file_name, create=False)))
+                connections[-1].request(read_file_name, writers[-1][1], "close", byte_range)
+            probe = None
+            continue
+
+        if all(connection.finished() for connection in connections):
+            for connection in connections:
+                for writer in connection.writers:
+                    writer.close()
+            # A failed or cut short response does not stop the others, but
+            # is reported here and makes the exit status non-zero
+            failed = [(name, writer) for name, writer in writers if writer.failed or not writer.done]
+            for name, writer in failed:
+                print(f"{name}: {writer.status() or 'no response'}", file=sys.stderr)
+            sys.exit(1 if failed else 0)
+
+        active = [connection for connection in connections if not connection.finished()]
+        timeouts = [t for t in (connection.endpoint.next_timeout() for connection in active) if t is not None]
+        select.select([connection.backend.fileno() for connection in active], [], [], min(timeouts, default=None))
+
+        for connection in active:
+            connection.receive()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,122 +1,420 @@
 # python3 sor-server.py server_ip_address server_udp_port_number server_buffer_size server_payload_length
+import os
 import sys
-import select
-import socket
-from rdp import RDP
+import time
+import signal
+import asyncio
+import argparse
+import threading
+import multiprocessing
 import re
-from datetime import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import accesslog, congestion
+from common.transport import Endpoint, UdpBackend
+
+LOG_TEMPLATE = "{time}: {client}:{port}: {request}; {response}"
+# Requests end with a blank line
+REQUEST_END = re.compile(rb"\r?\n\r?\n")
+# Unended request bytes beyond this are rejected instead of buffered forever
+MAX_REQUEST_BYTES = 8192
+STATUS = {
+    "200": "200 OK",
+    "206": "206 Partial Content",
+    "400": "400 Bad Request",
+    "404": "404 Not Found",
+    "416": "416 Range Not Satisfiable",
+}
+
+# Counters every worker keeps, added up by the parent process
+STATS = ("requests", "datagrams_received", "datagrams_sent", "bytes_sent", "retransmits", "malformed")
+
+access_log = None
+
+
+def split_requests(buffer):
+    '''
+    Splits the complete requests, each ended by a blank line, off the front of
+    buffer and returns them with the incomplete rest
+    '''
+    requests = []
+    match = REQUEST_END.search(buffer)
+    while match:
+        requests.append(decode_request(buffer[:match.start()]))
+        buffer = buffer[match.end():]
+        match = REQUEST_END.search(buffer)
+    return requests, buffer
+
+def decode_request(data):
+    '''
+    Decodes request bytes as UTF-8; bytes that are not become U+FFFD, which
+    process_request rejects
+    '''
+    return data.decode(errors="replace")
 
 def process_request(request, client_address):
     '''
-    Processes a HTTP request and returns a response
+    Processes a HTTP request and returns the response header, the open file
+    to send the body from (or None), the offset and length of the body in
+    that file and whether the connection stays open for more requests
     '''
-    # Get rid of empty line at start of request if it is there
-    request = request[2:] if request[:2] == "\r\n" else request
-    request = request[1:] if request[0] == "\n" else request
+    # Get rid of empty lines around the request if they are there
+    request = request.strip("\r\n")
 
-    request_pattern = r"^GET\s\/(.*)\sHTTP\/1.0((\r\n|\n)Connection:\s(keep-alive|close))?$"
+    request_pattern = r"^GET\s\/(.*)\sHTTP\/1.0((\r\n|\n)(Connection:\s(keep-alive|close)|Range:\sbytes=(\d*-\d*)))*$"
     response = ""
-    length = 0
     # Check for valid request
-    if not re.match(request_pattern, request):
-        response, length = create_response(400, "close")
+    if "\ufffd" in request or not re.match(request_pattern, request):
+        response = create_response(400, "close")
         log(request, response.splitlines()[0], client_address)
 
-        return response, length
+        return response, None, 0, 0, False
     lines = request.splitlines()
-    payload = ""
-    keep_alive = False
-    # Get rid of 1st line
-    for line in lines:
-        if line.startswith("GET"):
-            # Read the file in REGEX group 1
-            filename = re.search(request_pattern, request).group(1)
-            try:
-                with open(filename, "r") as f:
-                    payload = f.read()
-            except FileNotFoundError:
-                response, length = create_response("404", "close")
-                log(lines[0], response.splitlines()[0], client_address)
-
-                return response, length
-            break
-        if line.startswith("Connection"):
-            # Check if connection is closed
-            if re.search(request_pattern, request).group(4) == "keep-alive":
-                keep_alive = True
-
-    response, length = create_response("200", "keep-alive" if keep_alive else "close", payload)
+    # Read the file in REGEX group 1, keep the connection open if asked to
+    filename = re.match(request_pattern, lines[0]).group(1)
+    connection = re.search(r"Connection:\s(keep-alive|close)", request)
+    keep_alive = connection is not None and connection.group(1) == "keep-alive"
+    try:
+        body = open(filename, "rb")
+    except OSError:
+        # Missing, a directory or unreadable. The header still ends with a
+        # blank line, so a pipelining client can carry on with its next request
+        response = create_response("404", "keep-alive" if keep_alive else "close")
+        log(lines[0], response.splitlines()[0], client_address)
+
+        return response, None, 0, 0, keep_alive
+
+    size = os.fstat(body.fileno()).st_size
+    byte_range = re.search(r"Range:\sbytes=(\d*)-(\d*)", request)
+    if byte_range is None:
+        response = create_response("200", "keep-alive" if keep_alive else "close", size)
+        log(lines[0], response.splitlines()[0], client_address)
+
+        return response, body, 0, size, keep_alive
+
+    start, end = parse_range(byte_range.group(1), byte_range.group(2), size)
+    if start is None:
+        body.close()
+        response = create_response("416", "keep-alive" if keep_alive else "close", content_range=f"*/{size}")
+        log(lines[0], response.splitlines()[0], client_address)
+
+        return response, None, 0, 0, keep_alive
+
+    length = end - start + 1
+    response = create_response("206", "keep-alive" if keep_alive else "close", length, f"{start}-{end}/{size}")
     log(lines[0], response.splitlines()[0], client_address)
 
-    return response, length
+    return response, body, start, length, keep_alive
 
-def create_response(status_code, connection, payload=None):
+def parse_range(first, last, size):
     '''
-    Creates a HTTP response given a status code and payload
+    Resolves the bounds of a "bytes=first-last" range against the file size
+    and returns the first and last byte, or (None, None) if no byte of the
+    file is in the range
     '''
-    status = "200 OK" if status_code == "200" else "404 Not Found" if status_code == "404" else "400 Bad Request"
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # "-n" is the last n bytes
+        start = max(0, size - int(last))
+        end = size - 1
+    else:
+        return None, None
+    if start > end or start >= size:
+        return None, None
+    return start, end
+
+def create_response(status_code, connection, length=0, content_range=None):
+    '''
+    Creates the header of a HTTP response given a status code and body length
+    '''
+    status = STATUS.get(str(status_code), STATUS["400"])
     response = f"HTTP/1.0 {status}\r\n"
     response += f"Connection: {connection}\r\n"
-    length = len(payload) if payload else 0
-    if length:
-        response += f"Content-Length: {len(payload)}\r\n"
-        response += f"\r\n{payload}" if payload else "\r\n"
+    if content_range is not None:
+        response += f"Content-Range: bytes {content_range}\r\n"
+    if str(status_code) in ("200", "206"):
+        response += f"Content-Length: {length}\r\n"
+    # The blank line ends the header even without a body, so pipelined
+    # responses can be told apart
+    response += "\r\n"
 
-    return response, length
+    return response
 
 def log(request, response, client_address):
     '''
-    Logs the current time, client, request, and response to the console
+    Logs the current time, client, request, and response through the access log
     '''
-    now = datetime.now().strftime("%a %b %d %H:%M:%S PDT %Y")
-    print(f"{now}: {client_address[0]}:{client_address[1]}: {request}; {response}")
+    access_log.log(client=client_address[0], port=client_address[1], request=request, response=response)
 
-def main():
-    # Check for correct number of arguments
-    if len(sys.argv) != 5:
-        print("Usage: python3 sor-server.py server_ip_address server_udp_port_number server_buffer_size server_payload_length")
-        sys.exit(1)
+class WorkerStats:
+    '''
+    The counters of one worker: its own slice of an array shared with the
+    parent, so they are updated without locks and read without asking.
+
+    Parameters:
+        array (sequence): len(STATS) slots per worker.
+        index (int): Which worker's slots to update.
+    '''
 
-    # Parse arguments
-    server_ip_address = sys.argv[1]
-    server_udp_port_number = int(sys.argv[2])
-    server_buffer_size = int(sys.argv[3])
-    server_payload_length = int(sys.argv[4])
+    def __init__(self, array, index=0):
+        self._array = array
+        self._base = index * len(STATS)
 
-    # Initialize UDP socket and bind to server IP address and port number
-    udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_sock.bind((server_ip_address, server_udp_port_number))
+    def add(self, name, amount=1):
+        self._array[self._base + STATS.index(name)] += amount
 
-    # Key is the client address, value is an RDP instance
-    clients = {}
-    # Key is the client address, value is DAT to send
+    def update(self, counters):
+        '''
+        Set the counters of this worker that are kept elsewhere, e.g. by its
+        Endpoint, to their current totals
+        '''
+        for name, value in counters.items():
+            if name in STATS:
+                self._array[self._base + STATS.index(name)] = value
 
+def total_stats(array):
+    '''
+    Returns each counter summed over all workers
+    '''
+    return {name: sum(array[i::len(STATS)]) for i, name in enumerate(STATS)}
+
+def report_stats(array, workers, interval):
+    '''
+    Print the rates of the added up counters every interval seconds
+    '''
+    last, start = total_stats(array), time.monotonic()
     while True:
-        readable, writable, exceptional = select.select([udp_sock], [udp_sock], [udp_sock], 0.1)
-
-        if udp_sock in readable:
-            message, client_address = udp_sock.recvfrom(server_payload_length)
-            # print(f"Received {message} from {client_address}")
-            if client_address not in clients:
-                clients[client_address] = RDP(server_buffer_size, server_payload_length)
-            payload = clients[client_address].receive_packet(message)
-            if payload:
-                response, length = process_request(payload, client_address)
-                clients[client_address].add_data(response)
-                clients[client_address].set_content_length(length)
-
-        if udp_sock in writable:
-            for c in clients:
-                clients[c].timeout()
-                clients[c].send_packet(1)
-                packet = clients[c].pop_queue()
-                if packet:
-                    # print("Sending", packet)
-                    udp_sock.sendto(packet, c)
-
-        if udp_sock in exceptional:
-            pass
+        time.sleep(interval)
+        now, current = time.monotonic(), total_stats(array)
+        rates = {name: (current[name] - last[name]) / (now - start) for name in STATS}
+        last, start = current, now
+        print(f"stats: {workers} workers, {rates['requests']:.1f} requests/s, {rates['datagrams_received']:.0f} datagrams/s in, "
+              f"{rates['datagrams_sent']:.0f} datagrams/s out, {rates['bytes_sent'] / 1e6:.2f} MB/s", file=sys.stderr, flush=True)
+
+class ClientSession:
+    '''
+    The HTTP side of one client's connection: request bytes not yet ended
+    by a blank line, and whether the response that closes it is queued.
+
+    The RDP connection itself, its timer and its linger after closing are
+    the Endpoint's; a session only runs when datagrams for it arrive.
+    '''
+
+    def __init__(self, server, connection):
+        self._server = server
+        self._connection = connection
+        # Request bytes not yet ended by a blank line
+        self._pending = b""
+        self._closing = False
+
+    def receive(self):
+        connection = self._connection
+        payload = b"".join(iter(connection.recv_nowait, b""))
+        if payload and not self._closing:
+            requests, self._pending = split_requests(self._pending + payload)
+            if connection.peer_closed and self._pending.strip():
+                # The client closed without ending its last request
+                requests.append(decode_request(self._pending))
+            elif len(self._pending) > MAX_REQUEST_BYTES:
+                # Answered with 400, which closes the connection
+                self._pending = b""
+                requests.append("")
+            # Pipelined requests are answered in order, each response queued
+            # behind the previous one
+            for request in requests:
+                self.respond(request)
+                if self._closing:
+                    break
+        if connection.peer_closed and not self._closing:
+            self._closing = True
+            connection.close()
+
+    def respond(self, request):
+        connection = self._connection
+        response, body, offset, length, keep_alive = process_request(request, connection.address)
+        self._server.stats.add("requests")
+        connection.send(response.encode())
+        if body is not None:
+            connection.sendfile(body, offset, length)
+        if not keep_alive:
+            self._closing = True
+            connection.close()
+
+class SoRServer:
+    '''
+    Event loop front end of an Endpoint that serves every client.
+
+    Every readiness event has the endpoint drain the socket. All datagrams
+    of the batch go to their connections first, then each client session
+    that got any answers once, and the packets of all connections go out
+    together at the end. A single loop timer follows the endpoint's
+    earliest retransmission deadline.
+    '''
+
+    def __init__(self, buffer_size, payload_length, congestion_control="reno", sack=True, stats=None):
+        self.buffer_size = buffer_size
+        self.payload_length = payload_length
+        self.congestion_control = congestion_control
+        self.sack = sack
+        self.stats = stats if stats is not None else WorkerStats([0] * len(STATS))
+        self.endpoint = None
+        self._backend = None
+        self._timer = None
+        self._log_flush = None
+        self._writing = False
+
+    def start(self, backend):
+        '''
+        Serve the bound UdpBackend from the running event loop.
+        '''
+        self._backend = backend
+        # The server accepts the binary header whenever a client offers it
+        self.endpoint = Endpoint(backend, listening=True, window=self.buffer_size, payload_length=self.payload_length,
+                                 binary=True, congestion_control=self.congestion_control, sack=self.sack, handler=self._handle)
+        asyncio.get_running_loop().add_reader(backend.fileno(), self._process)
+
+    def stop(self):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self._backend.fileno())
+        if self._writing:
+            loop.remove_writer(self._backend.fileno())
+        if self._timer is not None:
+            self._timer.cancel()
+        self.endpoint.close()
+
+    def _handle(self, connection):
+        if connection.context is None:
+            connection.context = ClientSession(self, connection)
+        connection.context.receive()
+
+    def _process(self):
+        self.endpoint.process()
+        self.stats.update(self.endpoint.counters)
+        self._schedule()
+        if self._backend.pending() and not self._writing:
+            # The socket filled up; write the rest once it drains
+            self._writing = True
+            asyncio.get_running_loop().add_writer(self._backend.fileno(), self._write_ready)
+        self._poll_log()
+
+    def _schedule(self):
+        '''
+        Make the loop timer fire no later than the earliest retransmission
+        deadline. A timer that fires early just finds nothing due.
+        '''
+        delay = self.endpoint.next_timeout()
+        if delay is None:
+            return
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._timer is not None:
+            if self._timer.when() <= when:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_at(when, self._on_timeout)
+
+    def _on_timeout(self):
+        self._timer = None
+        self._process()
+
+    def _write_ready(self):
+        if self._backend.flush():
+            self._writing = False
+            asyncio.get_running_loop().remove_writer(self._backend.fileno())
+
+    def _poll_log(self):
+        access_log.poll()
+        delay = access_log.timeout()
+        if delay is not None and self._log_flush is None:
+            self._log_flush = asyncio.get_running_loop().call_later(delay, self._flush_log)
+
+    def _flush_log(self):
+        self._log_flush = None
+        self._poll_log()
+
+async def serve(server_ip_address, server_udp_port_number, server_buffer_size, server_payload_length, congestion_control="reno", sack=True, stats=None, reuse_port=False):
+    backend = UdpBackend((server_ip_address, server_udp_port_number), reuse_port)
+    server = SoRServer(server_buffer_size, server_payload_length, congestion_control, sack, stats)
+    server.start(backend)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+
+def stop(signum, frame):
+    sys.exit(0)
+
+def run_worker(args, stats, reuse_port=False):
+    '''
+    Serve until interrupted or terminated, in this process
+    '''
+    global access_log
+
+    signal.signal(signal.SIGTERM, stop)
+    access_log = accesslog.from_args(LOG_TEMPLATE, args)
+    try:
+        asyncio.run(serve(args.server_ip_address, args.server_udp_port_number, args.server_buffer_size, args.server_payload_length, args.congestion, args.sack, stats, reuse_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        access_log.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="SoR server: HTTP/1.0 over RDP")
+    parser.add_argument("server_ip_address")
+    parser.add_argument("server_udp_port_number", type=int)
+    parser.add_argument("server_buffer_size", type=int)
+    parser.add_argument("server_payload_length", type=int)
+    parser.add_argument("--congestion", choices=sorted(congestion.CONTROLLERS), default="reno", help="congestion control of the RDP sender (default: %(default)s)")
+    parser.add_argument("--no-sack", dest="sack", action="store_false", help="do not accept selective acknowledgements")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the port; the kernel hashes each client address to one of them (default: %(default)s)")
+    parser.add_argument("--stats", type=float, metavar="SECONDS", help="print request and datagram rates to stderr every SECONDS, and the totals on exit")
+    accesslog.add_arguments(parser)
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    # One slice of counters per worker
+    stats = multiprocessing.Array("q", args.workers * len(STATS), lock=False)
+    try:
+        if args.workers == 1:
+            if args.stats:
+                threading.Thread(target=report_stats, args=(stats, 1, args.stats), daemon=True).start()
+            run_worker(args, WorkerStats(stats))
+        else:
+            run_workers(args, stats)
+    finally:
+        if args.stats:
+            totals = total_stats(stats)
+            print("total: " + " ".join(f"{name}={totals[name]}" for name in STATS), file=sys.stderr, flush=True)
+
+def run_workers(args, stats):
+    '''
+    Fork one worker per --workers, each with its own SO_REUSEPORT socket on
+    the same address. The kernel picks the socket by hashing the client's
+    address and port, so all datagrams of one client, and with them its RDP
+    state machine, stay in one worker.
+    '''
+    workers = [multiprocessing.Process(target=run_worker, args=(args, WorkerStats(stats, i), True), name=f"worker-{i}")
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    # Threads are started after forking so no worker inherits them
+    if args.stats:
+        threading.Thread(target=report_stats, args=(stats, args.workers, args.stats), daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,110 @@
+'''
+Tests of the congestion window arithmetic of Reno and CUBIC.
+
+usage: python3 -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import congestion
+
+MSS = 1000
+
+class RenoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cc = congestion.create("reno", MSS)
+
+    def test_initial_window(self):
+        self.assertEqual(self.cc.cwnd, 4 * MSS)
+        self.assertEqual(congestion.Reno(1500).cwnd, 3 * 1500)
+        self.assertEqual(congestion.Reno(3000).cwnd, 2 * 3000)
+
+    def test_slow_start_grows_by_at_most_one_mss_per_ack(self):
+        self.cc.on_ack(MSS, 0.0, None)
+        self.assertEqual(self.cc.cwnd, 5 * MSS)
+        self.cc.on_ack(3 * MSS, 0.0, None)
+        self.assertEqual(self.cc.cwnd, 6 * MSS)
+
+    def test_congestion_avoidance_adds_one_mss_per_window(self):
+        self.cc.cwnd = self.cc.ssthresh = 10 * MSS
+        self.cc.on_ack(MSS, 0.0, 0.1)
+        self.assertAlmostEqual(self.cc.cwnd, 10 * MSS + MSS * MSS / (10 * MSS))
+        for _ in range(9):
+            self.cc.on_ack(MSS, 0.0, 0.1)
+        self.assertAlmostEqual(self.cc.cwnd, 11 * MSS, delta=0.1 * MSS)
+
+    def test_loss_halves_the_window(self):
+        self.cc.cwnd = 20 * MSS
+        self.cc.on_loss(20 * MSS, 0.0)
+        self.assertEqual(self.cc.cwnd, 10 * MSS)
+        self.assertEqual(self.cc.ssthresh, 10 * MSS)
+        self.cc.on_loss(MSS, 0.0)
+        self.assertEqual(self.cc.ssthresh, 2 * MSS)
+
+    def test_timeout_restarts_slow_start(self):
+        self.cc.cwnd = 20 * MSS
+        self.cc.on_timeout(16 * MSS, 0.0)
+        self.assertEqual(self.cc.cwnd, MSS)
+        self.assertEqual(self.cc.ssthresh, 8 * MSS)
+
+class CubicTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cc = congestion.create("cubic", MSS)
+        self.cc.cwnd = 100 * MSS
+        self.now = 0.0
+
+    def grow(self, until, rtt=0.1):
+        '''
+        Acknowledge a window per round trip up to time until and return
+        cwnd in segments
+        '''
+        while self.now < until - 1e-9:
+            for _ in range(int(self.cc.cwnd // MSS)):
+                self.cc.on_ack(MSS, self.now, 0.0)
+            self.now += rtt
+        return self.cc.cwnd / MSS
+
+    def test_loss_reduces_by_beta(self):
+        self.cc.on_loss(100 * MSS, 0.0)
+        self.assertAlmostEqual(self.cc.cwnd, 70 * MSS)
+        self.assertAlmostEqual(self.cc.ssthresh, 70 * MSS)
+
+    def test_fast_convergence(self):
+        self.cc.on_loss(100 * MSS, 0.0)
+        self.cc.cwnd = 80 * MSS
+        self.cc.on_loss(80 * MSS, 0.0)
+        # The second loss came below the first one's window
+        self.assertAlmostEqual(self.cc._w_max, 80 * (1 + congestion.Cubic.BETA) / 2)
+
+    def test_window_returns_to_w_max_after_k(self):
+        self.cc.on_loss(100 * MSS, 0.0)
+        # K = cbrt((W_max - cwnd) / C) = cbrt(30 / 0.4)
+        k = (30 / congestion.Cubic.C) ** (1 / 3)
+        self.assertLess(self.grow(2.0), 98)
+        self.assertAlmostEqual(self.grow(k), 100, delta=1)
+        # Past K the curve turns convex and probes for more
+        self.assertGreater(self.grow(8.0), 110)
+
+class ControllerTest(unittest.TestCase):
+
+    def test_unlimited_ignores_losses(self):
+        cc = congestion.create("none", MSS)
+        cc.on_loss(10 * MSS, 0.0)
+        cc.on_timeout(10 * MSS, 0.0)
+        self.assertEqual(cc.cwnd, float("inf"))
+
+    def test_unknown_name(self):
+        with self.assertRaises(ValueError):
+            congestion.create("vegas", MSS)
+
+    def test_base_class_is_abstract(self):
+        with self.assertRaises(TypeError):
+            congestion.CongestionControl(MSS)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+'''
+Tests of the LRU cache of sws.py static file responses.
+
+usage: python3 -m unittest discover tests
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "p1"))
+import filecache
+from filecache import FileCache
+
+class FileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def file(self, name, data):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_miss_then_hit(self):
+        path = self.file("a", b"body")
+        cache = FileCache(1024)
+        entry = cache.get(path)
+        self.assertEqual(entry.body, b"body")
+        self.assertIs(cache.get(path), entry)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertTrue(entry.headers["keep-alive"].startswith(b"HTTP/1.0 200 OK\r\nConnection: keep-alive\r\n"))
+
+    def test_evicts_least_recently_used(self):
+        a, b, c = (self.file(name, b"x" * 10) for name in "abc")
+        cache = FileCache(25)
+        cache.get(a)
+        cache.get(b)
+        # a is now the most recently used, so c pushes out b
+        cache.get(a)
+        cache.get(c)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["bytes"], 20)
+        hits = cache.hits
+        cache.get(a)
+        cache.get(b)
+        self.assertEqual(cache.hits, hits + 1)
+
+    def test_large_file_is_not_cached(self):
+        path = self.file("large", b"x" * 100)
+        cache = FileCache(1024, max_entry_bytes=50)
+        entry = cache.get(path)
+        self.assertIsNone(entry.body)
+        self.assertEqual(entry.size, 100)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_missing_file_and_directory(self):
+        cache = FileCache(1024)
+        self.assertIsNone(cache.get(os.path.join(self.dir.name, "missing")))
+        self.assertIsNone(cache.get(self.dir.name))
+
+    def test_changed_file_is_reloaded(self):
+        path = self.file("a", b"old")
+        cache = FileCache(1024)
+        cache.get(path)
+        self.file("a", b"newer")
+        # Within the interval the cached body is served without a stat
+        self.assertEqual(cache.get(path).body, b"old")
+        with mock.patch.object(filecache, "REVALIDATE_INTERVAL", 0.0):
+            self.assertEqual(cache.get(path).body, b"newer")
+        self.assertEqual(cache.stats()["bytes"], len(b"newer"))
+
+if __name__ == "__main__":
+    unittest.main()
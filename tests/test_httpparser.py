@@ -0,0 +1,66 @@
+'''
+Tests of the incremental HTTP/1.0 request parser of sws.py.
+
+usage: python3 -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "p1"))
+from httpparser import MAX_HEADER_BYTES, RequestParser
+
+class RequestParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = RequestParser()
+
+    def test_single_request(self):
+        [request] = self.parser.feed(b"GET /small.html HTTP/1.0\r\nConnection: keep-alive\r\n\r\n")
+        self.assertFalse(request.bad)
+        self.assertEqual(request.path, "small.html")
+        self.assertEqual(request.line, "GET /small.html HTTP/1.0")
+        self.assertTrue(request.keep_alive())
+
+    def test_root_is_index(self):
+        [request] = self.parser.feed(b"GET / HTTP/1.0\n\n")
+        self.assertEqual(request.path, "index.html")
+        self.assertFalse(request.keep_alive())
+
+    def test_split_one_byte_at_a_time(self):
+        data = b"GET /a HTTP/1.0\r\nConnection: Close\r\n\r\n"
+        requests = []
+        for i in range(len(data)):
+            requests += self.parser.feed(data[i:i + 1])
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0].path, "a")
+        self.assertEqual(requests[0].connection, "close")
+
+    def test_pipelined_requests(self):
+        requests = self.parser.feed(b"GET /a HTTP/1.0\n\nGET /b HTTP/1.0\r\n\r\nGET /c HTTP/1.0\r\n")
+        self.assertEqual([request.path for request in requests], ["a", "b"])
+        requests = self.parser.feed(b"\r\n")
+        self.assertEqual([request.path for request in requests], ["c"])
+
+    def test_blank_lines_between_requests_are_skipped(self):
+        requests = self.parser.feed(b"\r\n\r\nGET /a HTTP/1.0\r\n\r\n")
+        self.assertEqual([request.path for request in requests], ["a"])
+
+    def test_bad_request(self):
+        [request] = self.parser.feed(b"POST /a HTTP/1.0\r\n\r\n")
+        self.assertTrue(request.bad)
+        self.assertEqual(request.line, "POST /a HTTP/1.0")
+        [request] = self.parser.feed(b"GET /a HTTP/1.0\r\nHost: example\r\n\r\n")
+        self.assertTrue(request.bad)
+
+    def test_unended_header_is_bounded(self):
+        requests = self.parser.feed(b"GET /a HTTP/1.0\r\n" + b"x" * MAX_HEADER_BYTES)
+        self.assertEqual(len(requests), 1)
+        self.assertTrue(requests[0].bad)
+        # The parser starts afresh afterwards
+        [request] = self.parser.feed(b"GET /b HTTP/1.0\r\n\r\n")
+        self.assertEqual(request.path, "b")
+
+if __name__ == "__main__":
+    unittest.main()
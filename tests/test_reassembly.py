@@ -0,0 +1,81 @@
+'''
+Tests of the ring buffer that reassembles out-of-order RDP segments.
+
+usage: python3 -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport.rdp import RDP, ReceiveBuffer
+
+class ReceiveBufferTest(unittest.TestCase):
+
+    def test_gap_holds_data_back(self):
+        buffer = ReceiveBuffer(64)
+        buffer.add(10, b"world", 5)
+        self.assertEqual(buffer.pop(5), b"")
+        self.assertEqual(len(buffer), 5)
+        # The segment filling [5, 10) was delivered by the caller
+        self.assertEqual(buffer.pop(10), b"world")
+        self.assertEqual(len(buffer), 0)
+
+    def test_ranges_merge(self):
+        buffer = ReceiveBuffer(64)
+        buffer.add(20, b"cc", 0)
+        buffer.add(10, b"aa", 0)
+        buffer.add(12, b"bb", 0)
+        buffer.add(30, b"dd", 0)
+        self.assertEqual(buffer.ranges(), [(10, 14), (20, 22), (30, 32)])
+        buffer.add(13, b"xxxxxxx", 0)
+        self.assertEqual(buffer.ranges(), [(10, 22), (30, 32)])
+
+    def test_pop_returns_the_contiguous_run_only(self):
+        buffer = ReceiveBuffer(64)
+        buffer.add(4, b"efgh", 0)
+        buffer.add(8, b"ijkl", 0)
+        buffer.add(16, b"qrst", 0)
+        self.assertEqual(buffer.pop(4), b"efghijkl")
+        self.assertEqual(buffer.ranges(), [(16, 20)])
+
+    def test_wraps_around_the_ring(self):
+        buffer = ReceiveBuffer(8)
+        buffer.add(14, b"wxyz", 12)
+        self.assertEqual(buffer.pop(14), b"wxyz")
+
+    def test_data_past_the_window_is_dropped(self):
+        buffer = ReceiveBuffer(8)
+        buffer.add(4, b"abcdefgh", 0)
+        self.assertEqual(buffer.ranges(), [(4, 8)])
+        buffer.add(8, b"late", 0)
+        self.assertEqual(buffer.ranges(), [(4, 8)])
+
+    def test_ranges_already_delivered_are_dropped(self):
+        buffer = ReceiveBuffer(64)
+        buffer.add(10, b"abcd", 0)
+        buffer.add(20, b"efgh", 0)
+        self.assertEqual(buffer.pop(16), b"")
+        self.assertEqual(buffer.ranges(), [(20, 24)])
+        self.assertEqual(buffer.pop(12), b"")
+
+class ReorderTest(unittest.TestCase):
+
+    def test_rdp_delivers_reordered_segments_in_order(self):
+        sender = RDP(4096, 4)
+        receiver = RDP(4096, 4)
+        sender.add_data(b"abcdefghijkl")
+        sender.send_packet()
+        receiver.receive_packet(sender.pop_queue())
+        receiver.send_packet()
+        sender.receive_packet(receiver.pop_queue())
+        sender.send_packet()
+        packets = list(iter(sender.pop_queue, None))
+        self.assertEqual(len(packets), 2)
+        # The SYN carried "abcd"; "ijkl" overtakes "efgh"
+        self.assertIsNone(receiver.receive_packet(packets[1]))
+        self.assertEqual(receiver.receive_packet(packets[0]), b"efghijkl")
+
+if __name__ == "__main__":
+    unittest.main()
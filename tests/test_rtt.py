@@ -0,0 +1,104 @@
+'''
+Tests of the RFC 6298 round-trip time estimator and of Karn's rule in the
+RDP engine.
+
+usage: python3 -m unittest discover tests
+'''
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.rtt import RttEstimator
+from common.transport.rdp import RDP
+
+class RttEstimatorTest(unittest.TestCase):
+
+    def test_initial_rto(self):
+        estimator = RttEstimator(initial_rto=1.0)
+        self.assertIsNone(estimator.srtt)
+        self.assertEqual(estimator.rto, 1.0)
+
+    def test_first_sample(self):
+        estimator = RttEstimator()
+        estimator.sample(0.1)
+        self.assertAlmostEqual(estimator.srtt, 0.1)
+        self.assertAlmostEqual(estimator.rttvar, 0.05)
+        # SRTT + 4 * RTTVAR
+        self.assertAlmostEqual(estimator.rto, 0.3)
+
+    def test_later_sample(self):
+        estimator = RttEstimator()
+        estimator.sample(0.1)
+        estimator.sample(0.2)
+        # RTTVAR = 3/4 * 0.05 + 1/4 * |0.1 - 0.2|, SRTT = 7/8 * 0.1 + 1/8 * 0.2
+        self.assertAlmostEqual(estimator.rttvar, 0.0625)
+        self.assertAlmostEqual(estimator.srtt, 0.1125)
+        self.assertAlmostEqual(estimator.rto, 0.1125 + 4 * 0.0625)
+
+    def test_granularity_bounds_variance_term(self):
+        estimator = RttEstimator(min_rto=0.0, granularity=0.01)
+        for _ in range(100):
+            estimator.sample(0.05)
+        self.assertAlmostEqual(estimator.rto, 0.06)
+
+    def test_rto_is_clamped(self):
+        estimator = RttEstimator(min_rto=0.2, max_rto=1.0)
+        estimator.sample(0.001)
+        self.assertEqual(estimator.rto, 0.2)
+        estimator = RttEstimator(min_rto=0.2, max_rto=1.0)
+        estimator.sample(5.0)
+        self.assertEqual(estimator.rto, 1.0)
+
+    def test_backoff_doubles_up_to_cap(self):
+        estimator = RttEstimator(initial_rto=1.0, max_rto=3.0)
+        estimator.backoff()
+        self.assertEqual(estimator.rto, 2.0)
+        estimator.backoff()
+        estimator.backoff()
+        self.assertEqual(estimator.rto, 3.0)
+        self.assertEqual(estimator.backoffs, 3)
+
+    def test_sample_after_backoff_recomputes(self):
+        estimator = RttEstimator()
+        estimator.sample(0.1)
+        estimator.backoff()
+        self.assertAlmostEqual(estimator.rto, 0.6)
+        estimator.sample(0.1)
+        self.assertLess(estimator.rto, 0.6)
+
+class KarnTest(unittest.TestCase):
+    '''
+    The ACK of a retransmitted segment is ambiguous and gives no sample.
+    '''
+
+    def handshake(self, retransmit):
+        client = RDP(4096, 1024)
+        server = RDP(4096, 1024)
+        client.send_packet()
+        syn = client.pop_queue()
+        if retransmit:
+            with mock.patch.object(time, "monotonic", return_value=client.deadline() + 1):
+                client.timeout()
+            syn = client.pop_queue()
+        server.receive_packet(syn)
+        server.send_packet()
+        client.receive_packet(server.pop_queue())
+        return client
+
+    def test_ack_of_first_transmission_is_sampled(self):
+        client = self.handshake(retransmit=False)
+        self.assertIsNotNone(client.srtt())
+
+    def test_ack_of_retransmission_is_not_sampled(self):
+        client = self.handshake(retransmit=True)
+        self.assertEqual(client.counters["retransmits"], 1)
+        self.assertIsNone(client.srtt())
+        # The backed off RTO stays until a valid sample
+        self.assertEqual(client.rto(), 2.0)
+
+if __name__ == "__main__":
+    unittest.main()
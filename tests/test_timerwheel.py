@@ -0,0 +1,71 @@
+'''
+Tests of the hashed timing wheel that expires idle sws.py connections.
+
+usage: python3 -m unittest discover tests
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "p1"))
+from timerwheel import TimerWheel
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = TimerWheel(tick=1.0, slots=8, now=0.0)
+
+    def test_expires_at_deadline(self):
+        self.wheel.schedule("a", 3.0)
+        self.assertEqual(self.wheel.expire(2.5), [])
+        self.assertEqual(self.wheel.expire(3.0), ["a"])
+        self.assertNotIn("a", self.wheel)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_fires_at_most_one_tick_late(self):
+        self.wheel.schedule("a", 3.5)
+        self.assertEqual(self.wheel.expire(3.6), [])
+        self.assertEqual(self.wheel.expire(4.0), ["a"])
+
+    def test_later_deadline_is_kept(self):
+        self.wheel.schedule("a", 2.0)
+        self.wheel.schedule("a", 5.0)
+        self.assertEqual(self.wheel.expire(4.0), [])
+        self.assertIn("a", self.wheel)
+        self.assertEqual(self.wheel.expire(5.0), ["a"])
+
+    def test_earlier_deadline_moves_the_key(self):
+        self.wheel.schedule("a", 6.0)
+        self.wheel.schedule("a", 2.0)
+        self.assertEqual(self.wheel.expire(2.0), ["a"])
+        self.assertEqual(self.wheel.expire(7.0), [])
+
+    def test_cancel(self):
+        self.wheel.schedule("a", 2.0)
+        self.wheel.schedule("b", 2.0)
+        self.wheel.cancel("a")
+        self.wheel.cancel("missing")
+        self.assertEqual(self.wheel.expire(2.0), ["b"])
+
+    def test_deadline_beyond_one_turn(self):
+        # Shares a slot with tick 4 but must wait for the second turn
+        self.wheel.schedule("a", 12.0)
+        self.wheel.schedule("b", 4.0)
+        self.assertEqual(self.wheel.expire(4.0), ["b"])
+        self.assertEqual(self.wheel.expire(11.0), [])
+        self.assertEqual(self.wheel.expire(12.0), ["a"])
+
+    def test_long_sleep_expires_everything_due(self):
+        for i in range(20):
+            self.wheel.schedule(i, float(i))
+        self.assertEqual(sorted(self.wheel.expire(100.0)), list(range(20)))
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_next_timeout(self):
+        self.assertIsNone(self.wheel.next_timeout(0.0))
+        self.wheel.schedule("a", 5.0)
+        self.assertAlmostEqual(self.wheel.next_timeout(0.25), 0.75)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,288 @@
+'''
+Tests of common/transport over the in-process loopback network.
+
+usage: python3 -m unittest discover tests
+'''
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import CRLF_CODEC, TEXT_CODEC, LoopbackNetwork, connect, endpoint, listen
+from common.transport.rdp import decode_packet
+
+REQUEST = b"GET / HTTP/1.0\r\n\r\n"
+
+def read_all(connection):
+    data = b""
+    chunk = connection.recv()
+    while chunk:
+        data += chunk
+        chunk = connection.recv()
+    return data
+
+class LoopbackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = LoopbackNetwork()
+        self.server = listen(backend=self.network.backend())
+
+    def connect(self, **options):
+        return connect(self.server.address, backend=self.network.backend(), **options)
+
+    def exchange(self, client, body):
+        '''
+        Send a request from client, answer it with body from the server and
+        return the server's side of the connection and what the client read
+        '''
+        client.send(REQUEST)
+        accepted = self.server.accept(timeout=5)
+        self.assertEqual(accepted.recv(timeout=5), REQUEST)
+        accepted.send(body)
+        accepted.close()
+        received = read_all(client)
+        client.close()
+        client.wait_closed(timeout=5)
+        accepted.wait_closed(timeout=5)
+        return accepted, received
+
+class TransferTest(LoopbackTest):
+
+    def test_transfer(self):
+        body = os.urandom(300 * 1024)
+        _, received = self.exchange(self.connect(), body)
+        self.assertEqual(received, body)
+
+    def test_transfer_text_header(self):
+        body = os.urandom(20 * 1024)
+        client = self.connect(binary=False)
+        _, received = self.exchange(client, body)
+        self.assertEqual(received, body)
+        self.assertFalse(client.rdp.is_binary())
+
+    def test_transfer_crlf_header(self):
+        body = os.urandom(20 * 1024)
+        server = listen(backend=self.network.backend(), binary=False, text_codec=CRLF_CODEC)
+        client = connect(server.address, backend=self.network.backend(), binary=False, text_codec=CRLF_CODEC)
+        packet = client.rdp.create_packet(["DAT"], seq_num=1, ack_num=1, window=1024, payload=b"x")
+        self.assertTrue(packet.startswith(b"DAT\r\nSequence: 1\r\n"))
+        client.send(REQUEST)
+        accepted = server.accept(timeout=5)
+        self.assertEqual(accepted.recv(timeout=5), REQUEST)
+        accepted.send(body)
+        accepted.close()
+        self.assertEqual(read_all(client), body)
+
+    def test_sendfile(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "p3", "1mb.txt")
+        client = self.connect()
+        client.send(REQUEST)
+        accepted = self.server.accept(timeout=5)
+        accepted.recv(timeout=5)
+        with open(path, "rb") as f:
+            expected = f.read()
+        # The file is closed by the connection once it has been sent
+        accepted.sendfile(open(path, "rb"))
+        accepted.close()
+        self.assertEqual(read_all(client), expected)
+
+class WindowTest(LoopbackTest):
+
+    def test_syn_ack_fits_window_advertised_on_syn(self):
+        body = os.urandom(20 * 1024)
+        client = self.connect(window=700)
+        _, received = self.exchange(client, body)
+        self.assertEqual(received, body)
+        self.assertEqual(client.rdp.counters["aborts"], 0)
+
+    def test_segment_larger_than_window_resets(self):
+        server = listen(backend=self.network.backend(), window=512, binary=False)
+        peer = self.network.backend()
+        packet = TEXT_CODEC.encode(["SYN", "DAT"], 0, -1, 65536, b"x" * 1024)
+        peer.sendto(packet, server.address)
+        server.process()
+        self.assertTrue(server._connections[peer.address].closed)
+        self.assertIsNone(server.next_timeout())
+        self.assertIn("RST", decode_packet(peer.recv_batch()[-1][0])[0])
+
+class LossTest(LoopbackTest):
+
+    def drop_first(self, backend, seq_num):
+        '''
+        Make backend lose the first DAT packet it sends with seq_num
+        '''
+        sendto = backend.sendto
+
+        def lossy_sendto(data, address):
+            commands, seq, _, _, _, _, _ = decode_packet(data)
+            if "DAT" in commands and seq == seq_num and not dropped:
+                dropped.append(seq)
+                return
+            sendto(data, address)
+
+        dropped = []
+        backend.sendto = lossy_sendto
+
+    def test_fast_retransmit_without_sack(self):
+        backend = self.network.backend()
+        self.server = listen(backend=backend, sack=False)
+        client = self.connect(sack=False)
+        # The fifth segment of the body, with segments after it in flight
+        self.drop_first(backend, 1 + 4 * 1024)
+        body = os.urandom(100 * 1024)
+        accepted, received = self.exchange(client, body)
+        self.assertEqual(received, body)
+        self.assertFalse(accepted.rdp.is_sack())
+        self.assertEqual(accepted.rdp.counters["retransmits"], 1)
+        self.assertEqual(accepted.rdp.counters["fast_retransmits"], 1)
+        self.assertEqual(accepted.rdp.counters["timeouts"], 0)
+
+class HandlerTest(unittest.TestCase):
+
+    def test_handler_answers_each_connection(self):
+        network = LoopbackNetwork()
+
+        def handle(connection):
+            request = connection.recv_nowait()
+            if request:
+                connection.send(request.upper())
+                connection.close()
+
+        server = endpoint.Endpoint(network.backend(), listening=True, handler=handle)
+        clients = [connect(server.address, backend=network.backend()) for _ in range(3)]
+        for i, client in enumerate(clients):
+            client.send(b"request %d" % i)
+        for i, client in enumerate(clients):
+            self.assertEqual(read_all(client), b"REQUEST %d" % i)
+            client.close()
+            client.wait_closed(timeout=5)
+        with self.assertRaises(TimeoutError):
+            server.accept(timeout=0.05)
+
+    def test_failing_handler_resets_only_its_connection(self):
+        network = LoopbackNetwork()
+
+        def handle(connection):
+            request = connection.recv_nowait()
+            if request == b"fail":
+                raise RuntimeError("handler failed")
+            if request:
+                connection.send(request.upper())
+                connection.close()
+
+        server = endpoint.Endpoint(network.backend(), listening=True, handler=handle)
+        failing = connect(server.address, backend=network.backend())
+        working = connect(server.address, backend=network.backend())
+        failing.send(b"fail")
+        working.send(b"work")
+        with mock.patch("traceback.print_exc"):
+            self.assertEqual(read_all(working), b"WORK")
+        failing.wait_closed(timeout=5)
+        self.assertEqual(server.counters["handler_errors"], 1)
+
+class CloseTest(LoopbackTest):
+
+    def test_closed_connection_lingers(self):
+        backend = self.network.backend()
+        client = connect(self.server.address, backend=backend)
+        accepted, _ = self.exchange(client, b"body")
+        self.assertTrue(client.closed)
+        self.assertTrue(accepted.closed)
+        # Kept for a retransmitted FIN, but no longer scanned for timers
+        self.assertIsNone(self.server.next_timeout())
+        self.assertIs(self.server._connections[backend.address], accepted)
+
+    def test_closed_connection_is_forgotten(self):
+        backend = self.network.backend()
+        client = connect(self.server.address, backend=backend)
+        with mock.patch.object(endpoint, "CLOSE_LINGER", 0.0):
+            self.exchange(client, b"body")
+            self.server.process()
+        self.assertNotIn(backend.address, self.server._connections)
+
+    def test_vanished_peer_is_reset(self):
+        backend = self.network.backend()
+        client = connect(self.server.address, backend=backend)
+        client.send(REQUEST)
+        accepted = self.server.accept(timeout=5)
+        accepted.recv(timeout=5)
+        # Keep the backoff short so the test does not wait out minutes of it
+        accepted.rdp._rtt.min_rto = accepted.rdp._rtt.max_rto = 0.001
+        backend.close()
+        accepted.send(b"nobody reads this")
+        accepted.wait_closed(timeout=5)
+        self.assertEqual(accepted.rdp.counters["aborts"], 1)
+        self.assertIsNone(self.server.next_timeout())
+
+    def test_syn_reopens_closed_connection(self):
+        backend = self.network.backend()
+        first = connect(self.server.address, backend=backend)
+        accepted, _ = self.exchange(first, b"first")
+        backend.endpoint.close()
+        # A new connection from the same address while the old one lingers
+        backend = self.network.backend(backend.address)
+        second = connect(self.server.address, backend=backend)
+        reopened, received = self.exchange(second, b"second")
+        self.assertIsNot(reopened, accepted)
+        self.assertEqual(received, b"second")
+
+class StrayDatagramTest(LoopbackTest):
+
+    def test_junk_is_dropped(self):
+        stray = self.network.backend()
+        for data in (b"junk", b"", bytes([0xB5, 1, 2]), b"DAT|ACK\nSequence: x\n"):
+            stray.sendto(data, self.server.address)
+        self.server.process()
+        self.assertEqual(self.server.counters["malformed"], 4)
+        self.assertEqual(self.server._connections, {})
+        with self.assertRaises(TimeoutError):
+            self.server.accept(timeout=0.05)
+
+    def test_non_syn_does_not_open_connection(self):
+        stray = self.network.backend()
+        client = self.connect()
+        packet = client.rdp.create_packet(["ACK"], seq_num=1, ack_num=1, window=1024)
+        stray.sendto(packet, self.server.address)
+        self.server.process()
+        self.assertNotIn(stray.address, self.server._connections)
+
+    def test_junk_does_not_disturb_a_transfer(self):
+        stray = self.network.backend()
+        client = self.connect()
+        stray.sendto(b"junk", self.server.address)
+        body = os.urandom(50 * 1024)
+        _, received = self.exchange(client, body)
+        self.assertEqual(received, body)
+        self.assertEqual(self.server.counters["malformed"], 1)
+
+class EchoTest(unittest.TestCase):
+    '''
+    p2/rdp.py sends to its own address through the echo server, so its
+    packets come back as the peer's. Opening a connection to the endpoint's
+    own loopback address does the same without an echo server.
+    '''
+
+    def test_self_connection_transfer(self):
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "p2"))
+        import rdp
+        network = LoopbackNetwork()
+        backend = network.backend()
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "p2", "inputs", "small.html")
+        with tempfile.TemporaryDirectory() as out_dir:
+            out = os.path.join(out_dir, "out")
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                connection = rdp.transfer(backend, backend.address, path, out, window=4096)
+            with open(path, "rb") as f, open(out, "rb") as g:
+                self.assertEqual(g.read(), f.read())
+        self.assertTrue(connection.closed)
+        self.assertIn("Send; SYN; Sequence: 0; Length: 0", log.getvalue())
+        self.assertIn("Receive; SYN; Sequence: 0; Length: 0", log.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()